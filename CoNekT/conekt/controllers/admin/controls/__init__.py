@@ -12,11 +12,12 @@ from .expression_profiles import add_expression_profiles
 from .expression_specificity import add_condition_specificity, add_tissue_specificity
 from .families import add_family
 from .ftp import export_ftp
+from .full_text import reindex_full_text
 from .functional_data import add_functional_data, add_go, add_interpro, calculate_enrichment, delete_enrichment
 from .sequences import add_descriptions
 from .species import add_species
 from .trees import add_trees
-from .whooshee import reindex_whooshee
+from .whooshee import reindex_whooshee, whooshee_health
 from .xrefs import add_xrefs, add_xrefs_family
 from .ontology import add_ontology
 
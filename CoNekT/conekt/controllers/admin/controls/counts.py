@@ -3,10 +3,11 @@ from conekt.extensions import admin_required
 from werkzeug.utils import redirect
 
 from conekt.controllers.admin.controls import admin_controls
-from conekt.models.expression.coexpression_clusters import CoexpressionClusteringMethod
+from conekt.models.expression.coexpression_clusters import CoexpressionClusteringMethod, CoexpressionCluster
 from conekt.models.expression.networks import ExpressionNetworkMethod
 from conekt.models.gene_families import GeneFamilyMethod
 from conekt.models.go import GO
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.species import Species
 
 
@@ -26,6 +27,14 @@ def update_counts():
     else:
         flash('CoexpressionClusteringMethod count updated', 'success')
 
+    try:
+        CoexpressionCluster.update_summaries()
+    except Exception as e:
+        print("ERROR:", e)
+        flash('An error occurred while re-doing CoexpressionCluster summaries', 'danger')
+    else:
+        flash('CoexpressionCluster summaries updated', 'success')
+
     try:
         ExpressionNetworkMethod.update_count()
     except Exception as e:
@@ -58,4 +67,20 @@ def update_counts():
     else:
         flash('GO count updated', 'success')
 
+    try:
+        SpeciesAnnotationCount.update_counts(annotation_types=('interpro', 'cazyme', 'family'))
+    except Exception as e:
+        print("ERROR:", e)
+        flash('An error occurred while re-doing InterPro, CAZyme and family species counts', 'danger')
+    else:
+        flash('InterPro, CAZyme and family species counts updated', 'success')
+
+    try:
+        GO.update_closure()
+    except Exception as e:
+        print("ERROR:", e)
+        flash('An error occurred while re-doing the GO closure', 'danger')
+    else:
+        flash('GO closure updated', 'success')
+
     return redirect(url_for('admin.index'))
\ No newline at end of file
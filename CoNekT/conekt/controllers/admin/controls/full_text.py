@@ -0,0 +1,25 @@
+from flask import flash, url_for
+from conekt.extensions import admin_required
+from werkzeug.utils import redirect
+
+from conekt.models.full_text import FullTextIndex
+from conekt.controllers.admin.controls import admin_controls
+
+
+@admin_controls.route('/reindex/full_text')
+@admin_required
+def reindex_full_text():
+    """
+    Touching this endpoint creates missing full-text indexes and rebuilds them
+
+    :return: Redirect to admin controls
+    """
+    try:
+        FullTextIndex.rebuild()
+    except Exception as e:
+        print("ERROR:", e)
+        flash('An error occurred while rebuilding the full-text index', 'danger')
+    else:
+        flash('Full-text index rebuilt', 'success')
+
+    return redirect(url_for('admin.controls.index'))
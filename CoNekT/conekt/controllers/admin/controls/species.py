@@ -1,7 +1,7 @@
 import os
 from tempfile import mkstemp
 
-from flask import request, flash, url_for
+from flask import request, flash, url_for, current_app
 from conekt.extensions import admin_required
 from werkzeug.exceptions import abort
 from werkzeug.utils import redirect
@@ -62,7 +62,8 @@ def add_species():
         with open(temp_path, 'wb') as fasta_writer:
             fasta_writer.write(fasta_data_cds)
 
-        sequence_count_cds = Sequence.add_from_fasta(temp_path, species_id, compressed=compressed_cds)
+        sequence_count_cds = Sequence.add_from_fasta(temp_path, species_id, compressed=compressed_cds,
+                                                      packed=current_app.config.get('PACK_SEQUENCES', False))
 
         os.close(fd)
         os.remove(temp_path)
@@ -76,7 +77,8 @@ def add_species():
             fasta_writer.write(fasta_data_rna)
 
         sequence_count_rna = Sequence.add_from_fasta(temp_path, species_id, compressed=compressed_rna,
-                                                      sequence_type='RNA')
+                                                      sequence_type='RNA',
+                                                      packed=current_app.config.get('PACK_SEQUENCES', False))
         
         os.close(fd)
         os.remove(temp_path)
@@ -1,10 +1,12 @@
-from flask import flash, url_for
+from flask import flash, url_for, Response
 from conekt.extensions import admin_required
 from werkzeug.utils import redirect
 
 from conekt import whooshee
 from conekt.controllers.admin.controls import admin_controls
 
+import json
+
 
 @admin_controls.route('/reindex/whooshee')
 @admin_required
@@ -15,10 +17,24 @@ def reindex_whooshee():
     :return: Redirect to admin controls
     """
     try:
-        whooshee.reindex()
+        whooshee.rebuild()
     except Exception as e:
         flash('An error occurred while reindexing whooshee', 'danger')
     else:
         flash('Whooshee index rebuilt', 'success')
 
-    return redirect(url_for('admin.controls.index'))
\ No newline at end of file
+    return redirect(url_for('admin.controls.index'))
+
+
+@admin_controls.route('/health/whooshee')
+@admin_required
+def whooshee_health():
+    """
+    Reports for each Whooshee index the number of documents and rows in the database and the highest indexed ID.
+
+    :return: JSON with the status per index, status code 503 if any index is out of date
+    """
+    status = whooshee.health()
+
+    return Response(json.dumps(status), mimetype='application/json',
+                    status=200 if all([s['healthy'] for s in status]) else 503)
@@ -1,8 +1,8 @@
 from flask import Blueprint, current_app, Response, redirect, url_for, request, render_template, flash
-from sqlalchemy.sql.expression import func
+from sqlalchemy.sql.expression import func, or_
 
 from conekt import blast_thread
-from conekt.models.sequences import Sequence
+from conekt.models.sequences import Sequence, PackedSequence
 from conekt.forms.blast import BlastForm
 
 import os
@@ -45,8 +45,8 @@ def blast_main():
         flash(form.errors, 'danger')
 
     # select example from the database
-    sequence = Sequence.query.filter(Sequence.type == 'protein_coding')\
-        .filter(func.length(Sequence.coding_sequence) > 300).first()
+    sequence = Sequence.query.outerjoin(PackedSequence).filter(Sequence.type == 'protein_coding')\
+        .filter(or_(func.length(Sequence.coding_sequence) > 300, PackedSequence.length > 300)).first()
 
     example = {
         'blast_type': 'blastp',
@@ -60,7 +60,9 @@ def clade_families(clade_id, page=1):
                                                                          g.page_items,
                                                                          False).items
 
-    return render_template('pagination/families.html', families=families)
+    annotations = GeneFamily.get_annotations([f.id for f in families])
+
+    return render_template('pagination/families.html', families=families, annotations=annotations)
 
 
 @clade.route('/families/table/<int:clade_id>')
@@ -4,8 +4,9 @@ from flask import Blueprint, request, render_template, Response, Markup
 
 from conekt.forms.custom_network import CustomNetworkForm
 from conekt.helpers.cytoscape import CytoscapeHelper
+from conekt.helpers.gene_lists import flash_resolved_genes
 from conekt.models.expression.networks import ExpressionNetwork, ExpressionNetworkMethod
-from conekt.models.sequences import Sequence
+from conekt.models.gene_resolver import GeneResolver
 
 custom_network = Blueprint('custom_network', __name__)
 
@@ -26,19 +27,12 @@ def custom_network_main():
         cluster_method_id = request.form.get('cluster_method')
         specificity_method_id = request.form.get('specificity_method')
 
-        probes = terms
-
-        # also do search by gene ID
-        sequences = Sequence.query.filter(Sequence.name.in_(terms)).all()
-
-        for s in sequences:
-            for ep in s.expression_profiles:
-                probes.append(ep.probe)
+        network_method = ExpressionNetworkMethod.query.get_or_404(method_id)
 
-        # make probe list unique
-        probes = list(set(probes))
+        # also do search by gene ID and aliases
+        probes, resolved = GeneResolver.get_probes(terms, species_id=network_method.species_id)
+        flash_resolved_genes(resolved)
 
-        network_method = ExpressionNetworkMethod.query.get_or_404(method_id)
         network = ExpressionNetwork.get_custom_network(method_id, probes)
 
         network_cytoscape = CytoscapeHelper.parse_network(network)
@@ -115,17 +109,10 @@ def custom_network_json():
     cluster_method_id = request.form.get('cluster_method')
     specificity_method_id = request.form.get('specificity_method')
 
-    probes = terms
-
-    # also do search by gene ID
-    sequences = Sequence.query.filter(Sequence.name.in_(terms)).all()
-
-    for s in sequences:
-        for ep in s.expression_profiles:
-            probes.append(ep.probe)
+    network_method = ExpressionNetworkMethod.query.get(method_id)
 
-    # make probe list unique
-    probes = list(set(probes))
+    # also do search by gene ID and aliases
+    probes, _ = GeneResolver.get_probes(terms, species_id=network_method.species_id if network_method else None)
 
     network = ExpressionNetwork.get_custom_network(method_id, probes)
 
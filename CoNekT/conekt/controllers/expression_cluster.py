@@ -1,6 +1,6 @@
 import json
 
-from flask import Blueprint, render_template, g, Response
+from flask import Blueprint, render_template, g, Response, make_response
 from sqlalchemy import or_
 
 from conekt import cache
@@ -8,7 +8,6 @@ from conekt.helpers.cytoscape import CytoscapeHelper
 from conekt.models.expression.coexpression_clusters import CoexpressionCluster, CoexpressionClusteringMethod
 from conekt.models.relationships.cluster_similarity import CoexpressionClusterSimilarity
 from conekt.models.relationships.sequence_cluster import SequenceCoexpressionClusterAssociation
-from conekt.models.sequences import Sequence
 from conekt.models.gene_families import GeneFamilyMethod
 
 from conekt.helpers.chartjs import prepare_avg_profiles
@@ -36,7 +35,7 @@ def expression_cluster_view(cluster_id):
     """
     cluster = CoexpressionCluster.query.get_or_404(cluster_id)
 
-    sequence_count = len(cluster.sequences.with_entities(Sequence.id).all())
+    sequence_count = cluster.sequence_count
     go_enrichment = cluster.go_enrichment.order_by('corrected_p_value').all()
     similar_clusters = CoexpressionClusterSimilarity.query.filter(or_(
         CoexpressionClusterSimilarity.source_id == cluster_id,
@@ -156,13 +155,63 @@ def expression_cluster_json(cluster_id, family_method_id=None):
 def avg_profile(cluster_id):
     current_cluster = CoexpressionCluster.query.get(cluster_id)
 
-    profiles = current_cluster.profiles
-
-    avg_profile = prepare_avg_profiles(profiles, ylabel='TPM (normalized)')
+    avg_profile = prepare_avg_profiles(current_cluster.profile_summary, ylabel='TPM (normalized)')
 
     return Response(json.dumps(avg_profile), mimetype='application/json')
 
 
+@expression_cluster.route('/json/profile/<cluster_id>')
+@cache.cached()
+def cluster_profile_json(cluster_id):
+    """
+    Returns the average profile (mean, median and standard deviation of the normalized member profiles) and the
+    eigengene of a cluster
+
+    :param cluster_id: internal ID of the cluster
+    """
+    current_cluster = CoexpressionCluster.query.get_or_404(cluster_id)
+
+    output = {"id": current_cluster.id,
+              "name": current_cluster.name,
+              "method_id": current_cluster.method_id,
+              "sequence_count": current_cluster.sequence_count,
+              "profile": current_cluster.profile_summary}
+
+    return Response(json.dumps(output), mimetype='application/json')
+
+
+@expression_cluster.route('/download/profiles/<method_id>')
+def cluster_profiles_download(method_id):
+    """
+    Generates a tab-delimited file with the mean, median, standard deviation and eigengene of all clusters from a
+    clustering method
+
+    :param method_id: internal ID of the clustering method
+    """
+    method = CoexpressionClusteringMethod.query.get_or_404(method_id)
+    summaries = CoexpressionCluster.get_profile_summaries(method.id)
+
+    order = next((summary["order"] for _, summary in summaries if summary is not None), [])
+
+    output = ["\t".join(["cluster", "value"] + order)]
+
+    for cluster, summary in summaries:
+        if summary is None:
+            continue
+
+        for value in ["mean", "median", "stdev", "eigengene"]:
+            if value in summary.keys():
+                values = dict(zip(summary["order"], summary[value]))
+                output.append("\t".join([cluster.name, value] +
+                                        [str(values[o]) if values.get(o) is not None else "" for o in order]))
+
+    response = make_response("\n".join(output))
+    response.headers["Content-Disposition"] = "attachment; filename=cluster_profiles_" + str(method.id) + ".tsv"
+    response.headers['Content-type'] = 'text/plain'
+
+    return response
+
+
 @expression_cluster.route('/tooltip/<cluster_id>')
 @cache.cached()
 def cluster_tooltip(cluster_id):
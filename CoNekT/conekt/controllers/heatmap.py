@@ -5,12 +5,13 @@ import json
 from conekt import cache
 from conekt.forms.heatmap import HeatmapForm, HeatmapComparableForm, HeatmapPOForm, HeatmapPECOForm
 from conekt.models.expression.coexpression_clusters import CoexpressionCluster
+from conekt.helpers.gene_lists import flash_resolved_genes
 from conekt.models.expression.profiles import ExpressionProfile
+from conekt.models.gene_resolver import GeneResolver
 from conekt.models.condition_tissue import ConditionTissue
 from conekt.models.relationships.sequence_cluster import SequenceCoexpressionClusterAssociation
 from conekt.models.relationships.sample_po import SamplePOAssociation
 from conekt.models.relationships.sample_peco import SamplePECOAssociation
-from conekt.models.sequences import Sequence
 from conekt.models.trees import Tree
 from conekt.models.gene_families import GeneFamily
 from conekt.models.expression.cross_species_profile import CrossSpeciesExpressionProfile
@@ -142,16 +143,9 @@ def heatmap_custom_default():
         flash("No genes selected!", "warning")
         return redirect(url_for('heatmap.heatmap_main'))
 
-    # also do search by gene ID
-    sequences = Sequence.query.filter(Sequence.name.in_(probes)).all()
-
-    for s in sequences:
-        for ep in s.expression_profiles:
-            probes.append(ep.probe)
-
-    # make probe list unique
-    probes = list(set(probes))
-    # TODO check if certain probes were not found and warn the user
+    # also do search by gene ID and aliases
+    probes, resolved = GeneResolver.get_probes(probes, species_id=species_id)
+    flash_resolved_genes(resolved)
     current_heatmap = ExpressionProfile.get_heatmap(species_id, probes,
                                                     zlog=(option == 'zlog'),
                                                     raw=(option == 'raw'))
@@ -175,8 +169,10 @@ def heatmap_custom_comparable():
         flash("No genes selected!", "warning")
         return redirect(url_for('heatmap.heatmap_main'))
 
-    sequences = Sequence.query.filter(Sequence.name.in_(terms)).all()
-    sequence_ids = [s.id for s in sequences]
+    resolved = GeneResolver.resolve(terms)
+    flash_resolved_genes(resolved)
+
+    sequence_ids = list(resolved['matched'].values()) + [i for ids in resolved['ambiguous'].values() for i in ids]
 
     current_heatmap = CrossSpeciesExpressionProfile().get_heatmap(*sequence_ids, option=option)
 
@@ -206,16 +202,9 @@ def heatmap_custom_pos():
         flash("No genes selected!", "warning")
         return redirect(url_for('heatmap.heatmap_main'))
 
-    # also do search by gene ID
-    sequences = Sequence.query.filter(Sequence.name.in_(probes)).all()
-
-    for s in sequences:
-        for ep in s.expression_profiles:
-            probes.append(ep.probe)
-
-    # make probe list unique
-    probes = list(set(probes))
-    # TODO check if certain probes were not found and warn the user
+    # also do search by gene ID and aliases
+    probes, resolved = GeneResolver.get_probes(probes, species_id=species_id)
+    flash_resolved_genes(resolved)
 
     current_heatmap = ExpressionProfile.get_po_heatmap(species_id, probes, pos,
                                                     zlog=(option == 'zlog'),
@@ -247,16 +236,9 @@ def heatmap_custom_pecos():
         flash("No genes selected!", "warning")
         return redirect(url_for('heatmap.heatmap_main'))
 
-    # also do search by gene ID
-    sequences = Sequence.query.filter(Sequence.name.in_(probes)).all()
-
-    for s in sequences:
-        for ep in s.expression_profiles:
-            probes.append(ep.probe)
-
-    # make probe list unique
-    probes = list(set(probes))
-    # TODO check if certain probes were not found and warn the user
+    # also do search by gene ID and aliases
+    probes, resolved = GeneResolver.get_probes(probes, species_id=species_id)
+    flash_resolved_genes(resolved)
 
     current_heatmap = ExpressionProfile.get_peco_heatmap(species_id, probes, pecos,
                                                     zlog=(option == 'zlog'),
@@ -8,11 +8,12 @@ from sqlalchemy.orm import noload
 from conekt import cache
 from conekt.forms.profile_comparison import ProfileComparisonForm
 from conekt.helpers.chartjs import prepare_profiles, prepare_profiles_download
+from conekt.helpers.gene_lists import flash_resolved_genes
 from conekt.models.expression.coexpression_clusters import CoexpressionCluster
 from conekt.models.expression.profiles import ExpressionProfile
+from conekt.models.gene_resolver import GeneResolver
 from conekt.models.relationships.sequence_cluster import SequenceCoexpressionClusterAssociation
 from conekt.models.relationships.sample_literature import SampleLitAssociation
-from conekt.models.sequences import Sequence
 from conekt.models.ontologies import PlantOntology
 from conekt.models.literature import LiteratureItem
 
@@ -75,17 +76,9 @@ def profile_comparison_main():
         literature_id = request.form.get('literature_id')
         normalize = True if request.form.get('normalize') == 'y' else False
 
-        probes = terms
-
-        # also do search by gene ID
-        sequences = Sequence.query.filter(Sequence.name.in_(terms)).all()
-
-        for s in sequences:
-            for ep in s.expression_profiles:
-                probes.append(ep.probe)
-
-        # make probe list unique
-        probes = list(set(probes))
+        # also do search by gene ID and aliases
+        probes, resolved = GeneResolver.get_probes(terms, species_id=species_id)
+        flash_resolved_genes(resolved)
 
         # get max 51 profiles, only show the first 50 (the extra one is fetched to throw the warning)
         profiles = ExpressionProfile.get_profiles(species_id, probes, limit=51)
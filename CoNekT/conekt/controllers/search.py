@@ -15,6 +15,8 @@ from conekt.models.interpro import Interpro
 from conekt.models.go import GO
 from conekt.models.cazyme import CAZYme
 from conekt.models.search import Search
+from conekt.models.typeahead import Typeahead
+from conekt.models.fuzzy_names import FuzzyNames
 from conekt.models.species import Species
 from conekt.models.sequences import Sequence
 from conekt.models.xrefs import XRef
@@ -33,16 +35,19 @@ def search_single_keyword(keyword):
 
     :param keyword: Keyword to look for
     """
-    results = Search.whooshee_simple(keyword)
+    results = Search.keyword(keyword)
 
     # If the result is unique redirect to the corresponding page
-    if len(results["sequences"]) + len(results["go"]) + len(results["interpro"]) + len(results["families"]) + len(results["profiles"]) == 1:
+    if len(results["sequences"]) + len(results["go"]) + len(results["cazyme"]) +\
+            len(results["interpro"]) + len(results["families"]) + len(results["profiles"]) == 1:
         if len(results["sequences"]) == 1:
             return redirect(url_for('sequence.sequence_view', sequence_id=results["sequences"][0].id))
         elif len(results["go"]) == 1:
             return redirect(url_for('go.go_view', go_id=results["go"][0].id))
         elif len(results["interpro"]) == 1:
             return redirect(url_for('interpro.interpro_view', interpro_id=results["interpro"][0].id))
+        elif len(results["cazyme"]) == 1:
+            return redirect(url_for('cazyme.cazyme_view', cazyme_id=results["cazyme"][0].id))
         elif len(results["families"]) == 1:
             return redirect(url_for('family.family_view', family_id=results["families"][0].id))
         elif len(results["profiles"]) == 1:
@@ -51,9 +56,11 @@ def search_single_keyword(keyword):
     return render_template("search_results.html", keyword=keyword,
                            go=results["go"],
                            interpro=results["interpro"],
+                           cazyme=results["cazyme"],
                            sequences=results["sequences"],
                            families=results["families"],
-                           profiles=results["profiles"])
+                           profiles=results["profiles"],
+                           facets=results["facets"])
 
 
 @search.route('/', methods=['GET', 'POST'])
@@ -67,8 +74,7 @@ def simple():
         flash("Empty search term", "warning")
         return redirect(url_for('main.screen'))
     else:
-        # results = Search.simple(g.search_form.terms.data)
-        results = Search.whooshee_simple(g.search_form.terms.data)
+        results = Search.simple(g.search_form.terms.data)
 
         # If the result is unique redirect to the corresponding page
         if len(results["sequences"]) + len(results["go"]) + len(results["cazyme"]) +\
@@ -94,7 +100,8 @@ def simple():
                                cazyme=results["cazyme"],
                                sequences=results["sequences"],
                                families=results["families"],
-                               profiles=results["profiles"])
+                               profiles=results["profiles"],
+                               facets=results["facets"])
 
 
 @search.route('/advanced', methods=['GET', 'POST'])
@@ -137,7 +144,7 @@ def advanced():
                                                   cazymes, include_predictions=include_predictions)
 
         return render_template("search_results.html", keyword="Advanced search results",
-                               sequences=results, advanced=True)
+                               sequences=results["sequences"], facets=results["facets"], advanced=True)
 
 
 @search.route('/json/genes/<label>')
@@ -178,7 +185,7 @@ def search_json_genes(label=''):
 @search.route('/enriched/count', methods=['POST'])
 def count_enriched_clusters():
     """
-    Counts the number of clusters enriched for a set of criteria
+    Counts the number of clusters enriched for a set of criteria, counts for each clustering method are included
 
     :return: json response with the count
     """
@@ -203,14 +210,17 @@ def count_enriched_clusters():
         go = GO.query.filter(or_(GO.name == term,
                                  GO.label == term)).first()
 
-        cluster_count = Search.count_enriched_clusters(go.id,
-                                                       method=method,
-                                                       min_enrichment=min_enrichment,
-                                                       max_p=max_p,
-                                                       max_corrected_p=max_corrected_p,
-                                                       enriched_clade_id=clade)
+        # counts for all methods are obtained with the same query
+        method_counts = Search.count_enriched_clusters_per_method(go.id,
+                                                                  min_enrichment=min_enrichment,
+                                                                  max_p=max_p,
+                                                                  max_corrected_p=max_corrected_p,
+                                                                  enriched_clade_id=clade)
 
-        return Response(json.dumps({'count': cluster_count, 'error': 0}), mimetype='application/json')
+        cluster_count = sum(method_counts.values()) if method == -1 else method_counts.get(method, 0)
+
+        return Response(json.dumps({'count': cluster_count, 'methods': method_counts, 'error': 0}),
+                        mimetype='application/json')
     except Exception as e:
         # Bad data return zero
         return Response(json.dumps({'count': 0, 'error': 1}), mimetype='application/json')
@@ -274,7 +284,7 @@ def search_enriched_clusters():
 @search.route('/specific/count', methods=['POST'])
 def count_specific_profiles():
     """
-    Counts the number of genes above a certain SPM threshold.
+    Counts the number of genes above a certain SPM threshold, counts for each condition of the method are included
 
     :return: json response with the count
     """
@@ -286,12 +296,11 @@ def count_specific_profiles():
         cutoff = float(content["cutoff"])
         condition = content["condition"]
 
-        count = ExpressionSpecificity.query.filter(ExpressionSpecificity.method_id == method). \
-            filter(ExpressionSpecificity.score >= cutoff). \
-            filter(ExpressionSpecificity.condition == condition). \
-            count()
+        condition_counts = Search.count_specific_profiles_per_condition(method, cutoff)
 
-        return Response(json.dumps({'count': count, 'error': 0}), mimetype='application/json')
+        return Response(json.dumps({'count': condition_counts.get(condition, 0),
+                                    'conditions': condition_counts,
+                                    'error': 0}), mimetype='application/json')
     except Exception as e:
         # Bad data return zero
         return Response(json.dumps({'count': 0, 'error': 1}), mimetype='application/json')
@@ -374,14 +383,7 @@ def search_typeahead_interpro(term):
     :param term: partial search term
     :return: JSON object compatible with typeahead.js
     """
-    if len(term) > 7:
-        interpro = Interpro.query.filter(or_(Interpro.description.ilike("%" + term + "%"), Interpro.label.ilike(term + "%"))).order_by(
-            func.length(Interpro.description)).all()
-    else:
-        interpro = Interpro.query.filter(Interpro.description.ilike("%"+term+"%")).order_by(func.length(Interpro.description)).all()
-
-    return Response(json.dumps([{'value': i.description, 'tokens': i.description.split() + [i.label], 'label': i.label} for i in interpro]),
-                    mimetype='application/json')
+    return Response(json.dumps(Typeahead.complete('interpro', term)), mimetype='application/json')
 
 
 @search.route('/typeahead/interpro/prefetch')
@@ -408,14 +410,7 @@ def search_typeahead_cazyme(term):
     :param term: partial search term
     :return: JSON object compatible with typeahead.js
     """
-    if len(term) > 7:
-        cazyme = CAZYme.query.filter(or_(CAZYme.cazyme_class.ilike("%" + term + "%"), CAZYme.family.ilike(term + "%"))).order_by(
-            func.length(CAZYme.cazyme_class)).all()
-    else:
-        cazyme = CAZYme.query.filter(CAZYme.family.ilike("%"+term+"%")).order_by(func.length(CAZYme.family)).all()
-
-    return Response(json.dumps([{'value': c.family, 'tokens': c.cazyme_class.split() + [c.family], 'label': c.cazyme_class} for c in cazyme]),
-                    mimetype='application/json')
+    return Response(json.dumps(Typeahead.complete('cazyme', term)), mimetype='application/json')
 
 
 @search.route('/typeahead/cazyme/prefetch')
@@ -442,13 +437,7 @@ def search_typeahead_go(term):
     :param term: partial search term
     :return: JSON object compatible with typeahead.js
     """
-    if term.lower().startswith('go:') and len(term) > 7:
-        go = GO.query.filter(GO.obsolete == 0).filter(GO.label.ilike(term + "%")).all()
-    else:
-        go = GO.query.filter(GO.obsolete == 0).filter(GO.name.ilike("%"+term+"%")).order_by(func.length(GO.name)).all()
-
-    return Response(json.dumps([{'value': g.name, 'tokens': g.name.split() + [g.label], 'label': g.label} for g in go]),
-                    mimetype='application/json')
+    return Response(json.dumps(Typeahead.complete('go', term)), mimetype='application/json')
 
 
 @search.route('/typeahead/go/prefetch')
@@ -465,6 +454,48 @@ def search_typeahead_prefetch_go():
                     mimetype='application/json')
 
 
+@search.route('/typeahead/sequence/<term>.json')
+@cache.cached()
+def search_typeahead_sequence(term):
+    """
+    Controller required for populating predictive search forms using typeahead.js, completes gene names and aliases.
+
+    :param term: partial search term
+    :return: JSON object compatible with typeahead.js
+    """
+    return Response(json.dumps(Typeahead.complete('sequence', term)), mimetype='application/json')
+
+
+@search.route('/typeahead/family/<term>.json')
+@cache.cached()
+def search_typeahead_family(term):
+    """
+    Controller required for populating predictive search forms using typeahead.js, completes gene family names.
+
+    :param term: partial search term
+    :return: JSON object compatible with typeahead.js
+    """
+    return Response(json.dumps(Typeahead.complete('family', term)), mimetype='application/json')
+
+
+@search.route('/did_you_mean/<term>.json')
+@cache.cached(query_string=True, unless=lambda: FuzzyNames.index is None)
+def search_did_you_mean(term):
+    """
+    Suggests genes for an identifier that wasn't found, using the trigram index of sequence names and
+    cross-references (case insensitive, version suffixes and transcript tags are ignored). The index is built in the
+    background, until it is ready no suggestions are returned (and nothing is cached).
+
+    Optionally, results can be restricted to one species by adding ?species_id=<id>
+
+    :param term: (misspelled) gene identifier
+    :return: JSON object with suggestions (sequence id, name, species code, matched identifier and score), best first
+    """
+    species_id = request.args.get('species_id', type=int)
+
+    return Response(json.dumps(FuzzyNames.suggest(term, species_id=species_id)), mimetype='application/json')
+
+
 @search.route('/whooshee/<keyword>')
 @cache.cached()
 def search_whooshee(keyword):
@@ -140,7 +140,7 @@ def sequence_fasta_coding(sequence_id, rna):
             .options(noload('xrefs'))\
             .first()
 
-    fasta = ">" + current_sequence.name + "\n" + current_sequence.coding_sequence + "\n"
+    fasta = ">" + current_sequence.name + "\n" + current_sequence.nucleotide_sequence + "\n"
     response = make_response(fasta)
     response.headers["Content-Disposition"] = "attachment; filename=" + current_sequence.name + ".cds.fasta"
     response.headers['Content-type'] = 'text/plain'
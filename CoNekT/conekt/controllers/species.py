@@ -1,4 +1,5 @@
-from flask import Blueprint, render_template, g, make_response, Response, Markup, flash
+from flask import Blueprint, render_template, g, make_response, Response, Markup, flash, request, abort, \
+    stream_with_context
 from markdown import markdown
 
 from conekt import db, cache
@@ -6,10 +7,16 @@ from conekt.models.species import Species
 from conekt.models.literature import LiteratureItem
 from conekt.models.sequences import Sequence
 from conekt.models.clades import Clade
+from conekt.models.cazyme import CAZYme
+from conekt.models.gene_families import GeneFamily
+from conekt.models.go import GO
+from conekt.models.interpro import Interpro
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.relationships.sample_literature import SampleLitAssociation
 from conekt.models.literature import LiteratureItem
 
-from sqlalchemy.orm import undefer, noload
+from utils.sequence import translate
+
 from sqlalchemy import desc
 
 species = Blueprint('species', __name__)
@@ -114,20 +121,10 @@ def species_download_coding(species_id):
     :param species_id: Internal ID of the species
     :return: Response with the fasta file
     """
-    output = []
-
-    current_species = Species.query.get(species_id)
-    sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.coding_sequence]).
-                                  where(Sequence.__table__.c.species_id == current_species.id)).\
-        fetchall()
-
-    for (name, coding_sequence) in sequences:
-        output.append(">" + name)
-        output.append(coding_sequence)
+    current_species = Species.query.get_or_404(species_id)
 
-    response = make_response("\n".join(output))
+    response = Response(stream_with_context(__fasta(current_species.id)), mimetype='text/plain')
     response.headers["Content-Disposition"] = "attachment; filename=" + current_species.code + ".cds.fasta"
-    response.headers['Content-type'] = 'text/plain'
 
     return response
 
@@ -140,19 +137,11 @@ def species_download_protein(species_id):
     :param species_id: Internal ID of the species
     :return: Response with the fasta file
     """
-    output = []
-
-    current_species = Species.query.get(species_id)
-    sequences = current_species.sequences.options(undefer('coding_sequence')).options(noload('xrefs')).all()
-
-    for s in sequences:
-        if s.type == "protein_coding":
-            output.append(">" + s.name)
-            output.append(s.protein_sequence)
+    current_species = Species.query.get_or_404(species_id)
 
-    response = make_response("\n".join(output))
+    response = Response(stream_with_context(__fasta(current_species.id, 'protein_coding', translated=True)),
+                        mimetype='text/plain')
     response.headers["Content-Disposition"] = "attachment; filename=" + current_species.code + ".aa.fasta"
-    response.headers['Content-type'] = 'text/plain'
 
     return response
 
@@ -165,22 +154,10 @@ def species_download_rna(species_id):
     :param species_id: Internal ID of the species
     :return: Response with the fasta file
     """
-    output = []
-
-    current_species = Species.query.get(species_id)
-    sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.coding_sequence,
-                                             Sequence.__table__.c.type]).
-                                  where(Sequence.__table__.c.species_id == current_species.id)).\
-        fetchall()
-
-    for (name, coding_sequence, type) in sequences:
-        if type == "RNA":
-            output.append(">" + name)
-            output.append(coding_sequence)
+    current_species = Species.query.get_or_404(species_id)
 
-    response = make_response("\n".join(output))
+    response = Response(stream_with_context(__fasta(current_species.id, 'RNA')), mimetype='text/plain')
     response.headers["Content-Disposition"] = "attachment; filename=" + current_species.code + ".rna.fasta"
-    response.headers['Content-type'] = 'text/plain'
 
     return response
 
@@ -194,16 +171,7 @@ def species_stream_coding(species_id):
     :param species_id: Internal ID of the species
     :return: Streamed response with the fasta file
     """
-    def generate(selected_species):
-        sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.coding_sequence, Sequence.__table__.c.type]).
-                                      where(Sequence.__table__.c.species_id == selected_species)).\
-            fetchall()
-
-        for name, coding_sequence, type in sequences:
-            if type == 'protein_coding':
-                yield ">" + name + '\n' + coding_sequence + '\n'
-
-    return Response(generate(species_id), mimetype='text/plain')
+    return Response(stream_with_context(__fasta(species_id, 'protein_coding')), mimetype='text/plain')
 
 
 @species.route('/stream/protein/<species_id>')
@@ -215,59 +183,8 @@ def species_stream_protein(species_id):
     :param species_id: Internal ID of the species
     :return: Streamed response with the fasta file
     """
-    import time
-
-    def generate(selected_species):
-        
-        sequences = []
-        limit = 15000
-        offset = 0
-
-        counting_rows = Sequence.query\
-                .options(undefer('coding_sequence'))\
-                .options(noload('xrefs'))\
-                .filter_by(species_id=selected_species)\
-                .filter_by(type='protein_coding')\
-                .count()
-
-        start_time = time.time()
-        while True:
-            elapsed_time = time.time() - start_time
-
-            rows = Sequence.query\
-                .options(undefer('coding_sequence'))\
-                .options(noload('xrefs'))\
-                .filter_by(species_id=selected_species)\
-                .filter_by(type='protein_coding')\
-                .limit(limit)\
-                .offset(offset)
-
-            if (limit + offset) >= counting_rows:
-                sequences.extend(rows)
-                perc_recovered = (len(sequences) / counting_rows) * 100
-                print("Size of current rows in sequences: " + str(len(sequences)) + "(Perc: " + str(perc_recovered) + "%)")
-                time.sleep(1)
-                break
-            else:
-                sequences.extend(rows)
-                print("Size of current rows in sequences: " + str(len(sequences)))
-                perc_recovered = (len(sequences) / counting_rows) * 100
-                print("Size of current rows in sequences: " + str(len(sequences)) + "(Perc: " + str(perc_recovered) + "%)")
-                time.sleep(1)
-
-            if (offset + limit) <= counting_rows:
-                offset += limit
-                print("Total proteins: ", counting_rows, "Limit: ", limit, "Offset: ", offset)
-                perc_recovered = (len(sequences) / counting_rows) * 100
-                print("Size of current rows in sequences: " + str(len(sequences)) + "(Perc: " + str(perc_recovered) + "%)")
-                print(f"Elapsed time: {elapsed_time:.2f} seconds")
-                time.sleep(1)
-
-        for s in sequences:
-            if s.type == "protein_coding":
-                yield ">" + s.name + '\n' + s.protein_sequence + '\n'
-
-    return Response(generate(species_id), mimetype='text/plain')
+    return Response(stream_with_context(__fasta(species_id, 'protein_coding', translated=True)),
+                    mimetype='text/plain')
 
 #stream rna fasta -----------------------------------------------
 @species.route('/stream/rna/<species_id>')
@@ -279,16 +196,75 @@ def species_stream_rna(species_id):
     :param species_id: Internal ID of the species
     :return: Streamed response with the fasta file
     """
-    def generate(selected_species):
-        sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.coding_sequence, Sequence.__table__.c.type]).
-                                      where(Sequence.__table__.c.species_id == selected_species)).\
-            fetchall()
+    return Response(stream_with_context(__fasta(species_id, 'RNA')), mimetype='text/plain')
 
-        for name, coding_sequence, type in sequences:
-            if type == 'RNA':
-                yield ">" + name + '\n' + coding_sequence + '\n'
 
-    return Response(generate(species_id), mimetype='text/plain')
+def __fasta(species_id, sequence_type=None, translated=False):
+    """
+    Generates fasta records for the sequences of a species, sequences are fetched from the database in batches so
+    large genomes are never completely in memory
+
+    :param species_id: Internal ID of the species
+    :param sequence_type: only include sequences of this type (default: all types)
+    :param translated: set to true to translate coding sequences to amino acid sequences
+    :return: generator yielding one fasta record at the time
+    """
+    for name, coding_sequence in Sequence.stream_sequences(species_id=species_id, sequence_type=sequence_type):
+        yield ">" + name + '\n' + (translate(coding_sequence) if translated else coding_sequence) + '\n'
+
+
+@species.route('/download/profiles/<annotation_type>')
+def species_download_profiles(annotation_type):
+    """
+    Generates a tab-delimited file with the phylogenetic profiles (number of genes per species) of all InterPro
+    domains, GO terms, CAZymes or gene families. Profiles can be filtered on presence/absence using species codes
+    (separated by commas) in the arguments present and absent, e.g. ?present=shc1,shc2&absent=sbi
+
+    :param annotation_type: type of annotation (interpro, go, cazyme or family)
+    :return: Response with the tab-delimited file
+    """
+    models = {'interpro': (Interpro, Interpro.label),
+              'go': (GO, GO.label),
+              'cazyme': (CAZYme, CAZYme.family),
+              'family': (GeneFamily, GeneFamily.name)}
+
+    if annotation_type not in models.keys():
+        abort(404)
 
+    model, label = models[annotation_type]
 
+    all_species = Species.query.order_by(Species.code).all()
+    code_to_id = {s.code: s.id for s in all_species}
+
+    selected = {}
+    for argument in ['present', 'absent']:
+        codes = [c for c in request.args.get(argument, '').split(',') if c != '']
+        if any([c not in code_to_id.keys() for c in codes]):
+            abort(404)
+        selected[argument] = [code_to_id[c] for c in codes]
+
+    if len(selected['present']) > 0 or len(selected['absent']) > 0:
+        annotation_ids = SpeciesAnnotationCount.find_by_presence(annotation_type,
+                                                                 present=selected['present'],
+                                                                 absent=selected['absent'])
+        profiles = SpeciesAnnotationCount.get_profiles(annotation_type, annotation_ids)
+    else:
+        profiles = SpeciesAnnotationCount.get_profiles(annotation_type)
+
+    labels = {}
+    annotation_ids = list(profiles.keys())
+    for i in range(0, len(annotation_ids), 400):
+        labels.update(db.session.query(model.id, label).filter(model.id.in_(annotation_ids[i:i + 400])).all())
+
+    output = ["\t".join([annotation_type] + [s.code for s in all_species])]
+
+    for annotation_id, annotation_label in sorted(labels.items(), key=lambda x: str(x[1])):
+        output.append("\t".join([str(annotation_label)] +
+                                [str(profiles[annotation_id].get(s.code, 0)) for s in all_species]))
+
+    response = make_response("\n".join(output))
+    response.headers["Content-Disposition"] = "attachment; filename=" + annotation_type + "_profiles.tsv"
+    response.headers['Content-type'] = 'text/plain'
+
+    return response
 
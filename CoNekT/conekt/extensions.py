@@ -6,7 +6,6 @@ from flask_debugtoolbar import DebugToolbarExtension
 from flask_htmlmin import HTMLMIN
 from flask_login import LoginManager, current_user, user_unauthorized
 from flask_sqlalchemy import SQLAlchemy
-from flask_whooshee import Whooshee
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 
@@ -15,6 +14,7 @@ from sqlalchemy import event
 from sqlite3 import Connection as SQLite3Connection
 
 from conekt.flask_blast import BlastThread
+from conekt.persistent_whooshee import PersistentWhooshee
 
 __all__ = ['toolbar', 'db', 'login_manager', 'cache', 'htmlmin',
            'blast_thread', 'compress', 'whooshee', 'migrate', 'csrf']
@@ -60,6 +60,6 @@ cache = Cache()
 htmlmin = HTMLMIN()
 blast_thread = BlastThread()
 compress = Compress()
-whooshee = Whooshee()
+whooshee = PersistentWhooshee()
 migrate = Migrate()
 csrf = CSRFProtect()
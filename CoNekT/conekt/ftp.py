@@ -11,7 +11,7 @@ from sqlalchemy.orm import joinedload, noload
 from conekt import create_app, db
 from conekt.models.expression.coexpression_clusters import CoexpressionClusteringMethod
 from conekt.models.expression.networks import ExpressionNetworkMethod, ExpressionNetwork
-from conekt.models.gene_families import GeneFamilyMethod
+from conekt.models.gene_families import GeneFamily, GeneFamilyMethod
 from conekt.models.relationships.sequence_cluster import SequenceCoexpressionClusterAssociation
 from conekt.models.relationships.sequence_family import SequenceFamilyAssociation
 from conekt.models.relationships.sequence_go import SequenceGOAssociation
@@ -35,12 +35,9 @@ def export_coding_sequences(SEQUENCE_PATH):
     for s in species:
         filename = s.code + ".cds.fasta.gz"
         filename = os.path.join(SEQUENCE_PATH, filename)
-        sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.coding_sequence]).
-                                      where(Sequence.__table__.c.species_id == s.id)
-                                      ).fetchall()
 
         with gzip.open(filename, 'wb') as f:
-            for (name, coding_sequence) in sequences:
+            for (name, coding_sequence) in Sequence.stream_sequences(species_id=s.id):
                 f.write(bytes(">" + name + '\n' + coding_sequence + '\n', 'UTF-8'))
 
 
@@ -57,14 +54,9 @@ def export_protein_sequences(SEQUENCE_PATH):
         filename = s.code + ".aa.fasta.gz"
         filename = os.path.join(SEQUENCE_PATH, filename)
 
-        sequences = db.engine.execute(db.select([Sequence.__table__.c.name, Sequence.__table__.c.type, Sequence.__table__.c.coding_sequence]).
-                                      where(Sequence.__table__.c.species_id == s.id)
-                                      ).fetchall()
-
         with gzip.open(filename, 'wb') as f:
-            for (name, sequence_type, sequence) in sequences:
-                if sequence_type == "protein_coding":
-                    f.write(bytes(">" + name + '\n' + translate(sequence) + '\n', 'UTF-8'))
+            for (name, sequence) in Sequence.stream_sequences(species_id=s.id, sequence_type='protein_coding'):
+                f.write(bytes(">" + name + '\n' + translate(sequence) + '\n', 'UTF-8'))
 
 
 def export_go_annotation(ANNOTATION_PATH):
@@ -169,18 +161,21 @@ def export_families(FAMILIES_PATH):
         for m in methods:
             print(m.id, m.method, m.family_count, file=f, sep='\t')
 
-    associations = SequenceFamilyAssociation.query.all()
+    associations = db.session.query(GeneFamily.method_id, GeneFamily.name, Sequence.name).\
+        select_from(SequenceFamilyAssociation).\
+        join(GeneFamily, GeneFamily.id == SequenceFamilyAssociation.gene_family_id).\
+        join(Sequence, Sequence.id == SequenceFamilyAssociation.sequence_id).all()
 
     output = {}
 
-    for a in associations:
-        if a.family.method_id not in output.keys():
-            output[a.family.method_id] = {}
+    for method_id, family_name, sequence_name in associations:
+        if method_id not in output.keys():
+            output[method_id] = {}
 
-        if a.family.name not in output[a.family.method_id].keys():
-            output[a.family.method_id][a.family.name] = []
+        if family_name not in output[method_id].keys():
+            output[method_id][family_name] = []
 
-        output[a.family.method_id][a.family.name].append(a.sequence.name)
+        output[method_id][family_name].append(sequence_name)
 
     for method, families in sorted(output.items()):
         familyfile = os.path.join(FAMILIES_PATH, 'families_method_'+str(method)+'.tab')
@@ -1,5 +1,5 @@
 import json
-from statistics import mean, stdev
+from statistics import mean
 
 from utils.color import __COLORS_RGBA as COLORS
 
@@ -172,64 +172,30 @@ def prepare_profiles(profiles, doi, normalize=False, xlabel='', ylabel='', categ
     return output
 
 
-def prepare_avg_profiles(profiles, xlabel='', ylabel=''):
+def prepare_avg_profiles(summary, xlabel='', ylabel=''):
     """
-    Takes a set of profiles and generates the average profile
+    Takes the average profile of a set of profiles and generates a plot
 
-    :param profiles: list of profiles to include in the plot
+    :param summary: dict with order, colors, mean and stdev (see CoexpressionCluster.summarize_profiles)
     :param xlabel: label for x-axis
     :param ylabel: label for y-axis
 
     :return dict with plot compatible with Chart.js
     """
-    labels = []
-    datasets = []
-
-    background_color=[]
-    point_color=[]
-
-    means = []
-    stdevs = []
-
-    if len(profiles) > 0:
-        data = json.loads(profiles[0].profile)
-        labels = data['order']
-
-        background_color = data["colors"] if "colors" in data.keys() else "rgba(175,175,175,0.2)"
-        point_color = "rgba(55,55,55,0.4)" if "colors" in data.keys() else "rgba(220,22,22,1)"
+    if summary is None:
+        summary = {"order": [], "colors": None, "mean": [], "stdev": []}
 
-    for p in profiles:
-        data = json.loads(p.profile)
-
-        processed_values = {}
-        for key, values in data["data"]["tpm"].items():
-            po_value = data["data"]["po_anatomy_class"][key]
-
-            if po_value not in processed_values:
-                processed_values[po_value] = []
-
-            processed_values[po_value].append(values)
+    background_color = summary["colors"] if summary["colors"] is not None else "rgba(175,175,175,0.2)"
+    point_color = "rgba(55,55,55,0.4)" if summary["colors"] is not None else "rgba(220,22,22,1)"
 
-        expression_values = [mean(processed_values[label]) for label in labels]
-
-        max_expression = max(expression_values)
-        expression_values = [value/max_expression if max_expression != 0 else 0 for value in expression_values]
-
-        datasets.append(expression_values)
-
-    for i, l in enumerate(labels):
-        values = [d[i] for d in datasets]
-        means.append(mean(values))
-        if len(values) > 1:
-            # Can't get stdev for 1 value
-            stdevs.append(stdev(values))
-        else:
-            stdevs.append(None)
+    means = summary["mean"]
+    # Can't get stdev for 1 value
+    stdevs = [sd if sd is not None else 0 for sd in summary["stdev"]]
 
     output = {"type": "bar",
               "data": {
-                      "labels": list(label.capitalize() for label in data["order"]),
-                      "counts": [None]*len(data["order"]),
+                      "labels": list(label.capitalize() for label in summary["order"]),
+                      "counts": [None]*len(summary["order"]),
                       "datasets": [
                           {
                             "type": "line",
@@ -0,0 +1,14 @@
+from flask import flash
+
+
+def flash_resolved_genes(resolved):
+    """
+    Warns the user about identifiers in a gene list that couldn't be found or match multiple genes
+
+    :param resolved: output of GeneResolver.resolve or GeneResolver.get_probes
+    """
+    if len(resolved['unknown']) > 0:
+        flash("Couldn't find: %s" % ", ".join(resolved['unknown']), "warning")
+
+    if len(resolved['ambiguous']) > 0:
+        flash("Multiple genes found for: %s (all are included)" % ", ".join(resolved['ambiguous'].keys()), "info")
@@ -0,0 +1,165 @@
+"""
+Shared aggregation of annotation statistics (InterPro, GO, CAZYme and gene families) for a set of sequences. Counts are
+computed in the database with one GROUP BY query, large lists of sequence IDs are passed through a temporary table
+instead of a long IN clause.
+"""
+
+from conekt import db
+from conekt.models.sequences import Sequence
+
+from sqlalchemy import func, distinct
+
+from contextlib import contextmanager
+
+CHUNK_SIZE = 400
+
+
+def sequence_stats(association, annotation_id, model, key, sequence_ids=None, sequences=None, filters=None):
+    """
+    Counts, for each annotation linked with any of the input sequences, the number of associations, sequences and
+    species.
+
+    :param association: association model linking sequences to the annotation (e.g. SequenceGOAssociation)
+    :param annotation_id: column of the association with the annotation ID (e.g. SequenceGOAssociation.go_id)
+    :param model: model of the annotation (e.g. GO)
+    :param key: key to store the annotation object in the output (e.g. 'go')
+    :param sequence_ids: list of sequence IDs
+    :param sequences: BaseQuery returning sequences, used instead of sequence_ids when provided
+    :param filters: list of additional filters on the association (e.g. to exclude predicted GO labels)
+    :return: dict with for each annotation the object, count, sequence_count and species_count
+    """
+    query = db.session.query(annotation_id,
+                             func.count(association.id),
+                             func.count(distinct(association.sequence_id)),
+                             func.count(distinct(Sequence.species_id))).\
+        join(Sequence, Sequence.id == association.sequence_id)
+
+    if filters is not None:
+        query = query.filter(*filters)
+
+    def grouped(q):
+        return q.group_by(annotation_id).order_by(func.count(association.id).desc()).all()
+
+    if sequences is not None:
+        subquery = sequences.with_entities(Sequence.id).distinct().subquery()
+        counts = grouped(query.join(subquery, association.sequence_id == subquery.c.id))
+    else:
+        sequence_ids = list(set(sequence_ids))
+
+        if len(sequence_ids) == 0:
+            return {}
+        elif len(sequence_ids) <= CHUNK_SIZE:
+            counts = grouped(query.filter(association.sequence_id.in_(sequence_ids)))
+        else:
+            with _sequence_id_table(sequence_ids) as id_table:
+                counts = grouped(query.join(id_table, association.sequence_id == id_table.c.sequence_id))
+
+    annotations = {}
+    annotation_ids = [c[0] for c in counts]
+    for i in range(0, len(annotation_ids), CHUNK_SIZE):
+        for a in model.query.filter(model.id.in_(annotation_ids[i:i + CHUNK_SIZE])).all():
+            annotations[a.id] = a
+
+    return {a_id: {key: annotations[a_id],
+                   'count': count,
+                   'sequence_count': sequence_count,
+                   'species_count': species_count}
+            for a_id, count, sequence_count, species_count in counts if a_id in annotations.keys()}
+
+
+def sequence_facets(sequence_ids, limit=10, max_annotated=None):
+    """
+    Breakdown of a set of sequences (e.g. search results) per species and the most common GO terms, InterPro domains,
+    CAZYmes and gene families. All counts are grouped aggregates, large sets are passed through a temporary table.
+
+    Species are always counted for all sequences. For very large sets the annotations can be counted for an evenly
+    spaced sample of the sequences (sequence IDs follow the order species were loaded in, so a prefix would only cover
+    the first species).
+
+    :param sequence_ids: list of sequence IDs
+    :param limit: number of annotations to report per type
+    :param max_annotated: maximum number of sequences to count annotations for (default: all)
+    :return: dict with the number of sequences, a list of dicts with species and count, for each type of annotation a
+             list of stats (see sequence_stats) ordered by the number of sequences and 'sampled', the number of
+             sequences the annotations are based on if these were sampled (None otherwise)
+    """
+    from conekt.models.cazyme import CAZYme
+    from conekt.models.gene_families import GeneFamily
+    from conekt.models.go import GO
+    from conekt.models.interpro import Interpro
+    from conekt.models.species import Species
+
+    sequence_ids = sorted(set(sequence_ids))
+
+    output = {'count': 0, 'species': [], 'go': [], 'interpro': [], 'cazyme': [], 'families': [], 'sampled': None}
+
+    if len(sequence_ids) == 0:
+        return output
+
+    def grouped(ids, aggregate):
+        if len(ids) <= CHUNK_SIZE:
+            return aggregate(Sequence.query.filter(Sequence.id.in_(ids)))
+
+        with _sequence_id_table(ids) as id_table:
+            return aggregate(Sequence.query.join(id_table, Sequence.id == id_table.c.sequence_id))
+
+    species_counts = grouped(sequence_ids,
+                             lambda sequences: sequences.with_entities(Sequence.species_id, func.count(Sequence.id)).
+                             group_by(Sequence.species_id).all())
+
+    annotated_ids = sequence_ids
+    if max_annotated is not None and len(sequence_ids) > max_annotated:
+        annotated_ids = [sequence_ids[i * len(sequence_ids) // max_annotated] for i in range(max_annotated)]
+        output['sampled'] = len(annotated_ids)
+
+    annotations = grouped(annotated_ids,
+                          lambda sequences: {'go': GO.sequence_stats_subquery(sequences),
+                                             'interpro': Interpro.sequence_stats_subquery(sequences),
+                                             'cazyme': CAZYme.sequence_stats_subquery(sequences),
+                                             'families': GeneFamily.sequence_stats_subquery(sequences)})
+
+    output['count'] = sum([c for _, c in species_counts])
+
+    species = {s.id: s for s in Species.query.filter(Species.id.in_([s for s, _ in species_counts])).all()}
+    output['species'] = sorted([{'species': species[s], 'count': c} for s, c in species_counts if s in species.keys()],
+                               key=lambda f: (-f['count'], f['species'].code))
+
+    for key, stats in annotations.items():
+        output[key] = sorted(stats.values(), key=lambda a: -a['sequence_count'])[:limit]
+
+    return output
+
+
+@contextmanager
+def temporary_table(name, column, values):
+    """
+    Context manager that creates a temporary table with a single column on the connection of the current session and
+    fills it in chunks. The table is dropped again when the block is left, also when filling or querying it fails, so
+    it can't leak on a pooled connection.
+
+    Example:
+        with temporary_table('tmp_ids', db.Column('sequence_id', db.Integer, primary_key=True), ids) as id_table:
+            rows = query.join(id_table, Sequence.id == id_table.c.sequence_id).all()
+
+    :param name: name of the temporary table
+    :param column: column of the table (db.Column), its name is used as key for the values
+    :param values: list of unique values to insert
+    :return: the temporary table
+    """
+    table = db.Table(name, db.MetaData(), column, prefixes=['TEMPORARY'])
+
+    connection = db.session.connection()
+    table.create(connection)
+
+    try:
+        for i in range(0, len(values), CHUNK_SIZE):
+            connection.execute(table.insert(), [{column.name: v} for v in values[i:i + CHUNK_SIZE]])
+
+        yield table
+    finally:
+        table.drop(connection)
+
+
+def _sequence_id_table(sequence_ids):
+    return temporary_table('tmp_stats_sequence_ids', db.Column('sequence_id', db.Integer, primary_key=True),
+                           sequence_ids)
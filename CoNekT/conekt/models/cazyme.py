@@ -1,7 +1,10 @@
 from conekt import db, whooshee
 from conekt.models.relationships import sequence_cazyme
 from conekt.models.relationships.sequence_cazyme import SequenceCAZYmeAssociation
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.sequences import Sequence
+from conekt.models.species import Species
+from conekt.models import annotation_stats
 
 from collections import defaultdict
 
@@ -30,6 +33,35 @@ class CAZYme(db.Model):
         self.activities = activities
 
 
+    @property
+    def species_codes(self):
+        """
+        Finds all species the CAZYme has genes from
+        :return: a list of all species (codes)
+        """
+        return list(self.species_counts.keys())
+
+    @property
+    def species_counts(self):
+        """
+        Generates a phylogenetic profile of a CAZYme
+        :return: a dict with counts per species (codes are keys)
+        """
+        output = SpeciesAnnotationCount.get_species_counts('cazyme', self.id)
+
+        if len(output) > 0:
+            return output
+
+        # No precomputed counts available, count sequences
+        for code, count in db.session.query(Species.code, db.func.count(db.distinct(Sequence.id))).\
+                join(Sequence, Sequence.species_id == Species.id).\
+                join(SequenceCAZYmeAssociation, SequenceCAZYmeAssociation.sequence_id == Sequence.id).\
+                filter(SequenceCAZYmeAssociation.cazyme_id == self.id).\
+                group_by(Species.code).all():
+            output[code] = count
+
+        return output
+
     @staticmethod
     def sequence_stats(sequence_ids, exclude_predicted=True):
         """
@@ -39,48 +71,17 @@ class CAZYme(db.Model):
         :param exclude_predicted: if True (default) predicted CAZYme labels will be excluded
         :return: dict with for each CAZYme linked with any of the input sequences stats
         """
-        data = SequenceCAZYmeAssociation.query.filter(SequenceCAZYmeAssociation.sequence_id.in_(sequence_ids)).all()
-
-        return CAZYme.__sequence_stats_associations(data)
-
-
-    @staticmethod
-    def __sequence_stats_associations(associations):
-        output = {}
-        for d in associations:
-            if d.cazyme_id not in output.keys():
-                output[d.cazyme_id] = {
-                    'cazyme': d.cazyme,
-                    'count': 1,
-                    'sequences': [d.sequence_id],
-                    'species': [d.sequence.species_id]
-                }
-            else:
-                output[d.cazyme_id]['count'] += 1
-                if d.sequence_id not in output[d.cazyme_id]['sequences']:
-                    output[d.cazyme_id]['sequences'].append(d.sequence_id)
-                if d.sequence.species_id not in output[d.cazyme_id]['species']:
-                    output[d.cazyme_id]['species'].append(d.sequence.species_id)
-
-        for k, v in output.items():
-            v['species_count'] = len(v['species'])
-            v['sequence_count'] = len(v['sequences'])
-
-        return output
-
+        return annotation_stats.sequence_stats(SequenceCAZYmeAssociation, SequenceCAZYmeAssociation.cazyme_id,
+                                               CAZYme, 'cazyme', sequence_ids=sequence_ids)
 
     @staticmethod
     def sequence_stats_subquery(sequences):
-        subquery = sequences.subquery()
-        data = SequenceCAZYmeAssociation.query.join(subquery, SequenceCAZYmeAssociation.sequence_id == subquery.c.id).all()
-
-        return CAZYme.__sequence_stats_associations(data)
+        return annotation_stats.sequence_stats(SequenceCAZYmeAssociation, SequenceCAZYmeAssociation.cazyme_id,
+                                               CAZYme, 'cazyme', sequences=sequences)
 
     
     @property
     def cazyme_stats(self):
-        sequence_ids = [s.id for s in self.sequences.all()]
-
         return CAZYme.sequence_stats_subquery(self.sequences)
 
     @property
@@ -140,6 +141,11 @@ class CAZYme(db.Model):
 
         db.engine.execute(SequenceCAZYmeAssociation.__table__.insert(), associations)
 
+        # Refresh the pre-calculated cluster summaries for this species
+        from conekt.models.expression.coexpression_clusters import CoexpressionCluster
+        CoexpressionCluster.update_summaries(species_id=species_id)
+
+        SpeciesAnnotationCount.update_counts(annotation_types=('cazyme',), species_id=species_id)
 
     @staticmethod
     def add_from_txt(filename, empty=True):
@@ -167,32 +173,25 @@ class CAZYme(db.Model):
             'CBM':'Carbohydrate-Binding Module'
         }
 
-        with open(filename, 'r') as fin:
-            i = 0
-            for line in fin:
-                parts = line.strip().split('\t')
-                if len(parts) == 2:
-                    family, cazyme_class, activities = parts[0], '', parts[1]
-                    
-                    string = ''
-                    for char in parts[0]:
-                        if char.isalpha():
-                            string += char
-                    cazyme_class = class_dict[string]
-
-                    cazyme = CAZYme(family=family, cazyme_class=cazyme_class, activities=activities)
-                    db.session.add(cazyme)
-                    i += 1
-                if i % 40 == 0:
-                # commit to the db frequently to allow WHOOSHEE's indexing function to work without timing out
-                    try:
-                        db.session.commit()
-                    except Exception as e:
-                        db.session.rollback()
-                        print(e)
-
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(e)
\ No newline at end of file
+        # the families are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(CAZYme, rebuild=empty):
+            with open(filename, 'r') as fin:
+                for line in fin:
+                    parts = line.strip().split('\t')
+                    if len(parts) == 2:
+                        family, cazyme_class, activities = parts[0], '', parts[1]
+
+                        string = ''
+                        for char in parts[0]:
+                            if char.isalpha():
+                                string += char
+                        cazyme_class = class_dict[string]
+
+                        cazyme = CAZYme(family=family, cazyme_class=cazyme_class, activities=activities)
+                        db.session.add(cazyme)
+
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(e)
\ No newline at end of file
@@ -2,6 +2,7 @@ from conekt import db
 from conekt.models.species import Species
 from conekt.models.gene_families import GeneFamily
 from conekt.models.interpro import Interpro
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 
 from utils.phylo import get_clade
 
@@ -69,8 +70,12 @@ class Clade(db.Model):
         clade_to_species = {c.name: json.loads(c.species) for c in clades}
         clade_to_id = {c.name: c.id for c in clades}
 
+        # Get the phylogenetic profiles of all families at once
+        SpeciesAnnotationCount.update_counts(annotation_types=('family',))
+        profiles = SpeciesAnnotationCount.get_profiles('family')
+
         for f in families:
-            family_species = f.species_codes
+            family_species = list(profiles[f.id].keys()) if f.id in profiles.keys() else []
 
             # skip for families without members
             if len(family_species) == 0:
@@ -101,8 +106,12 @@ class Clade(db.Model):
         clade_to_species = {c.name: json.loads(c.species) for c in clades}
         clade_to_id = {c.name: c.id for c in clades}
 
+        # Get the phylogenetic profiles of all domains at once
+        SpeciesAnnotationCount.update_counts(annotation_types=('interpro',))
+        profiles = SpeciesAnnotationCount.get_profiles('interpro')
+
         for i in interpro:
-            interpro_species = i.species_codes
+            interpro_species = list(profiles[i.id].keys()) if i.id in profiles.keys() else []
 
             # skip for families without members
             if len(interpro_species) == 0:
@@ -1,10 +1,14 @@
 import json
+import random
 import sys
 from math import log2
+from bisect import bisect_right
 from collections import defaultdict
+from multiprocessing import Pool
+from statistics import mean, median, stdev
 
 from flask import url_for
-from sqlalchemy import join
+from sqlalchemy import join, func, distinct
 from sqlalchemy.orm import joinedload, load_only, undefer
 
 from conekt import db
@@ -19,13 +23,18 @@ from conekt.models.relationships.sequence_family import SequenceFamilyAssociatio
 from conekt.models.relationships.sequence_go import SequenceGOAssociation
 from conekt.models.relationships.cluster_go import ClusterGOEnrichment
 from conekt.models.relationships.cluster_clade import ClusterCladeEnrichment
+from conekt.models.relationships.cluster_summary import CoexpressionClusterSummary, CoexpressionClusterAnnotationCount
+from conekt.models.relationships.sequence_interpro import SequenceInterproAssociation
+from conekt.models.relationships.sequence_cazyme import SequenceCAZYmeAssociation
 from conekt.models.sequences import Sequence
+from conekt.models.species import Species
 from conekt.models.expression.profiles import ExpressionProfile
 
 from utils.benchmark import benchmark
-from utils.enrichment import hypergeo_sf, fdr_correction
-from utils.jaccard import jaccard
+from utils.enrichment import hypergeo_sf_many, fdr_correction, cluster_go_enrichment
+from utils.jaccard import jaccard_null_distribution, empirical_p_value
 from utils.hcca import HCCA
+from utils.expression import eigengene
 
 
 class CoexpressionClusteringMethod(db.Model):
@@ -138,6 +147,8 @@ class CoexpressionClusteringMethod(db.Model):
             db.session.rollback()
             print(e)
 
+        CoexpressionCluster.update_summaries(cluster_ids=[c.id for c in clusters_orm.values()])
+
     @staticmethod
     def build_hcca_clusters(method, network_method_id, step_size=3, hrr_cutoff=30, min_cluster_size=40, max_cluster_size=200):
         """
@@ -259,6 +270,7 @@ class CoexpressionClusteringMethod(db.Model):
                 db.session.rollback()
                 print(e)
 
+            CoexpressionCluster.update_summaries(method_id=new_method.id)
 
         else:
             print("No clusters found! Not adding anything to DB !")
@@ -333,6 +345,8 @@ class CoexpressionClusteringMethod(db.Model):
                         db.session.rollback()
                         print(e)
 
+        CoexpressionCluster.update_summaries(method_id=clustering_method.id)
+
         return clustering_method.id
 
 
@@ -347,6 +361,8 @@ class CoexpressionCluster(db.Model):
     # sequence_associations defined in SequenceCoexpressionClusterAssociation'
     # go_enrichment defined in ClusterGOEnrichment
     # clade_enrichment defined in ClusterCladeEnrichment
+    # summary defined in CoexpressionClusterSummary
+    # annotation_counts defined in CoexpressionClusterAnnotationCount
 
     @staticmethod
     def get_cluster(cluster_id):
@@ -398,68 +414,62 @@ class CoexpressionCluster(db.Model):
 
         return {"nodes": nodes, "edges": edges}
 
-    def __calculate_enrichment(self):
-        """
-        Initial implementation to calculate GO enrichment for a single cluster
+    @staticmethod
+    def __load_species_go_data(species_id):
         """
-        gene_count = self.method.network_method.species.sequence_count
-        species_id = self.method.network_method.species_id
+        Loads, for a single species, the members of all co-expression clusters and the non-predicted GO annotation of
+        all sequences. Both are returned as sparse incidence dicts (cluster -> set of sequences and sequence -> set of
+        GO terms) so the overlap with every GO term can be counted in one pass.
 
-        sequences = self.sequences.options(load_only("id")).all()
+        ORM free method for speed !
 
-        associations = SequenceGOAssociation.query\
-            .filter(SequenceGOAssociation.sequence_id.in_([s.id for s in sequences]))\
-            .filter(SequenceGOAssociation.predicted == 0)\
-            .options(load_only("sequence_id", "go_id"))\
-            .group_by(SequenceGOAssociation.sequence_id, SequenceGOAssociation.go_id)
-
-        go_data = {}
+        :param species_id: internal ID of the species
+        :return: tuple with cluster members and sequence GO terms
+        """
+        association_table = SequenceCoexpressionClusterAssociation.__table__
+        cluster_table = CoexpressionCluster.__table__
+        method_table = CoexpressionClusteringMethod.__table__
+        network_table = ExpressionNetworkMethod.__table__
 
-        for a in associations:
-            if a.go_id not in go_data.keys():
-                go_data[a.go_id] = {}
-                go_data[a.go_id]["total_count"] = json.loads(a.go.species_counts)[str(species_id)]
-                go_data[a.go_id]["cluster_count"] = 1
-            else:
-                go_data[a.go_id]["cluster_count"] += 1
+        table = join(association_table, cluster_table, association_table.c.coexpression_cluster_id == cluster_table.c.id).\
+            join(method_table, cluster_table.c.method_id == method_table.c.id).\
+            join(network_table, method_table.c.network_method_id == network_table.c.id)
 
-        p_values = []
-        for go_id in go_data:
-            p_values.append(hypergeo_sf(go_data[go_id]['cluster_count'],
-                                        len(sequences),
-                                        go_data[go_id]['total_count'],
-                                        gene_count))
+        memberships = db.engine.execute(
+            db.select([association_table.c.coexpression_cluster_id, association_table.c.sequence_id]).
+            select_from(table).
+            where(network_table.c.species_id == species_id).
+            where(association_table.c.sequence_id.isnot(None))).fetchall()
 
-        corrected_p_values = fdr_correction(p_values)
+        cluster_members = defaultdict(set)
+        for cluster_id, sequence_id in memberships:
+            cluster_members[cluster_id].add(sequence_id)
 
-        for i, go_id in enumerate(go_data):
-            enrichment = ClusterGOEnrichment()
-            enrichment.cluster_id = self.id
-            enrichment.go_id = go_id
+        go_table = SequenceGOAssociation.__table__
+        sequence_table = Sequence.__table__
 
-            enrichment.cluster_count = go_data[go_id]['cluster_count']
-            enrichment.cluster_size = len(sequences)
-            enrichment.go_count = go_data[go_id]['total_count']
-            enrichment.go_size = gene_count
+        associations = db.engine.execute(
+            db.select([go_table.c.sequence_id, go_table.c.go_id], distinct=True).
+            select_from(join(go_table, sequence_table, go_table.c.sequence_id == sequence_table.c.id)).
+            where(sequence_table.c.species_id == species_id).
+            where(go_table.c.predicted == 0)).fetchall()
 
-            enrichment.enrichment = log2((go_data[go_id]['cluster_count']/len(sequences))/(go_data[go_id]['total_count']/gene_count))
-            enrichment.p_value = p_values[i]
-            enrichment.corrected_p_value = corrected_p_values[i]
+        sequence_go = defaultdict(set)
+        for sequence_id, go_id in associations:
+            sequence_go[sequence_id].add(go_id)
 
-            db.session.add(enrichment)
-
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(e)
+        return cluster_members, sequence_go
 
     @staticmethod
-    def calculate_enrichment(empty=True):
+    def calculate_enrichment(empty=True, processes=1):
         """
-        Static method to calculate the enrichment for all cluster in the database
+        Static method to calculate the GO enrichment for all clusters in the database.
+
+        Clusters are processed per species, the data for each species is loaded with two queries and results are
+        written in bulk. With processes > 1 the enrichment for different species is computed in parallel.
 
         :param empty: empty table cluster_go_enrichment first
+        :param processes: number of worker processes to use (default = 1)
         """
         # If required empty the table first
         if empty:
@@ -469,103 +479,48 @@ class CoexpressionCluster(db.Model):
             except Exception as e:
                 db.session.rollback()
                 print(e)
-            else:
-                clusters = CoexpressionCluster.query.all()
+                return
 
-                for i, cluster in enumerate(clusters):
-                    # print(i, "\t cluster: ", cluster.method_id, cluster.name)
-                    cluster.__calculate_enrichment()
+        species = db.engine.execute(
+            db.select([Species.__table__.c.id, Species.__table__.c.sequence_count])).fetchall()
 
-    def __calculate_clade_enrichment(self, background, gf_method_id):
-        """
-        Calculates the clade enrichment for a co-expression cluster (i.e. if genes which originated in a certain clade
-        are overrepresented). A background is required (how many genes there are per clade in the organism) and the
-        gene family method those clades are based on.
+        def species_data():
+            for species_id, gene_count in species:
+                if not gene_count:
+                    print("No sequence count for species %d, update the counts first. Skipping..." % species_id)
+                    continue
 
-        Calculations will be immediately committed to the DB.
+                cluster_members, sequence_go = CoexpressionCluster.__load_species_go_data(species_id)
 
-        :param background: dict with background
-        :param gf_method_id: internal ID of gene family method
-        """
-        species_gene_count = self.method.network_method.species.sequence_count
-        species_id = self.method.network_method.species_id
+                if len(cluster_members) > 0:
+                    yield cluster_members, sequence_go, gene_count
 
-        cluster_clade_count = defaultdict(lambda: 0)
-
-        cluster_gene_count = self.sequences.count()
-
-        try:
-            sequences = self.sequences.\
-                join(SequenceFamilyAssociation, Sequence.id == SequenceFamilyAssociation.sequence_id).\
-                join(GeneFamily, SequenceFamilyAssociation.gene_family_id == GeneFamily.id).\
-                add_columns(Sequence.name,
-                            Sequence.species_id,
-                            SequenceFamilyAssociation.gene_family_id,
-                            GeneFamily.method_id,
-                            GeneFamily.clade_id).\
-                filter(GeneFamily.method_id == gf_method_id).all()
-        except Exception as e:
-            print(e, file=sys.stderr)
-
-        for s in sequences:
-            cluster_clade_count[s.clade_id] += 1
-
-        enrichment_scores = []
+        if processes > 1:
+            with Pool(processes) as pool:
+                for enrichments in pool.imap_unordered(cluster_go_enrichment, species_data()):
+                    CoexpressionCluster.__add_go_enrichment(enrichments)
+        else:
+            for data in species_data():
+                CoexpressionCluster.__add_go_enrichment(cluster_go_enrichment(data))
 
-        for clade_id, count in cluster_clade_count.items():
-            try:
-                background_count = background[species_id][clade_id]
-                p_value = hypergeo_sf(count,
-                                      cluster_gene_count,
-                                      background_count,
-                                      species_gene_count)
-                enrichment = log2((count/cluster_gene_count)/(background_count/species_gene_count))
-
-                enrichment_scores.append({
-                    'clade_count': background_count,
-                    'clade_size': species_gene_count,
-                    'cluster_count': count,
-                    'cluster_size': cluster_gene_count,
-                    'p_value': p_value,
-                    'enrichment': enrichment,
-                    'clade_id': clade_id,
-                    'cluster_id': self.id
-                })
+    @staticmethod
+    def __add_go_enrichment(enrichments):
+        """
+        Writes GO enrichment to the database in chunks of 400 rows
 
-            except Exception as e:
-                print(e, file=sys.stderr)
-
-        corrected_p_values = fdr_correction([es['p_value'] for es in enrichment_scores])
-
-        commit_required = False
-        for es, corrected_p_value in zip(enrichment_scores, corrected_p_values):
-            if es['p_value'] < 0.05 and es['enrichment'] > 0:
-                commit_required = True
-                cluster_clade_enrichment = ClusterCladeEnrichment()
-                cluster_clade_enrichment.p_value = es['p_value']
-                cluster_clade_enrichment.corrected_p_value = corrected_p_value
-                cluster_clade_enrichment.enrichment = es['enrichment']
-                cluster_clade_enrichment.clade_id = es['clade_id']
-                cluster_clade_enrichment.cluster_id = es['cluster_id']
-                cluster_clade_enrichment.gene_family_method_id = gf_method_id
-                cluster_clade_enrichment.clade_count = es['clade_count']
-                cluster_clade_enrichment.clade_size = es['clade_size']
-                cluster_clade_enrichment.cluster_count = es['cluster_count']
-                cluster_clade_enrichment.cluster_size = es['cluster_size']
-
-                db.session.add(cluster_clade_enrichment)
-
-        if commit_required:
-            try:
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
-                print(e)
+        :param enrichments: list of dicts with the values for ClusterGOEnrichment
+        """
+        for i in range(0, len(enrichments), 400):
+            db.engine.execute(ClusterGOEnrichment.__table__.insert(), enrichments[i: i + 400])
 
     @staticmethod
     def calculate_clade_enrichment(gene_family_method_id, empty=True):
         """
-        Calculates clade enrichment for co-expression clusters
+        Calculates clade enrichment for co-expression clusters (i.e. if genes which originated in a certain clade
+        are overrepresented).
+
+        The background (genes per clade in each species) and the number of genes per cluster and clade are obtained
+        with aggregate queries, p-values are computed in batch and enriched clades are written in bulk.
 
         :param gene_family_method_id: gene family method to use to determine clades
         :param empty: when true, removes clade enrichments for the current gf_method
@@ -582,17 +537,88 @@ class CoexpressionCluster(db.Model):
 
         print("Calculating background...", sep='')
         gf_method = GeneFamilyMethod.query.get(gene_family_method_id)
-        counts = gf_method.get_clade_distribution()
+        background = gf_method.get_clade_distribution()
         print(' Done!')
 
-        # calculate enrichment
         print("Calculate enrichment", sep='')
 
-        clusters = CoexpressionCluster.query.all()
+        association_table = SequenceCoexpressionClusterAssociation.__table__
+        family_association_table = SequenceFamilyAssociation.__table__
+        family_table = GeneFamily.__table__
+        cluster_table = CoexpressionCluster.__table__
+        method_table = CoexpressionClusteringMethod.__table__
+        network_table = ExpressionNetworkMethod.__table__
+        species_table = Species.__table__
+
+        # Species and background size for each cluster
+        cluster_species = db.engine.execute(
+            db.select([cluster_table.c.id, species_table.c.id, species_table.c.sequence_count]).
+            select_from(join(cluster_table, method_table, cluster_table.c.method_id == method_table.c.id).
+                        join(network_table, method_table.c.network_method_id == network_table.c.id).
+                        join(species_table, network_table.c.species_id == species_table.c.id))).fetchall()
+
+        # Number of genes in each cluster
+        cluster_sizes = dict(db.engine.execute(
+            db.select([association_table.c.coexpression_cluster_id, db.func.count()]).
+            where(association_table.c.sequence_id.isnot(None)).
+            group_by(association_table.c.coexpression_cluster_id)).fetchall())
+
+        # Number of genes in each cluster per clade
+        cluster_clade_counts = db.engine.execute(
+            db.select([association_table.c.coexpression_cluster_id, family_table.c.clade_id, db.func.count()]).
+            select_from(join(association_table, family_association_table,
+                             association_table.c.sequence_id == family_association_table.c.sequence_id).
+                        join(family_table, family_association_table.c.gene_family_id == family_table.c.id)).
+            where(family_table.c.method_id == gene_family_method_id).
+            where(family_table.c.clade_id.isnot(None)).
+            group_by(association_table.c.coexpression_cluster_id, family_table.c.clade_id)).fetchall()
+
+        clade_counts = defaultdict(dict)
+        for cluster_id, clade_id, count in cluster_clade_counts:
+            clade_counts[cluster_id][clade_id] = count
+
+        enrichment_scores = []
+
+        for cluster_id, species_id, species_gene_count in cluster_species:
+            if cluster_id not in clade_counts.keys() or not species_gene_count:
+                continue
+
+            cluster_gene_count = cluster_sizes[cluster_id]
+
+            tests = [{'clade_count': background[species_id][clade_id],
+                      'clade_size': species_gene_count,
+                      'cluster_count': count,
+                      'cluster_size': cluster_gene_count,
+                      'clade_id': clade_id,
+                      'cluster_id': cluster_id,
+                      'gene_family_method_id': gene_family_method_id}
+                     for clade_id, count in clade_counts[cluster_id].items()]
+
+            # skip counts that cannot be drawn from the background (e.g. outdated sequence counts)
+            valid_tests = [t for t in tests
+                           if t['cluster_count'] <= t['clade_count'] <= t['clade_size']
+                           and t['cluster_size'] <= t['clade_size']
+                           and t['clade_size'] - t['clade_count'] >= t['cluster_size'] - t['cluster_count']]
+
+            if len(valid_tests) < len(tests):
+                print("Skipped %d clade(s) for cluster %d, counts exceed background" %
+                      (len(tests) - len(valid_tests), cluster_id), file=sys.stderr)
+            tests = valid_tests
+
+            p_values = hypergeo_sf_many([(t['cluster_count'], t['cluster_size'], t['clade_count'], t['clade_size'])
+                                         for t in tests])
+            corrected_p_values = fdr_correction(p_values)
+
+            for t, p_value, corrected_p_value in zip(tests, p_values, corrected_p_values):
+                t['p_value'] = p_value
+                t['corrected_p_value'] = corrected_p_value
+                t['enrichment'] = log2((t['cluster_count']/t['cluster_size'])/(t['clade_count']/t['clade_size']))
 
-        for i, cluster in enumerate(clusters):
-            print(i, "\t cluster: ", cluster.method_id, cluster.name)
-            cluster.__calculate_clade_enrichment(counts, gene_family_method_id)
+                if p_value < 0.05 and t['enrichment'] > 0:
+                    enrichment_scores.append(t)
+
+        for i in range(0, len(enrichment_scores), 400):
+            db.engine.execute(ClusterCladeEnrichment.__table__.insert(), enrichment_scores[i: i + 400])
 
         print(" Done!")
 
@@ -610,21 +636,59 @@ class CoexpressionCluster(db.Model):
             db.session.rollback()
             print(e)
 
+    @staticmethod
+    def __shared_families(cluster_to_families):
+        """
+        Generator that yields all pairs of clusters that share at least one gene family. A family -> cluster inverted
+        index is used so pairs without shared families are never visited.
+
+        :param cluster_to_families: dict with for each cluster a set of gene families
+        :return: tuples with source cluster, target cluster and the number of shared families
+        """
+        keys = list(cluster_to_families.keys())
+
+        # postings are sorted as clusters are added in order
+        family_to_clusters = defaultdict(list)
+        for i, cluster_id in enumerate(keys):
+            for family_id in cluster_to_families[cluster_id]:
+                family_to_clusters[family_id].append(i)
+
+        for i, cluster_id in enumerate(keys):
+            shared = defaultdict(lambda: 0)
+
+            for family_id in cluster_to_families[cluster_id]:
+                postings = family_to_clusters[family_id]
+                for j in postings[bisect_right(postings, i):]:
+                    shared[j] += 1
+
+            for j, count in shared.items():
+                yield cluster_id, keys[j], count
+
     @staticmethod
     @benchmark
-    def calculate_similarities(gene_family_method_id=1, percentile_pass=0.95):
+    def calculate_similarities(gene_family_method_id=1, percentile_pass=0.95, permutations=1000, seed=None):
         """
-        This function will calculate ALL similarities between clusters in the database. Results will be added to the
-        DB
+        This function will calculate the similarities between all clusters in the database that share gene families.
+        Results passing the percentile based cutoff will be added to the DB
+
+        Pairs are scored in two passes over an inverted index, the first builds a histogram of the jaccard indexes
+        to determine the cutoff, the second stores the pairs that pass it. Pairs without shared families (jaccard index
+        of 0) are not considered.
+
+        P-values are obtained by permuting the family labels of clustered genes while keeping the cluster sizes fixed.
+        Null distributions are sampled once per pair of size buckets and FDR correction is applied over all scored
+        pairs.
 
         :param gene_family_method_id: Internal ID of gene family method to use to calculate the scores (default = 1)
         :param percentile_pass: percentile based cutoff (default = 0.95)
+        :param permutations: number of permutations for each null distribution (default = 1000)
+        :param seed: seed for the random number generator, set for reproducible p-values (default = None)
         """
 
         # sqlalchemy to fetch cluster associations
         fields = [SequenceCoexpressionClusterAssociation.__table__.c.sequence_id,
                   SequenceCoexpressionClusterAssociation.__table__.c.coexpression_cluster_id]
-        condition = SequenceCoexpressionClusterAssociation.__table__.c.sequence_id is not None
+        condition = SequenceCoexpressionClusterAssociation.__table__.c.sequence_id.isnot(None)
         cluster_associations = db.engine.execute(db.select(fields).where(condition)).fetchall()
 
         # sqlalchemy to fetch sequence family associations
@@ -636,46 +700,289 @@ class CoexpressionCluster(db.Model):
         # convert sqlachemy results into dictionary
         sequence_to_family = {seq_id: fam_id for seq_id, fam_id, method_id in sequence_families}
 
-        cluster_to_sequences = {}
-        cluster_to_families = {}
+        cluster_to_labels = defaultdict(list)
 
         for seq_id, cluster_id in cluster_associations:
-            if cluster_id not in cluster_to_sequences.keys():
-                cluster_to_sequences[cluster_id] = []
-            cluster_to_sequences[cluster_id].append(seq_id)
+            if seq_id in sequence_to_family.keys():
+                cluster_to_labels[cluster_id].append(sequence_to_family[seq_id])
+
+        # only clusters with more than four families are compared
+        cluster_to_families = {k: set(v) for k, v in cluster_to_labels.items() if len(set(v)) > 4}
+        cluster_sizes = {k: len(cluster_to_labels[k]) for k in cluster_to_families.keys()}
+
+        # pool of family labels to permute, bucket clusters by size (half-octaves) to share null distributions
+        labels = [f for k in cluster_to_families.keys() for f in cluster_to_labels[k]]
+
+        size_buckets = defaultdict(list)
+        for cluster_id, size in cluster_sizes.items():
+            size_buckets[int(2*log2(size))].append(size)
+
+        bucket_sizes = {b: round(sum(sizes)/len(sizes)) for b, sizes in size_buckets.items()}
+
+        rng = random.Random(seed)
+        null_distributions = {}
+
+        def p_value(source_id, target_id, j):
+            bucket = tuple(sorted([int(2*log2(cluster_sizes[source_id])), int(2*log2(cluster_sizes[target_id]))]))
+            if bucket not in null_distributions.keys():
+                # the rounded mean sizes can exceed the pool when a bucket holds most of the labelled genes
+                size_a = min(bucket_sizes[bucket[0]], len(labels))
+                size_b = min(bucket_sizes[bucket[1]], len(labels) - size_a)
+                null_distributions[bucket] = jaccard_null_distribution(labels,
+                                                                        size_a,
+                                                                        size_b,
+                                                                        permutations=permutations,
+                                                                        rng=rng)
+
+            return empirical_p_value(null_distributions[bucket], j)
+
+        def similarities():
+            for source_id, target_id, shared in CoexpressionCluster.__shared_families(cluster_to_families):
+                union = len(cluster_to_families[source_id]) + len(cluster_to_families[target_id]) - shared
+                j = shared/union
+                yield source_id, target_id, j, p_value(source_id, target_id, j)
+
+        # first pass, histograms of all scores and p-values to find the cutoff and apply FDR correction
+        histogram = defaultdict(lambda: 0)
+        p_histogram = defaultdict(lambda: 0)
+        for _, _, j, p in similarities():
+            histogram[j] += 1
+            p_histogram[p] += 1
+
+        pair_count = sum(histogram.values())
+
+        if pair_count == 0:
+            print("No similar clusters found!")
+            return
+
+        cutoff_rank = int(pair_count*percentile_pass)
+        seen = 0
+        for j in sorted(histogram.keys()):
+            seen += histogram[j]
+            if seen > cutoff_rank:
+                percentile_cutoff = j
+                break
+
+        # p-values take few distinct values, Benjamini-Hochberg is applied per distinct value: the rank (max) of each
+        # follows from the cumulative histogram, going from the largest p-value down the adjusted values are kept
+        # monotone with a running minimum (step-up)
+        corrected_p = {}
+        current = 1
+        seen = pair_count
+        for p in sorted(p_histogram.keys(), reverse=True):
+            current = min(current, p * pair_count/seen)
+            corrected_p[p] = current
+            seen -= p_histogram[p]
+
+        # second pass, store pairs that pass the cutoff
+        database = []
+        for source_id, target_id, j, p in similarities():
+            if j >= percentile_cutoff:
+                database.append({'source_id': source_id,
+                                 'target_id': target_id,
+                                 'gene_family_method_id': gene_family_method_id,
+                                 'jaccard_index': j,
+                                 'p_value': p,
+                                 'corrected_p_value': corrected_p[p]})
+
+            if len(database) >= 400:
+                db.engine.execute(CoexpressionClusterSimilarity.__table__.insert(), database)
+                database = []
+
+        if len(database) > 0:
+            db.engine.execute(CoexpressionClusterSimilarity.__table__.insert(), database)
 
-        for cluster_id, sequences in cluster_to_sequences.items():
-            families = list(set([sequence_to_family[s] for s in sequences if s in sequence_to_family.keys()]))
-            if len(families) > 0:
-                cluster_to_families[cluster_id] = families
+    @staticmethod
+    def summarize_profiles(profiles):
+        """
+        Averages a set of expression profiles. For each profile the TPM values are averaged per anatomy class and
+        scaled to the maximum, next the mean, median and standard deviation for each class are determined. The
+        eigengene is the first principal component of the log-transformed profiles (see utils.expression.eigengene)
 
-        keys = list(cluster_to_families.keys())
+        :param profiles: list of profiles (JSON strings as stored in the database)
+        :return: dict with order, colors, mean, median, stdev, eigengene and eigengene_variance (fraction of variance
+            explained by the eigengene), None if there are no profiles with TPM values and anatomy classes
+        """
+        # profiles without TPM values or anatomy classes (e.g. added with other tools) can't be summarized
+        profiles = [data for data in (json.loads(p) for p in profiles)
+                    if data.get("data", {}).get("tpm") and data["data"].get("po_anatomy_class")]
 
-        data = []
+        if len(profiles) == 0:
+            return None
 
-        for i in range(len(keys) - 1):
-            for j in range(i+1, len(keys)):
-                current_keys = [keys[x] for x in [i, j]]
-                current_families = [cluster_to_families[k] for k in current_keys]
+        first = profiles[0]
+        labels = first.get("order", [])
 
-                if len(current_families[0]) > 4 and len(current_families[1]) > 4:
-                    j = jaccard(current_families[0], current_families[1])
-                    data.append([current_keys[0], current_keys[1], j])
+        datasets = []
+        log_values = []
 
-        ordered_j = sorted([a[2] for a in data])
-        if len(ordered_j) > 0:
-            percentile_cutoff = ordered_j[int(len(ordered_j)*percentile_pass)]
+        for data in profiles:
+            processed_values = defaultdict(list)
+            for key, value in data["data"]["tpm"].items():
+                if key in data["data"]["po_anatomy_class"].keys():
+                    processed_values[data["data"]["po_anatomy_class"][key]].append(value)
 
-            database = [{'source_id': d[0],
-                         'target_id': d[1],
-                         'gene_family_method_id': gene_family_method_id,
-                         'jaccard_index': d[2],
-                         'p_value': 0,
-                         'corrected_p_value': 0} for d in data if d[2] >= percentile_cutoff]
+            # classes in the order without samples are set to zero
+            expression_values = [mean(processed_values[label]) if label in processed_values.keys() else 0
+                                 for label in labels]
 
-            db.engine.execute(CoexpressionClusterSimilarity.__table__.insert(), database)
-        else:
-            print("No similar clusters found!")
+            log_values.append([log2(value + 1) for value in expression_values])
+
+            max_expression = max(expression_values)
+            datasets.append([value/max_expression if max_expression != 0 else 0 for value in expression_values])
+
+        values = list(zip(*datasets))
+        eigengene_values, eigengene_variance = eigengene(log_values)
+
+        return {"order": labels,
+                "colors": first["colors"] if "colors" in first.keys() else None,
+                "mean": [mean(v) for v in values],
+                "median": [median(v) for v in values],
+                "stdev": [stdev(v) if len(v) > 1 else None for v in values],
+                "eigengene": eigengene_values,
+                "eigengene_variance": eigengene_variance}
+
+    @staticmethod
+    def get_profile_summaries(method_id):
+        """
+        Gets the average profile and eigengene of all clusters from one clustering method. Pre-calculated summaries
+        are loaded along with the clusters, only clusters without summary are calculated from the member profiles
+
+        :param method_id: internal ID of the clustering method
+        :return: list of tuples with the cluster and its profile summary (see summarize_profiles)
+        """
+        clusters = CoexpressionCluster.query.filter_by(method_id=method_id).\
+            options(joinedload('summary')).\
+            order_by(CoexpressionCluster.name).all()
+
+        return [(c, c.profile_summary) for c in clusters]
+
+    @staticmethod
+    def update_summaries(cluster_ids=None, method_id=None, species_id=None):
+        """
+        Pre-calculates the member count, average profile and InterPro, GO, CAZYme and gene family counts of clusters
+        so cluster pages don't need to aggregate those on every request. Existing summaries of the selected clusters
+        are replaced, run this again for clusters whose members or annotation changed.
+
+        :param cluster_ids: list of internal cluster IDs to update (all clusters if None)
+        :param method_id: only update clusters from this clustering method (ignored if None)
+        :param species_id: only update clusters of networks for this species (ignored if None)
+        """
+        query = db.session.query(CoexpressionCluster.id)
+
+        if cluster_ids is not None:
+            if len(cluster_ids) == 0:
+                return
+            query = query.filter(CoexpressionCluster.id.in_(cluster_ids))
+
+        if method_id is not None:
+            query = query.filter(CoexpressionCluster.method_id == method_id)
+
+        if species_id is not None:
+            query = query.join(CoexpressionClusteringMethod, CoexpressionCluster.method_id == CoexpressionClusteringMethod.id).\
+                join(ExpressionNetworkMethod, CoexpressionClusteringMethod.network_method_id == ExpressionNetworkMethod.id).\
+                filter(ExpressionNetworkMethod.species_id == species_id)
+
+        cluster_ids = [c.id for c in query.all()]
+
+        for i in range(0, len(cluster_ids), 400):
+            CoexpressionCluster.__update_summaries_batch(cluster_ids[i:i + 400])
+
+    @staticmethod
+    def __update_summaries_batch(cluster_ids):
+        """
+        Replaces the summaries of a set of clusters, all counts are aggregated in the database with one query per
+        annotation type
+
+        :param cluster_ids: list of internal cluster IDs
+        """
+        members = db.session.query(SequenceCoexpressionClusterAssociation.coexpression_cluster_id.label('cluster_id'),
+                                   SequenceCoexpressionClusterAssociation.sequence_id.label('sequence_id')).\
+            filter(SequenceCoexpressionClusterAssociation.coexpression_cluster_id.in_(cluster_ids)).\
+            filter(SequenceCoexpressionClusterAssociation.sequence_id.isnot(None)).\
+            distinct().subquery()
+
+        member_counts = dict(db.session.query(members.c.cluster_id, func.count(members.c.sequence_id)).
+                             group_by(members.c.cluster_id).all())
+
+        profiles = defaultdict(list)
+        for cluster_id, profile in db.session.query(members.c.cluster_id, ExpressionProfile.profile).\
+                select_from(members).\
+                join(ExpressionProfile, ExpressionProfile.sequence_id == members.c.sequence_id).all():
+            profiles[cluster_id].append(profile)
+
+        summaries = []
+        for cluster_id in cluster_ids:
+            profile = CoexpressionCluster.summarize_profiles(profiles[cluster_id])
+            summaries.append({"cluster_id": cluster_id,
+                              "member_count": member_counts.get(cluster_id, 0),
+                              "profile": json.dumps(profile) if profile is not None else None})
+
+        annotation_counts = []
+        for annotation_type, association, annotation_id, filters in [
+                ('interpro', SequenceInterproAssociation, SequenceInterproAssociation.interpro_id, []),
+                ('go', SequenceGOAssociation, SequenceGOAssociation.go_id, [SequenceGOAssociation.predicted == 0]),
+                ('cazyme', SequenceCAZYmeAssociation, SequenceCAZYmeAssociation.cazyme_id, []),
+                ('family', SequenceFamilyAssociation, SequenceFamilyAssociation.gene_family_id, [])]:
+            counts = db.session.query(members.c.cluster_id, annotation_id,
+                                      func.count(association.id),
+                                      func.count(distinct(association.sequence_id)),
+                                      func.count(distinct(Sequence.species_id))).\
+                select_from(members).\
+                join(association, association.sequence_id == members.c.sequence_id).\
+                join(Sequence, Sequence.id == association.sequence_id).\
+                filter(*filters).\
+                group_by(members.c.cluster_id, annotation_id).all()
+
+            for cluster_id, a_id, count, sequence_count, species_count in counts:
+                annotation_counts.append({"cluster_id": cluster_id,
+                                          "annotation_type": annotation_type,
+                                          "annotation_id": a_id,
+                                          "count": count,
+                                          "sequence_count": sequence_count,
+                                          "species_count": species_count})
+
+        try:
+            CoexpressionClusterAnnotationCount.query.\
+                filter(CoexpressionClusterAnnotationCount.cluster_id.in_(cluster_ids)).\
+                delete(synchronize_session=False)
+            CoexpressionClusterSummary.query.\
+                filter(CoexpressionClusterSummary.cluster_id.in_(cluster_ids)).\
+                delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+
+        for i in range(0, len(summaries), 400):
+            db.engine.execute(CoexpressionClusterSummary.__table__.insert(), summaries[i:i + 400])
+
+        for i in range(0, len(annotation_counts), 400):
+            db.engine.execute(CoexpressionClusterAnnotationCount.__table__.insert(), annotation_counts[i:i + 400])
+
+    def __summary_stats(self, annotation_type, model, key):
+        """
+        Reads pre-calculated annotation counts of the current cluster, in the same format as the sequence_stats
+        functions of the annotation models
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param model: model of the annotation
+        :param key: key to store the annotation object in the output
+        :return: dict with stats for each annotation
+        """
+        counts = self.annotation_counts.filter_by(annotation_type=annotation_type).\
+            order_by(CoexpressionClusterAnnotationCount.count.desc()).all()
+
+        if len(counts) == 0:
+            return {}
+
+        annotations = {a.id: a for a in model.query.filter(model.id.in_([c.annotation_id for c in counts])).all()}
+
+        return {c.annotation_id: {key: annotations[c.annotation_id],
+                                  'count': c.count,
+                                  'sequence_count': c.sequence_count,
+                                  'species_count': c.species_count}
+                for c in counts if c.annotation_id in annotations.keys()}
 
     @property
     def profiles(self):
@@ -692,7 +999,29 @@ class CoexpressionCluster(db.Model):
 
         return profiles
 
+    @property
+    def profile_summary(self):
+        """
+        Get the average profile of the cluster members, read from the pre-calculated summary when available
+
+        :return: dict with order, colors, mean, median and stdev (see summarize_profiles)
+        """
+        if self.summary is not None:
+            return json.loads(self.summary.profile) if self.summary.profile is not None else None
+
+        return CoexpressionCluster.summarize_profiles([p.profile for p in self.profiles])
+
+    @property
+    def sequence_count(self):
+        """
+        Get the number of sequences in the cluster, read from the pre-calculated summary when available
+
+        :return: number of sequences
+        """
+        if self.summary is not None:
+            return self.summary.member_count
 
+        return len(self.sequences.with_entities(Sequence.id).all())
 
     @property
     def interpro_stats(self):
@@ -701,9 +1030,10 @@ class CoexpressionCluster(db.Model):
 
         :return: Interpro statistics
         """
-        sequence_ids = [s.id for s in self.sequences.all()]
+        if self.summary is not None:
+            return self.__summary_stats('interpro', Interpro, 'domain')
 
-        return Interpro.sequence_stats(sequence_ids)
+        return Interpro.sequence_stats_subquery(self.sequences)
 
     @property
     def go_stats(self):
@@ -712,9 +1042,10 @@ class CoexpressionCluster(db.Model):
 
         :return: GO statistics
         """
-        sequence_ids = [s.id for s in self.sequences.all()]
+        if self.summary is not None:
+            return self.__summary_stats('go', GO, 'go')
 
-        return GO.sequence_stats(sequence_ids)
+        return GO.sequence_stats_subquery(self.sequences)
 
     @property
     def cazyme_stats(self):
@@ -723,9 +1054,10 @@ class CoexpressionCluster(db.Model):
 
         :return: CAZYme statistics
         """
-        sequence_ids = [s.id for s in self.sequences.all()]
+        if self.summary is not None:
+            return self.__summary_stats('cazyme', CAZYme, 'cazyme')
 
-        return CAZYme.sequence_stats(sequence_ids)
+        return CAZYme.sequence_stats_subquery(self.sequences)
 
     @property
     def family_stats(self):
@@ -734,6 +1066,7 @@ class CoexpressionCluster(db.Model):
 
         :return: gene family statistics
         """
-        sequence_ids = [s.id for s in self.sequences.all()]
+        if self.summary is not None:
+            return self.__summary_stats('family', GeneFamily, 'family')
 
-        return GeneFamily.sequence_stats(sequence_ids)
+        return GeneFamily.sequence_stats_subquery(self.sequences)
@@ -0,0 +1,208 @@
+"""
+Database-native full-text indexes for the text fields used by the search (sequence descriptions, GO, InterPro and
+CAZYme descriptions).
+
+  * SQLite: FTS5 virtual tables (external content) kept in sync with the original tables using triggers
+
+  * MySQL: FULLTEXT indexes on the original tables, these are maintained by MySQL itself
+
+The indexes are created together with the tables (db.create_all) and can be (re-)built for existing databases using
+FullTextIndex.create(). For other database engines the search falls back to LIKE queries.
+"""
+from conekt import db
+
+from sqlalchemy import event, text, or_, and_
+
+import re
+
+FULL_TEXT_COLUMNS = {
+    'sequences': ['name', 'description'],
+    'go': ['name', 'description'],
+    'interpro': ['label', 'description'],
+    'cazyme': ['family', 'cazyme_class', 'activities']
+}
+
+
+class FullTextIndex:
+    @staticmethod
+    def create(connection=None):
+        """
+        Creates missing full-text indexes, existing indexes are left untouched. New SQLite indexes are populated with
+        the current content of the tables.
+
+        :param connection: connection to use (default: a new connection from db.engine)
+        """
+        if connection is None:
+            with db.engine.begin() as connection:
+                FullTextIndex.create(connection)
+            return
+
+        for table, columns in FULL_TEXT_COLUMNS.items():
+            if connection.dialect.name == 'sqlite':
+                FullTextIndex.__create_sqlite(connection, table, columns)
+            elif connection.dialect.name == 'mysql':
+                FullTextIndex.__create_mysql(connection, table, columns)
+
+    @staticmethod
+    def drop(connection=None):
+        """
+        Removes the SQLite FTS5 tables (MySQL indexes are removed together with their tables)
+
+        :param connection: connection to use (default: a new connection from db.engine)
+        """
+        if connection is None:
+            with db.engine.begin() as connection:
+                FullTextIndex.drop(connection)
+            return
+
+        if connection.dialect.name == 'sqlite':
+            for table in FULL_TEXT_COLUMNS.keys():
+                connection.execute(text('DROP TABLE IF EXISTS %s_fts' % table))
+
+    @staticmethod
+    def rebuild():
+        """
+        Rebuilds all SQLite FTS5 tables from the original tables, MySQL keeps FULLTEXT indexes up to date by itself
+        """
+        with db.engine.begin() as connection:
+            FullTextIndex.create(connection)
+
+            if connection.dialect.name == 'sqlite':
+                for table in FULL_TEXT_COLUMNS.keys():
+                    connection.execute(text("INSERT INTO %s_fts(%s_fts) VALUES('rebuild')" % (table, table)))
+
+    @staticmethod
+    def __create_sqlite(connection, table, columns):
+        fts_table = table + '_fts'
+
+        exists = connection.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name=:name"),
+                                    name=fts_table).fetchone() is not None
+
+        if exists:
+            return
+
+        new_values = ', '.join(['new.' + c for c in columns])
+        old_values = ', '.join(['old.' + c for c in columns])
+        column_list = ', '.join(columns)
+
+        connection.execute(text("CREATE VIRTUAL TABLE %s USING fts5(%s, content='%s', content_rowid='id')" %
+                                (fts_table, column_list, table)))
+
+        connection.execute(text("""CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN
+            INSERT INTO %s(rowid, %s) VALUES (new.id, %s);
+        END""" % (fts_table, table, fts_table, column_list, new_values)))
+        connection.execute(text("""CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN
+            INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s);
+        END""" % (fts_table, table, fts_table, fts_table, column_list, old_values)))
+        connection.execute(text("""CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN
+            INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s);
+            INSERT INTO %s(rowid, %s) VALUES (new.id, %s);
+        END""" % (fts_table, table, fts_table, fts_table, column_list, old_values, fts_table, column_list, new_values)))
+
+        connection.execute(text("INSERT INTO %s(%s) VALUES('rebuild')" % (fts_table, fts_table)))
+
+    @staticmethod
+    def __create_mysql(connection, table, columns):
+        index_name = 'ft_' + table
+
+        exists = connection.execute(text("""SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = :table AND index_name = :index"""),
+                                    table=table, index=index_name).scalar() > 0
+
+        if not exists:
+            connection.execute(text("ALTER TABLE %s ADD FULLTEXT INDEX %s (%s)" %
+                                    (table, index_name, ', '.join(columns))))
+
+    @staticmethod
+    def parse_query(term_string):
+        """
+        Splits a search string in terms. Text between double quotes is kept together as a phrase, terms ending with
+        * are used as prefix. Punctuation is removed, terms like heat-shock are considered a phrase.
+
+        :param term_string: search string, e.g. '"heat shock" transcript*'
+        :return: list of tuples with a list of words and a boolean (True for prefix searches)
+        """
+        output = []
+
+        for phrase, term in re.findall(r'"([^"]*)"|(\S+)', term_string):
+            words = re.findall(r'\w+', phrase if phrase != '' else term)
+
+            if len(words) > 0:
+                output.append((words, phrase == '' and term.endswith('*')))
+
+        return output
+
+    @staticmethod
+    def __match_string(parsed_query, dialect):
+        """
+        Converts a parsed query (see parse_query) to the syntax of the database engine, all terms are required
+
+        :param parsed_query: list of tuples with a list of words and a boolean (True for prefix searches)
+        :param dialect: name of the SQLAlchemy dialect (sqlite or mysql)
+        :return: string to use in MATCH
+        """
+        output = []
+
+        for words, prefix in parsed_query:
+            if dialect == 'sqlite':
+                output.append('"' + ' '.join(words) + '"' + ('*' if prefix else ''))
+            elif len(words) > 1:
+                output.append('+"' + ' '.join(words) + '"')
+            else:
+                output.append('+' + words[0] + ('*' if prefix else ''))
+
+        return ' '.join(output)
+
+    @staticmethod
+    def search(model, term_string, limit=50):
+        """
+        Full-text search on a model, results are ranked by relevance
+
+        :param model: model to search (Sequence, GO, Interpro or CAZYme)
+        :param term_string: search string (see parse_query)
+        :param limit: maximum number of results
+        :return: list of matching objects, best hits first
+        """
+        table = model.__tablename__
+        columns = FULL_TEXT_COLUMNS[table]
+
+        parsed_query = FullTextIndex.parse_query(term_string)
+
+        if len(parsed_query) == 0:
+            return []
+
+        dialect = db.engine.dialect.name
+        match_string = FullTextIndex.__match_string(parsed_query, dialect)
+
+        if dialect == 'sqlite':
+            ids = db.session.execute(text("SELECT rowid FROM %s_fts WHERE %s_fts MATCH :query "
+                                          "ORDER BY rank LIMIT :limit" % (table, table)),
+                                     {'query': match_string, 'limit': limit}).fetchall()
+        elif dialect == 'mysql':
+            match = "MATCH (%s) AGAINST (:query IN BOOLEAN MODE)" % ', '.join(columns)
+            ids = db.session.execute(text("SELECT id FROM %s WHERE %s ORDER BY %s DESC LIMIT :limit" %
+                                          (table, match, match)),
+                                     {'query': match_string, 'limit': limit}).fetchall()
+        else:
+            return model.query.filter(and_(*[or_(*[getattr(model, c).ilike('%' + ' '.join(words) + '%')
+                                                   for c in columns])
+                                             for words, _ in parsed_query])).limit(limit).all()
+
+        ids = [i[0] for i in ids]
+
+        if len(ids) == 0:
+            return []
+
+        hits = {h.id: h for h in model.query.filter(model.id.in_(ids)).all()}
+
+        return [hits[i] for i in ids if i in hits.keys()]
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_full_text_indexes(target, connection, **kw):
+    FullTextIndex.create(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def drop_full_text_indexes(target, connection, **kw):
+    FullTextIndex.drop(connection)
@@ -0,0 +1,189 @@
+"""
+In-memory trigram index over sequence names and cross-references (e.g. aliases), used to find genes when identifiers
+don't match exactly: different case, version suffixes or transcript tags (AT1G01010.1, Zm00001d000001_T001) or typos.
+Each process builds the index the first time it is used and rebuilds it when sequences or cross-references change.
+Building the index for millions of names takes a while, so this is done in a background thread, requests don't wait
+for it and use the previous index (or no index at all) in the meantime.
+"""
+from flask import current_app
+
+from conekt import db
+from conekt.models.sequences import Sequence
+from conekt.models.species import Species
+from conekt.models.xrefs import XRef
+
+from utils.trigram_index import TrigramIndex
+
+from sqlalchemy import event, func
+
+from itertools import chain
+
+import threading
+import time
+
+REFRESH_INTERVAL = 60
+MAX_RESULTS = 50
+
+
+class FuzzyNames:
+    index = None
+    stale = False
+    builder = None
+    lock = threading.Lock()
+
+    @staticmethod
+    def suggest(term, species_id=None, limit=10, threshold=0.3):
+        """
+        Finds sequences with a name or cross-reference similar to the query
+
+        :param term: (partial or misspelled) gene identifier
+        :param species_id: only include sequences from this species (default: all species)
+        :param limit: maximum number of suggestions (at most MAX_RESULTS)
+        :param threshold: minimal similarity (0 - 1), identifiers identical after normalization score 1
+        :return: list of dicts with the sequence id, name, species code, matched identifier and score, best first
+                 (empty while the index is built for the first time)
+        """
+        current = FuzzyNames.get_index()
+        limit = min(limit, MAX_RESULTS)
+
+        if current is None:
+            return []
+
+        # hits from other species are removed afterwards, so look further when filtering
+        hits = current['index'].search(term, limit=limit if species_id is None else MAX_RESULTS * 10,
+                                       threshold=threshold)
+
+        output = []
+        for score, match, sequence_id in hits:
+            name, sequence_species_id, code = current['sequences'][sequence_id]
+
+            if species_id is not None and sequence_species_id != species_id:
+                continue
+
+            output.append({'id': sequence_id, 'name': name, 'species': code, 'match': match,
+                           'score': round(score, 3)})
+
+            if len(output) >= limit:
+                break
+
+        return output
+
+    @staticmethod
+    def lookup(terms, species_id=None):
+        """
+        Finds sequences with a name or cross-reference identical to the query after normalization (case insensitive,
+        without version suffixes and transcript tags)
+
+        :param terms: list of gene identifiers
+        :param species_id: only include sequences from this species (default: all species)
+        :return: dict with identifiers as keys and lists of sequence IDs as values (identifiers without hits are left
+                 out, nothing is found while the index is built for the first time)
+        """
+        current = FuzzyNames.get_index()
+
+        if current is None:
+            return {}
+
+        output = {}
+        for term in terms:
+            sequence_ids = [i for i in current['index'].exact(term)
+                            if species_id is None or current['sequences'][i][1] == species_id]
+            if len(sequence_ids) > 0:
+                output[term] = sequence_ids
+
+        return output
+
+    @staticmethod
+    def get_index():
+        """
+        Gets the trigram index. If it is missing or outdated it is (re-)built in a background thread and the previous
+        index is returned in the meantime.
+
+        :return: dict with the TrigramIndex and a dict with the name, species ID and species code for each sequence,
+                 None if the index isn't built yet
+        """
+        current = FuzzyNames.index
+
+        if current is not None and not FuzzyNames.stale and time.time() - current['checked'] < REFRESH_INTERVAL:
+            return current
+
+        signature = FuzzyNames.__signature()
+
+        if current is not None and not FuzzyNames.stale and current['signature'] == signature:
+            current['checked'] = time.time()
+            return current
+
+        FuzzyNames.__start_build(signature)
+
+        return current
+
+    @staticmethod
+    def invalidate():
+        """
+        Marks the index as outdated, it will be rebuilt when it is used again
+        """
+        FuzzyNames.stale = True
+
+    @staticmethod
+    def __start_build(signature):
+        """
+        Starts building the index in a background thread, unless a build is running already
+
+        :param signature: signature of the data the index is built from (see __signature)
+        """
+        with FuzzyNames.lock:
+            if FuzzyNames.builder is not None and FuzzyNames.builder.is_alive():
+                return
+
+            FuzzyNames.stale = False
+            FuzzyNames.builder = threading.Thread(target=FuzzyNames.__run_build,
+                                                  args=(current_app._get_current_object(), signature),
+                                                  daemon=True)
+            FuzzyNames.builder.start()
+
+    @staticmethod
+    def __run_build(app, signature):
+        with app.app_context():
+            try:
+                current = FuzzyNames.__build()
+                current['signature'] = signature
+                current['checked'] = time.time()
+                FuzzyNames.index = current
+            except Exception as e:
+                app.logger.error("Building the fuzzy name index failed: %s" % e)
+                FuzzyNames.stale = True
+            finally:
+                db.session.remove()
+
+    @staticmethod
+    def __signature():
+        """
+        Number of rows and highest ID of the tables used to build the index
+
+        :return: list of (count, max id) tuples
+        """
+        return [tuple(db.session.query(func.count(m.id), func.max(m.id)).one()) for m in [Sequence, XRef]]
+
+    @staticmethod
+    def __build():
+        sequences = {sequence_id: (name, species_id, code) for sequence_id, name, species_id, code in
+                     db.session.query(Sequence.id, Sequence.name, Sequence.species_id, Species.code).
+                     join(Species, Species.id == Sequence.species_id).all()}
+
+        aliases = db.session.query(XRef.name, Sequence.id).select_from(Sequence).join(Sequence.xrefs).\
+            yield_per(10000)
+
+        # generators, so the entries aren't copied into a list first
+        entries = chain(((name, sequence_id) for sequence_id, (name, _, _) in sequences.items() if name is not None),
+                        ((name, sequence_id) for name, sequence_id in aliases if name is not None))
+
+        return {'index': TrigramIndex(entries), 'sequences': sequences}
+
+
+def _invalidate(mapper, connection, target):
+    FuzzyNames.invalidate()
+
+
+for m in [Sequence, XRef]:
+    for e in ['after_insert', 'after_update', 'after_delete']:
+        event.listen(m, e, _invalidate)
@@ -4,13 +4,17 @@ from conekt.models.relationships.sequence_family import SequenceFamilyAssociatio
 from conekt.models.relationships.sequence_sequence_ecc import SequenceSequenceECCAssociation
 from conekt.models.relationships.family_interpro import FamilyInterproAssociation
 from conekt.models.relationships.family_go import FamilyGOAssociation
+from conekt.models.relationships.go_closure import GOClosure
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.sequences import Sequence
+from conekt.models import annotation_stats
 from conekt.models.interpro import Interpro
+from conekt.models.relationships.sequence_interpro import SequenceInterproAssociation
 from conekt.models.go import GO
 
 import re
 import json
-from collections import defaultdict, Counter
+from collections import defaultdict
 
 from sqlalchemy.orm import joinedload, load_only
 from sqlalchemy.sql import or_, and_
@@ -51,68 +55,145 @@ class GeneFamilyMethod(db.Model):
             print(e)
 
     def get_interpro_annotation(self):
-        families = self.families.all()
-
-        relations = []
+        """
+        Assigns the three most common InterPro domains to each family of this method with five or more members
+        """
+        GeneFamilyMethod.update_interpro_annotation(method_id=self.id)
 
-        for f in families:
-            sequences = f.sequences.all()
-            domains = []
+    def get_go_annotation(self):
+        """
+        Assigns the five most common GO terms (excluding predictions and terms close to the root of the ontology) to
+        each family of this method with five or more members
+        """
+        GeneFamilyMethod.update_go_annotation(method_id=self.id)
 
-            # Only consider families with 5 or more members
-            if len(sequences) > 4:
-                for s in sequences:
-                    interpro_ids = list(set([i.interpro_id for i in s.interpro_associations]))
+    @staticmethod
+    def __selected_families(method_id=None, species_id=None):
+        """
+        Builds a query for the IDs of the families to annotate
 
-                    domains += interpro_ids
+        :param method_id: only include families from this method (ignored if None)
+        :param species_id: only include families with members from this species (ignored if None)
+        :return: query returning family IDs
+        """
+        query = db.session.query(GeneFamily.id)
 
-                cnt = Counter(domains)
+        if method_id is not None:
+            query = query.filter(GeneFamily.method_id == method_id)
 
-                for interpro_id, _ in cnt.most_common(3):
-                    relations.append({'gene_family_id': f.id, 'interpro_id': interpro_id})
+        if species_id is not None:
+            species_families = db.session.query(SequenceFamilyAssociation.gene_family_id).\
+                join(Sequence, Sequence.id == SequenceFamilyAssociation.sequence_id).\
+                filter(Sequence.species_id == species_id)
+            query = query.filter(GeneFamily.id.in_(species_families))
 
-            # add 400 sequences at the time, more can cause problems with some database engines
-            if len(relations) > 400:
-                db.engine.execute(FamilyInterproAssociation.__table__.insert(), relations)
-                relations = []
+        return query
 
-        db.engine.execute(FamilyInterproAssociation.__table__.insert(), relations)
+    @staticmethod
+    def __update_family_annotation(model, annotation_column, counts, family_ids, top):
+        """
+        Replaces the annotation of a set of families with the most common terms
 
-    def get_go_annotation(self):
-        from conekt.models.relationships.sequence_go import SequenceGOAssociation
-        families = self.families.all()
+        :param model: association model to store the annotation (FamilyInterproAssociation or FamilyGOAssociation)
+        :param annotation_column: name of the column with the annotation ID in the association model
+        :param counts: list of tuples with family ID, annotation ID and count
+        :param family_ids: query returning the IDs of families for which the annotation is replaced
+        :param top: number of terms to keep per family
+        """
+        family_counts = defaultdict(list)
+        for family_id, annotation_id, count in counts:
+            family_counts[family_id].append((count, annotation_id))
 
         relations = []
+        for family_id, annotations in family_counts.items():
+            for _, annotation_id in sorted(annotations, key=lambda x: (-x[0], x[1]))[:top]:
+                relations.append({'gene_family_id': family_id, annotation_column: annotation_id})
+
+        try:
+            model.query.filter(model.gene_family_id.in_(family_ids.subquery())).delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(e)
+
+        # add 400 relations at the time, more can cause problems with some database engines
+        for i in range(0, len(relations), 400):
+            db.engine.execute(model.__table__.insert(), relations[i:i + 400])
+
+    @staticmethod
+    def __large_families(family_ids, min_size):
+        """
+        Filters a query of family IDs on the number of members
+
+        :param family_ids: query returning family IDs
+        :param min_size: minimal number of members
+        :return: subquery returning the IDs of families with at least min_size members
+        """
+        return db.session.query(SequenceFamilyAssociation.gene_family_id).\
+            filter(SequenceFamilyAssociation.gene_family_id.in_(family_ids.subquery())).\
+            group_by(SequenceFamilyAssociation.gene_family_id).\
+            having(db.func.count(db.distinct(SequenceFamilyAssociation.sequence_id)) >= min_size).subquery()
+
+    @staticmethod
+    def update_interpro_annotation(method_id=None, species_id=None, top=3, min_size=5):
+        """
+        Assigns the most common InterPro domains (by number of members with the domain) to gene families. Counts for
+        all families are obtained with a single aggregate query, existing family annotation is replaced.
+
+        :param method_id: only annotate families from this method (ignored if None)
+        :param species_id: only annotate families with members from this species (ignored if None)
+        :param top: number of domains to assign to each family
+        :param min_size: only consider families with this many members or more
+        """
+        family_ids = GeneFamilyMethod.__selected_families(method_id=method_id, species_id=species_id)
+        large_families = GeneFamilyMethod.__large_families(family_ids, min_size)
 
-        for f in families:
-            # Ignore small families
-            sequence_count = len(f.sequences.all())
-            if sequence_count < 5:
-                break
+        counts = db.session.query(SequenceFamilyAssociation.gene_family_id,
+                                  SequenceInterproAssociation.interpro_id,
+                                  db.func.count(db.distinct(SequenceInterproAssociation.sequence_id))).\
+            join(SequenceInterproAssociation,
+                 SequenceInterproAssociation.sequence_id == SequenceFamilyAssociation.sequence_id).\
+            filter(SequenceFamilyAssociation.gene_family_id.in_(large_families)).\
+            group_by(SequenceFamilyAssociation.gene_family_id, SequenceInterproAssociation.interpro_id).all()
+
+        GeneFamilyMethod.__update_family_annotation(FamilyInterproAssociation, 'interpro_id', counts, family_ids, top)
+
+    @staticmethod
+    def update_go_annotation(method_id=None, species_id=None, top=5, min_size=5, min_depth=4):
+        """
+        Assigns the most common GO terms (by number of non-predicted associations) to gene families. Terms with fewer
+        than min_depth ancestors are ignored as they are too generic. Counts for all families are obtained with a
+        single aggregate query, existing family annotation is replaced.
+
+        :param method_id: only annotate families from this method (ignored if None)
+        :param species_id: only annotate families with members from this species (ignored if None)
+        :param top: number of GO terms to assign to each family
+        :param min_size: only consider families with this many members or more
+        :param min_depth: minimal number of ancestors a GO term needs to be considered
+        """
+        from conekt.models.relationships.sequence_go import SequenceGOAssociation
 
-            subquery = f.sequences.subquery()
-            data = SequenceGOAssociation.query.filter(SequenceGOAssociation.predicted == 0).\
-                filter(SequenceGOAssociation.evidence is not None).\
-                join(subquery, SequenceGOAssociation.sequence_id == subquery.c.id).all()
+        family_ids = GeneFamilyMethod.__selected_families(method_id=method_id, species_id=species_id)
+        large_families = GeneFamilyMethod.__large_families(family_ids, min_size)
 
-            go_terms = []
+        counts = db.session.query(SequenceFamilyAssociation.gene_family_id,
+                                  SequenceGOAssociation.go_id,
+                                  db.func.count(SequenceGOAssociation.id)).\
+            join(SequenceGOAssociation, SequenceGOAssociation.sequence_id == SequenceFamilyAssociation.sequence_id).\
+            filter(SequenceGOAssociation.predicted == 0).\
+            filter(SequenceFamilyAssociation.gene_family_id.in_(large_families))
 
-            for d in data:
-                if d.go.parent_count > 3:
-                    go_terms.append(d.go_id)
+        if min_depth > 0:
+            specific_terms = db.session.query(GOClosure.go_id).\
+                filter(GOClosure.distance > 0).\
+                group_by(GOClosure.go_id).\
+                having(db.func.count(GOClosure.ancestor_id) >= min_depth).subquery()
 
-            cnt = Counter(go_terms)
-            print(f.id, cnt.most_common(5))
-            for go_id, _ in cnt.most_common(5):
-                print({'gene_family_id': f.id, 'go_id': go_id})
-                relations.append({'gene_family_id': f.id, 'go_id': go_id})
+            counts = counts.filter(SequenceGOAssociation.go_id.in_(specific_terms))
 
-            # add 400 sequences at the time, more can cause problems with some database engines
-            if len(relations) > 400:
-                db.engine.execute(FamilyGOAssociation.__table__.insert(), relations)
-                relations = []
+        counts = counts.group_by(SequenceFamilyAssociation.gene_family_id, SequenceGOAssociation.go_id).all()
 
-        db.engine.execute(FamilyGOAssociation.__table__.insert(), relations)
+        GeneFamilyMethod.__update_family_annotation(FamilyGOAssociation, 'go_id', counts, family_ids, top)
 
     def get_clade_distribution(self):
         """
@@ -121,14 +202,29 @@ class GeneFamilyMethod(db.Model):
         counts[species_id][clade_id] = number of genes from the species associated with the Clade based on the current
         gene family method.
 
+        Counts are obtained with a single aggregate query.
+
         :return: dict-of-dict with species_id, clade_id and then the count
         """
+        association_table = SequenceFamilyAssociation.__table__
+        family_table = GeneFamily.__table__
+        sequence_table = Sequence.__table__
+
+        table = association_table.\
+            join(family_table, association_table.c.gene_family_id == family_table.c.id).\
+            join(sequence_table, association_table.c.sequence_id == sequence_table.c.id)
+
+        data = db.engine.execute(
+            db.select([sequence_table.c.species_id, family_table.c.clade_id, db.func.count()]).
+            select_from(table).
+            where(family_table.c.method_id == self.id).
+            where(family_table.c.clade_id.isnot(None)).
+            group_by(sequence_table.c.species_id, family_table.c.clade_id)).fetchall()
+
         counts = defaultdict(lambda: defaultdict(lambda: 0))
 
-        for family in self.families:
-            if family.clade is not None:
-                for s in family.sequences:
-                    counts[s.species_id][family.clade_id] += 1
+        for species_id, clade_id, count in data:
+            counts[species_id][clade_id] = count
 
         return counts
 
@@ -192,7 +288,12 @@ class GeneFamily(db.Model):
         Finds all species the family has genes from
         :return: a list of all species (codes)
         """
+        output = SpeciesAnnotationCount.get_species_counts('family', self.id)
 
+        if len(output) > 0:
+            return list(output.keys())
+
+        # No precomputed counts available, check sequences
         sequences = self.sequences.options(joinedload('species')).all()
 
         output = []
@@ -209,7 +310,12 @@ class GeneFamily(db.Model):
         Generates a phylogenetic profile of a gene family
         :return: a dict with counts per species (codes are keys)
         """
+        output = SpeciesAnnotationCount.get_species_counts('family', self.id)
+
+        if len(output) > 0:
+            return output
 
+        # No precomputed counts available, count sequences
         sequences = self.sequences.options(joinedload('species')).all()
 
         output = {}
@@ -248,14 +354,13 @@ class GeneFamily(db.Model):
     @staticmethod
     def sequence_stats(sequence_ids):
         """
-        Takes a list of sequence IDs and returns InterPro stats for those sequences
+        Takes a list of sequence IDs and returns gene family stats for those sequences
 
         :param sequence_ids: list of sequence ids
-        :return: dict with for each InterPro domain linked with any of the input sequences stats
+        :return: dict with for each gene family linked with any of the input sequences stats
         """
-        data = SequenceFamilyAssociation.query.filter(SequenceFamilyAssociation.sequence_id.in_(sequence_ids)).all()
-
-        return GeneFamily.__sequence_stats_associations(data)
+        return annotation_stats.sequence_stats(SequenceFamilyAssociation, SequenceFamilyAssociation.gene_family_id,
+                                               GeneFamily, 'family', sequence_ids=sequence_ids)
 
     @staticmethod
     def sequence_stats_subquery(sequences):
@@ -264,32 +369,39 @@ class GeneFamily(db.Model):
         sequences by ID)
 
         :param sequences: BaseQuery returning sequences
-        :return: dict with for each InterPro domain linked with any of the input sequences stats
+        :return: dict with for each gene family linked with any of the input sequences stats
         """
-        subquery = sequences.subquery()
+        return annotation_stats.sequence_stats(SequenceFamilyAssociation, SequenceFamilyAssociation.gene_family_id,
+                                               GeneFamily, 'family', sequences=sequences)
 
-        data = SequenceFamilyAssociation.query.join(subquery, SequenceFamilyAssociation.sequence_id == subquery.c.id).all()
+    @staticmethod
+    def get_annotations(family_ids):
+        """
+        Gets the pre-computed InterPro and GO annotation (see GeneFamilyMethod.update_interpro_annotation and
+        update_go_annotation) for many families at once
 
-        return GeneFamily.__sequence_stats_associations(data)
+        :param family_ids: list of internal family IDs
+        :return: dict with for each family a dict with a list of InterPro domains ('interpro') and GO terms ('go')
+        """
+        output = {f: {'interpro': [], 'go': []} for f in family_ids}
+        family_ids = list(output.keys())
 
-    @staticmethod
-    def __sequence_stats_associations(associations):
-        output = {}
-        for d in associations:
-            if d.gene_family_id not in output.keys():
-                output[d.gene_family_id] = {
-                    'family': d.family,
-                    'count': 1,
-                    'sequences': [d.sequence_id],
-                    'species': [d.sequence.species_id]
-                }
-            else:
-                output[d.gene_family_id]['count'] += 1
-                if d.sequence.species_id not in output[d.gene_family_id]['species']:
-                    output[d.gene_family_id]['species'].append(d.sequence.species_id)
+        for i in range(0, len(family_ids), 400):
+            domains = db.session.query(FamilyInterproAssociation.gene_family_id, Interpro).\
+                join(Interpro, Interpro.id == FamilyInterproAssociation.interpro_id).\
+                filter(FamilyInterproAssociation.gene_family_id.in_(family_ids[i:i + 400])).\
+                order_by(FamilyInterproAssociation.id).all()
+
+            for family_id, domain in domains:
+                output[family_id]['interpro'].append(domain)
+
+            terms = db.session.query(FamilyGOAssociation.gene_family_id, GO).\
+                join(GO, GO.id == FamilyGOAssociation.go_id).\
+                filter(FamilyGOAssociation.gene_family_id.in_(family_ids[i:i + 400])).\
+                order_by(FamilyGOAssociation.id).all()
 
-        for k, v in output.items():
-            v['species_count'] = len(v['species'])
+            for family_id, term in terms:
+                output[family_id]['go'].append(term)
 
         return output
 
@@ -355,6 +467,16 @@ class GeneFamily(db.Model):
             db.session.rollback()
             quit()
 
+        # Refresh the pre-calculated cluster summaries, new families can include members of any cluster
+        from conekt.models.expression.coexpression_clusters import CoexpressionCluster
+        CoexpressionCluster.update_summaries()
+
+        SpeciesAnnotationCount.update_counts(annotation_types=('family',))
+
+        if len(families) > 0:
+            GeneFamilyMethod.update_interpro_annotation(method_id=families[0].method_id)
+            GeneFamilyMethod.update_go_annotation(method_id=families[0].method_id)
+
     @staticmethod
     def add_families_from_mcl(filename, description, handle_isoforms=False, prefix='mcl'):
         """
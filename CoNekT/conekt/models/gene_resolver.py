@@ -0,0 +1,138 @@
+"""
+Resolves lists of gene identifiers (sequence names, aliases or other cross-references, case insensitive) entered in the
+list tools (heatmaps, custom networks, profile comparison) to sequences, using a few set-based queries. Large lists are
+passed through a temporary table instead of long IN clauses.
+"""
+from conekt import db
+from conekt.models.annotation_stats import temporary_table
+from conekt.models.expression.profiles import ExpressionProfile
+from conekt.models.fuzzy_names import FuzzyNames
+from conekt.models.sequences import Sequence, SQL_COLLATION
+from conekt.models.xrefs import XRef
+
+from collections import defaultdict
+
+CHUNK_SIZE = 400
+
+
+class GeneResolver:
+    @staticmethod
+    def resolve(terms, species_id=None):
+        """
+        Maps identifiers to sequences. Sequence names take precedence over cross-references (e.g. aliases), remaining
+        identifiers are matched after removing version suffixes and transcript tags (once the FuzzyNames index is
+        built). An identifier is ambiguous if it matches multiple sequences (e.g. the same name in different species).
+
+        :param terms: list of identifiers
+        :param species_id: only consider sequences from this species (default: all species)
+        :return: dict with 'matched' (identifier: sequence ID), 'ambiguous' (identifier: list of sequence IDs) and
+                 'unknown' (list of identifiers)
+        """
+        # identifiers are compared case-insensitively, keep the spelling from the input
+        spelling = {}
+        for t in terms:
+            spelling.setdefault(t.lower(), t)
+
+        hits = GeneResolver.__find(list(spelling.keys()), Sequence.name, species_id)
+
+        remaining = [t for t in spelling.keys() if t not in hits.keys()]
+        if len(remaining) > 0:
+            hits.update(GeneResolver.__find(remaining, XRef.name, species_id))
+
+        # identifiers with a different version suffix or transcript tag (e.g. AT1G01010.1), the trigram index is built
+        # in the background and nothing is found here until it is ready
+        remaining = [t for t in spelling.keys() if t not in hits.keys()]
+        if len(remaining) > 0:
+            hits.update(FuzzyNames.lookup(remaining, species_id=species_id))
+
+        output = {'matched': {}, 'ambiguous': {}, 'unknown': []}
+
+        for term, original in spelling.items():
+            sequence_ids = sorted(hits.get(term, []))
+
+            if len(sequence_ids) == 1:
+                output['matched'][original] = sequence_ids[0]
+            elif len(sequence_ids) > 1:
+                output['ambiguous'][original] = sequence_ids
+            else:
+                output['unknown'].append(original)
+
+        return output
+
+    @staticmethod
+    def get_probes(terms, species_id=None):
+        """
+        Gets the expression profile probes for a list of identifiers, these can be probes or anything resolve accepts.
+        Probes of all sequences an ambiguous identifier matches are included.
+
+        :param terms: list of identifiers
+        :param species_id: only consider sequences and profiles from this species (default: all species)
+        :return: list of probes and the output of resolve, identifiers that are probes are removed from 'unknown'
+        """
+        resolved = GeneResolver.resolve(terms, species_id=species_id)
+
+        sequence_ids = list(resolved['matched'].values()) + \
+            [i for ids in resolved['ambiguous'].values() for i in ids]
+
+        probes = set(terms)
+        for i in range(0, len(sequence_ids), CHUNK_SIZE):
+            query = db.session.query(ExpressionProfile.probe).\
+                filter(ExpressionProfile.sequence_id.in_(sequence_ids[i:i + CHUNK_SIZE]))
+
+            if species_id is not None:
+                query = query.filter(ExpressionProfile.species_id == species_id)
+
+            probes.update([p for p, in query.all()])
+
+        unknown = resolved['unknown']
+        known_probes = set()
+        for i in range(0, len(unknown), CHUNK_SIZE):
+            query = db.session.query(ExpressionProfile.probe).\
+                filter(ExpressionProfile.probe.in_(unknown[i:i + CHUNK_SIZE]))
+
+            if species_id is not None:
+                query = query.filter(ExpressionProfile.species_id == species_id)
+
+            known_probes.update([p.lower() for p, in query.all()])
+
+        resolved['unknown'] = [t for t in unknown if t.lower() not in known_probes]
+
+        return list(probes), resolved
+
+    @staticmethod
+    def __find(terms, column, species_id=None):
+        """
+        Finds sequences by name or cross-reference
+
+        :param terms: list of unique, lowercase identifiers
+        :param column: Sequence.name or XRef.name
+        :param species_id: only consider sequences from this species
+        :return: dict with identifiers (lowercase) as keys and sets of sequence IDs as values
+        """
+        # longer identifiers can't match any name
+        terms = [t for t in terms if len(t) <= column.type.length]
+
+        if len(terms) == 0:
+            return {}
+
+        query = db.session.query(column, Sequence.id).select_from(Sequence)
+
+        if column is XRef.name:
+            query = query.join(Sequence.xrefs)
+
+        if species_id is not None:
+            query = query.filter(Sequence.species_id == species_id)
+
+        if len(terms) <= CHUNK_SIZE:
+            rows = query.filter(column.in_(terms)).all()
+        else:
+            with temporary_table('tmp_resolver_terms',
+                                 db.Column('term', db.String(80, collation=SQL_COLLATION), primary_key=True),
+                                 terms) as term_table:
+                rows = query.join(term_table, column == term_table.c.term).all()
+
+        output = defaultdict(set)
+        for name, sequence_id in rows:
+            output[name.lower()].add(sequence_id)
+
+        return output
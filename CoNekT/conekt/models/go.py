@@ -1,13 +1,17 @@
 from conekt import db, whooshee
 from conekt.models.relationships import sequence_go
 from conekt.models.relationships.sequence_go import SequenceGOAssociation
+from conekt.models.relationships.go_closure import GOClosure
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.sequences import Sequence
+from conekt.models import annotation_stats
 
-from utils.parser.obo import Parser as OBOParser
+from utils.parser.obo import Parser as OBOParser, OboEntry
 from utils.parser.plaza.go import Parser as GOParser
-from utils.enrichment import hypergeo_sf, fdr_correction
+from utils.enrichment import network_go_enrichment
 
 from collections import defaultdict
+from multiprocessing import Pool
 
 import json
 
@@ -25,7 +29,6 @@ class GO(db.Model):
     obsolete = db.Column(db.SmallInteger)
     is_a = db.Column(db.Text)
     extended_go = db.Column(db.Text)
-    species_counts = db.Column(db.Text)
 
     sequences = db.relationship('Sequence', secondary=sequence_go, lazy='dynamic')
 
@@ -33,6 +36,7 @@ class GO(db.Model):
     #
     # sequence_associations declared in 'SequenceGOAssociation'
     # enriched_clusters declared in 'ClusterGOEnrichment'
+    # ancestor_associations and descendant_associations declared in 'GOClosure'
 
     def __init__(self, label, name, go_type, description, obsolete, is_a, extended_go):
         self.label = label
@@ -42,7 +46,6 @@ class GO(db.Model):
         self.obsolete = obsolete
         self.is_a = is_a
         self.extended_go = extended_go
-        self.species_counts = ""
 
     def set_all(self, label, name, go_type, description, extended_go):
         self.label = label
@@ -50,7 +53,6 @@ class GO(db.Model):
         self.type = go_type
         self.description = description
         self.extended_go = extended_go
-        self.species_counts = ""
 
     @property
     def short_type(self):
@@ -80,7 +82,7 @@ class GO(db.Model):
         Returns total number of genes 'above' this gene in the DAG
         :return:
         """
-        return len(self.extended_go.split(';')) if self.extended_go != '' else 0
+        return self.ancestor_associations.filter(GOClosure.distance > 0).count()
 
     @property
     def interpro_stats(self):
@@ -117,97 +119,41 @@ class GO(db.Model):
     @staticmethod
     def sequence_stats(sequence_ids, exclude_predicted=True):
         """
-        Takes a list of sequence IDs and returns InterPro stats for those sequences
+        Takes a list of sequence IDs and returns GO stats for those sequences
 
         :param sequence_ids: list of sequence ids
         :param exclude_predicted: if True (default) predicted GO labels will be excluded
-        :return: dict with for each InterPro domain linked with any of the input sequences stats
+        :return: dict with for each GO term linked with any of the input sequences stats
         """
-        query = SequenceGOAssociation.query.filter(SequenceGOAssociation.sequence_id.in_(sequence_ids))
+        filters = [SequenceGOAssociation.predicted == 0] if exclude_predicted else None
 
-        if exclude_predicted:
-            query = query.filter(SequenceGOAssociation.predicted == 0)
-
-        data = query.all()
-
-        return GO.__sequence_stats_associations(data)
+        return annotation_stats.sequence_stats(SequenceGOAssociation, SequenceGOAssociation.go_id, GO, 'go',
+                                               sequence_ids=sequence_ids, filters=filters)
 
     @staticmethod
     def sequence_stats_subquery(sequences, exclude_predicted=True):
-        subquery = sequences.subquery()
-
-        query = SequenceGOAssociation.query
-
-        if exclude_predicted:
-            query = query.filter(SequenceGOAssociation.predicted == 0)
-
-        data = query.join(subquery, SequenceGOAssociation.sequence_id == subquery.c.id).all()
-
-        return GO.__sequence_stats_associations(data)
-
-    @staticmethod
-    def __sequence_stats_associations(associations):
-        output = {}
-        for d in associations:
-            if d.go_id not in output.keys():
-                output[d.go_id] = {
-                    'go': d.go,
-                    'count': 1,
-                    'sequences': [d.sequence_id],
-                    'species': [d.sequence.species_id]
-                }
-            else:
-                output[d.go_id]['count'] += 1
-                if d.sequence_id not in output[d.go_id]['sequences']:
-                    output[d.go_id]['sequences'].append(d.sequence_id)
-                if d.sequence.species_id not in output[d.go_id]['species']:
-                    output[d.go_id]['species'].append(d.sequence.species_id)
-
-        for k, v in output.items():
-            v['species_count'] = len(v['species'])
-            v['sequence_count'] = len(v['sequences'])
-
-        return output
-
-    @staticmethod
-    def update_species_counts():
         """
-        Adds phylo-profile to each go-label, results are stored in the database
+        Same as sequence_stats but takes a BaseQuery returning sequences as input (to avoid multiple times querying
+        sequences by ID)
 
+        :param sequences: BaseQuery returning sequences
         :param exclude_predicted: if True (default) predicted GO labels will be excluded
+        :return: dict with for each GO term linked with any of the input sequences stats
         """
-        # link species to sequences
-        sequences = db.engine.execute(db.select([Sequence.__table__.c.id, Sequence.__table__.c.species_id])).fetchall()
+        filters = [SequenceGOAssociation.predicted == 0] if exclude_predicted else None
 
-        sequence_to_species = {}
-        for seq_id, species_id in sequences:
-            if species_id is not None:
-                sequence_to_species[seq_id] = int(species_id)
-
-        # get go for all genes
-        associations = db.engine.execute(
-            db.select([SequenceGOAssociation.__table__.c.sequence_id,
-                       SequenceGOAssociation.__table__.c.go_id], distinct=True)\
-            .where(SequenceGOAssociation.__table__.c.predicted == 0))\
-            .fetchall()
+        return annotation_stats.sequence_stats(SequenceGOAssociation, SequenceGOAssociation.go_id, GO, 'go',
+                                               sequences=sequences, filters=filters)
 
-        count = {}
-        for seq_id, go_id in associations:
-            species_id = sequence_to_species[seq_id]
-
-            if go_id not in count.keys():
-                count[go_id] = {}
-
-            if species_id not in count[go_id]:
-                count[go_id][species_id] = 1
-            else:
-                count[go_id][species_id] += 1
+    @staticmethod
+    def update_species_counts(species_id=None):
+        """
+        Counts the number of sequences per species annotated with each go-label (phylo-profile), results are stored
+        in the species_annotation_counts table. Predicted GO labels are excluded.
 
-        # update counts
-        for go_id, data in count.items():
-            db.engine.execute(db.update(GO.__table__)
-                              .where(GO.__table__.c.id == go_id)
-                              .values(species_counts=json.dumps(data)))
+        :param species_id: only recount the GO annotation of this species (default: all species)
+        """
+        SpeciesAnnotationCount.update_counts(annotation_types=('go',), species_id=species_id)
 
     @staticmethod
     def add_from_obo(filename, empty=True, compressed=False):
@@ -232,25 +178,152 @@ class GO(db.Model):
 
         obo_parser.extend_go()
 
-        for i, term in enumerate(obo_parser.terms):
-            go = GO(term.id, term.name, term.namespace, term.definition, term.is_obsolete, ";".join(term.is_a),
-                    ";".join(term.extended_go))
+        # the terms are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(GO, rebuild=empty):
+            for term in obo_parser.terms:
+                go = GO(term.id, term.name, term.namespace, term.definition, term.is_obsolete, ";".join(term.is_a),
+                        ";".join(term.extended_go))
+
+                db.session.add(go)
+
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(e)
+
+        GO.update_closure()
+
+    @staticmethod
+    def update_closure():
+        """
+        Rebuilds the go_closure table, with for each term all ancestors and the distance to them, from the is_a
+        relationships in the go table. Each term is included as its own ancestor (distance 0).
+        """
+        terms = db.engine.execute(db.select([GO.__table__.c.id, GO.__table__.c.label, GO.__table__.c.is_a])).fetchall()
+
+        go_ids = {}
+        obo_parser = OBOParser()
+
+        for go_id, label, is_a in terms:
+            go_ids[label] = go_id
+
+            entry = OboEntry()
+            entry.set_id(label)
+            if is_a:
+                for parent in is_a.split(";"):
+                    entry.add_is_a(parent)
+
+            obo_parser.terms.append(entry)
 
-            db.session.add(go)
+        obo_parser.extend_go()
 
-            if i % 40 == 0:
-                # commit to the db frequently to allow WHOOSHEE's indexing function to work without timing out
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    print(e)
         try:
+            db.session.query(GOClosure).delete()
             db.session.commit()
         except Exception as e:
             db.session.rollback()
             print(e)
 
+        closure = []
+
+        for term in obo_parser.terms:
+            closure.append({"go_id": go_ids[term.id], "ancestor_id": go_ids[term.id], "distance": 0})
+
+            for ancestor, distance in term.ancestor_distance.items():
+                if ancestor in go_ids.keys():
+                    closure.append({"go_id": go_ids[term.id], "ancestor_id": go_ids[ancestor], "distance": distance})
+
+            if len(closure) > 400:
+                db.engine.execute(GOClosure.__table__.insert(), closure)
+                closure = []
+
+        if len(closure) > 0:
+            db.engine.execute(GOClosure.__table__.insert(), closure)
+
+    @staticmethod
+    def get_ancestors():
+        """
+        Gets the ancestors of all GO terms from the go_closure table. If the table is empty (e.g. on a database created
+        before it existed) it is rebuilt first, if there still are no ancestors (no is_a relationships stored) these
+        are taken from the extended_go field.
+
+        :return: dict with for each GO term (internal ID) the set of internal IDs of its ancestors
+        """
+        ancestors = defaultdict(set)
+
+        if db.session.query(GOClosure.go_id).first() is None and db.session.query(GO.id).first() is not None:
+            print("The go_closure table is empty, rebuilding it")
+            GO.update_closure()
+
+        closure = db.engine.execute(db.select([GOClosure.__table__.c.go_id, GOClosure.__table__.c.ancestor_id]).
+                                    where(GOClosure.__table__.c.distance > 0)).fetchall()
+
+        for go_id, ancestor_id in closure:
+            ancestors[go_id].add(ancestor_id)
+
+        if len(ancestors) == 0:
+            terms = db.engine.execute(db.select([GO.__table__.c.id, GO.__table__.c.label,
+                                                 GO.__table__.c.extended_go])).fetchall()
+            go_ids = {label: go_id for go_id, label, _ in terms}
+
+            for go_id, _, extended_go in terms:
+                if extended_go:
+                    ancestors[go_id] = set([go_ids[label] for label in extended_go.split(";")
+                                            if label in go_ids.keys() and go_ids[label] != go_id])
+
+        return ancestors
+
+    @staticmethod
+    def __add_associations(associations):
+        """
+        Adds GO associations, and the parental terms of the associated terms (as 'Extended' associations), to the
+        database. Associations with the same sequence, term and evidence are only added once, parental terms are only
+        added if the sequence isn't associated with the term directly.
+
+        :param associations: iterable with (sequence_id, go_id, evidence, source) tuples
+        """
+        ancestors = GO.get_ancestors()
+
+        seen = set()
+        sequence_terms = defaultdict(set)
+        new_associations = []
+
+        for sequence_id, go_id, evidence, source in associations:
+            if (sequence_id, go_id, evidence) in seen:
+                continue
+
+            seen.add((sequence_id, go_id, evidence))
+            sequence_terms[sequence_id].add(go_id)
+
+            new_associations.append({"sequence_id": sequence_id,
+                                     "go_id": go_id,
+                                     "evidence": evidence,
+                                     "source": source})
+
+            if len(new_associations) >= 400:
+                db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations)
+                new_associations = []
+
+        # Add extended GOs
+        for sequence_id, terms in sequence_terms.items():
+            extended_terms = set()
+            for go_id in terms:
+                extended_terms |= ancestors[go_id]
+
+            for go_id in sorted(extended_terms - terms):
+                new_associations.append({"sequence_id": sequence_id,
+                                         "go_id": go_id,
+                                         "evidence": None,
+                                         "source": "Extended"})
+
+                if len(new_associations) >= 400:
+                    db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations)
+                    new_associations = []
+
+        if len(new_associations) > 0:
+            db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations)
+
     @staticmethod
     def add_go_from_plaza(filename):
         """
@@ -263,152 +336,111 @@ class GO(db.Model):
 
         go_parser.read_plaza_go(filename)
 
-        gene_hash = {}
-        go_hash = {}
-
-        all_sequences = Sequence.query.all()
-        all_go = GO.query.all()
+        sequence_ids = {name: sequence_id for sequence_id, name in
+                        db.engine.execute(db.select([Sequence.__table__.c.id, Sequence.__table__.c.name])).fetchall()}
+        go_ids = {label: go_id for go_id, label in
+                  db.engine.execute(db.select([GO.__table__.c.id, GO.__table__.c.label])).fetchall()}
+
+        def associations():
+            for gene, terms in go_parser.annotation.items():
+                if gene in sequence_ids.keys():
+                    for term in terms:
+                        if term["id"] in go_ids.keys():
+                            yield sequence_ids[gene], go_ids[term["id"]], term["evidence"], term["source"]
+                        else:
+                            print(term, "not found in the database.")
+                else:
+                    print("Gene", gene, "not found in the database.")
 
-        for sequence in all_sequences:
-            gene_hash[sequence.name] = sequence
+        GO.__add_associations(associations())
 
-        for term in all_go:
-            go_hash[term.label] = term
+    @staticmethod
+    def add_go_from_tab(filename, species_id, source="Source not provided"):
+        sequence_ids = {name: sequence_id for sequence_id, name in
+                        db.engine.execute(db.select([Sequence.__table__.c.id, Sequence.__table__.c.name]).
+                                          where(Sequence.__table__.c.species_id == species_id).
+                                          where(Sequence.__table__.c.type == 'protein_coding')).fetchall()}
+        go_ids = {label: go_id for go_id, label in
+                  db.engine.execute(db.select([GO.__table__.c.id, GO.__table__.c.label])).fetchall()}
+
+        def associations():
+            with open(filename, "r") as f:
+                for line in f:
+                    gene, term, evidence = line.strip().split('\t')
+                    if gene in sequence_ids.keys():
+                        if term in go_ids.keys():
+                            yield sequence_ids[gene], go_ids[term], evidence, source
+                        else:
+                            print(term, "not found in the database.")
+                    else:
+                        print("Gene", gene, "not found in the database.")
 
-        associations = []
+        GO.__add_associations(associations())
 
-        for gene, terms in go_parser.annotation.items():
-            if gene in gene_hash.keys():
-                current_sequence = gene_hash[gene]
-                for term in terms:
-                    if term["id"] in go_hash.keys():
-                        current_term = go_hash[term["id"]]
-                        association = {
-                            "sequence_id": current_sequence.id,
-                            "go_id": current_term.id,
-                            "evidence": term["evidence"],
-                            "source": term["source"]}
-                        associations.append(association)
-                    else:
-                        print(term, "not found in the database.")
-            else:
-                print("Gene", gene, "not found in the database.")
+        # Refresh the pre-calculated cluster summaries for this species
+        from conekt.models.expression.coexpression_clusters import CoexpressionCluster
+        CoexpressionCluster.update_summaries(species_id=species_id)
 
-            if len(associations) > 400:
-                db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
-                associations = []
+        GO.update_species_counts(species_id=species_id)
 
-        # Add extended GOs
-        for gene, terms in go_parser.annotation.items():
-            if gene in gene_hash.keys():
-                current_sequence = gene_hash[gene]
-                new_terms = []
-                current_terms = []
-
-                for term in terms:
-                    if term["id"] not in current_terms:
-                        current_terms.append(term["id"])
-
-                for term in terms:
-                    if term["id"] in go_hash.keys():
-                        extended_terms = go_hash[term["id"]].extended_go.split(";")
-                        for extended_term in extended_terms:
-                            if extended_term not in current_terms and extended_term not in new_terms:
-                                new_terms.append(extended_term)
-
-                for new_term in new_terms:
-                    if new_term in go_hash.keys():
-                        current_term = go_hash[new_term]
-                        association = {
-                            "sequence_id": current_sequence.id,
-                            "go_id": current_term.id,
-                            "evidence": None,
-                            "source": "Extended"}
-                        associations.append(association)
-
-                    if len(associations) > 400:
-                        db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
-                        associations = []
-
-        db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
+        # Refresh the top GO terms of gene families with members from this species
+        from conekt.models.gene_families import GeneFamilyMethod
+        GeneFamilyMethod.update_go_annotation(species_id=species_id)
 
     @staticmethod
-    def add_go_from_tab(filename, species_id, source="Source not provided"):
-        gene_hash = {}
-        go_hash = {}
+    def __load_network_go_data(expression_network_method):
+        """
+        Loads the neighborhoods of all genes in a network and the GO annotation of all genes in the species with two
+        queries.
 
-        all_sequences = Sequence.query.filter(Sequence.species_id == species_id, Sequence.type == 'protein_coding').all()
-        all_go = GO.query.all()
+        :param expression_network_method: ExpressionNetworkMethod to load
+        :return: tuple with the number of probes in the network, neighborhoods (list of tuples with a sequence id and
+                 the neighboring sequence ids), all GO terms per sequence (dict sequence_id -> set of GO ids) and
+                 non-predicted GO terms per sequence (dict sequence_id -> set of GO ids)
+        """
+        from conekt.models.expression.networks import ExpressionNetwork
 
-        for sequence in all_sequences:
-            gene_hash[sequence.name] = sequence
+        network_table = ExpressionNetwork.__table__
 
-        for term in all_go:
-            go_hash[term.label] = term
+        probes = db.engine.execute(
+            db.select([network_table.c.sequence_id, network_table.c.network]).
+            where(network_table.c.method_id == expression_network_method.id)).fetchall()
 
-        associations = []
+        neighborhoods = []
+        for sequence_id, network in probes:
+            # If there is no sequence associated with the probe skip (no prediction possible)
+            if sequence_id is None:
+                continue
 
-        gene_go = defaultdict(list)
+            neighborhood = json.loads(network)
+            neighborhoods.append((sequence_id, [n['gene_id'] for n in neighborhood if 'gene_id' in n]))
 
-        with open(filename, "r") as f:
-            for line in f:
-                gene, term, evidence = line.strip().split('\t')
-                if gene in gene_hash.keys():
-                    current_sequence = gene_hash[gene]
-                    if term in go_hash.keys():
-                        current_term = go_hash[term]
-                        association = {
-                            "sequence_id": current_sequence.id,
-                            "go_id": current_term.id,
-                            "evidence": evidence,
-                            "source": source}
-                        associations.append(association)
+        go_table = SequenceGOAssociation.__table__
+        sequence_table = Sequence.__table__
 
-                        if term not in gene_go[gene]:
-                            gene_go[gene].append(term)
+        associations = db.engine.execute(
+            db.select([go_table.c.sequence_id, go_table.c.go_id, go_table.c.predicted], distinct=True).
+            select_from(go_table.join(sequence_table, go_table.c.sequence_id == sequence_table.c.id)).
+            where(sequence_table.c.species_id == expression_network_method.species_id)).fetchall()
 
-                    else:
-                        print(term, "not found in the database.")
-                else:
-                    print("Gene", gene, "not found in the database.")
+        own_go = defaultdict(set)
+        sequence_go = defaultdict(set)
+        for sequence_id, go_id, predicted in associations:
+            own_go[sequence_id].add(go_id)
+            if not predicted:
+                sequence_go[sequence_id].add(go_id)
 
-                if len(associations) > 400:
-                    db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
-                    associations = []
+        return len(probes), neighborhoods, own_go, sequence_go
 
-        # Add extended GOs
-        for gene, terms in gene_go.items():
-            if gene in gene_hash.keys():
-                current_sequence = gene_hash[gene]
-                new_terms = []
-                current_terms = []
-
-                for term in terms:
-                    if term not in current_terms:
-                        current_terms.append(term)
-
-                for term in terms:
-                    if term in go_hash.keys():
-                        extended_terms = go_hash[term].extended_go.split(";")
-                        for extended_term in extended_terms:
-                            if extended_term not in current_terms and extended_term not in new_terms:
-                                new_terms.append(extended_term)
-
-                for new_term in new_terms:
-                    if new_term in go_hash.keys():
-                        current_term = go_hash[new_term]
-                        association = {
-                            "sequence_id": current_sequence.id,
-                            "go_id": current_term.id,
-                            "evidence": None,
-                            "source": "Extended"}
-                        associations.append(association)
-
-                    if len(associations) > 400:
-                        db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
-                        associations = []
-
-        db.engine.execute(SequenceGOAssociation.__table__.insert(), associations)
+    @staticmethod
+    def __add_predictions(new_associations):
+        """
+        Writes predicted GO associations to the database in chunks of 400 rows
+
+        :param new_associations: list of dicts with the values for SequenceGOAssociation
+        """
+        for i in range(0, len(new_associations), 400):
+            db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations[i: i + 400])
 
     @staticmethod
     def predict_from_network(expression_network_method_id, threshold=5, source="PlaNet Prediction"):
@@ -428,69 +460,57 @@ class GO(db.Model):
             print("ERROR: Network Method ID %d not found" % expression_network_method_id)
             return
 
-        # Get all genes that belong to the network
-        probes = expression_network_method.probes.all()
+        _, neighborhoods, own_go, sequence_go = GO.__load_network_go_data(expression_network_method)
 
         new_associations = []
 
-        for i, probe in enumerate(probes):
-            print("Predicting GO for gene: %d, %s (%d out of %d)" %
-                  (probe.sequence_id, probe.sequence.name, i, expression_network_method.probe_count))
-
-            # Get neighborhood from database
-            neighborhood = json.loads(probe.network)
-
-            # Get sequence ids from genes in first level neighborhood
-            sequence_ids = [n['gene_id'] for n in neighborhood if 'gene_id' in n]
-
+        for sequence_id, neighbors in neighborhoods:
             # If the number of genes in the neighborhood is smaller than the threshold skip (no prediction possible)
-            # If there is no sequence associated with the probe skip as well
-            if len(sequence_ids) < threshold or probe.sequence_id is None:
+            if len(neighbors) < threshold:
                 continue
 
-            # Get own GO terms
-            own_associations = SequenceGOAssociation.query.filter(SequenceGOAssociation.sequence_id == probe.sequence_id)
-            own_terms = list(set([a.go_id for a in own_associations]))
-
-            # Get GO terms from neighbors
-            associations = SequenceGOAssociation.query.filter(SequenceGOAssociation.sequence_id.in_(sequence_ids)).\
-                filter(SequenceGOAssociation.predicted == 0).all()
-
-            # Make GO terms from neighbors unique and ignore terms the current gene has already
-            unique_associations = set([(a.sequence_id, a.go_id) for a in associations if a.go_id not in own_terms])
+            # Count GO terms from neighbors and ignore terms the current gene has already
+            own_terms = own_go.get(sequence_id, set())
 
             go_counts = defaultdict(lambda: 0)
-
-            for ua in unique_associations:
-                go_counts[ua[1]] += 1
-
-            # Determine new terms (that occurred equal or more times than the desired threshold
-            new_terms = [{
-                'go_id': k,
-                'score': v
-            } for k, v in go_counts.items() if v >= threshold]
-
-            # Store new terms in a list that can be added to the database
-            for nt in new_terms:
-                new_associations.append({
-                    'sequence_id': probe.sequence_id,
-                    'go_id': nt['go_id'],
-                    'evidence': 'IEP',
-                    'source': source,
-                    'predicted': True,
-                    'prediction_data': json.dumps({'score': nt['score'],
-                                                   'threshold': threshold,
-                                                   'network_method': expression_network_method_id,
-                                                   'prediction_method': 'Neighbor counting'
-                                                   })
-                })
-
-        # Add new labels to the database in chuncks of 400
-        for i in range(0, len(new_associations), 400):
-            db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations[i: i + 400])
+            for neighbor_id in set(neighbors):
+                for go_id in sequence_go.get(neighbor_id, []):
+                    if go_id not in own_terms:
+                        go_counts[go_id] += 1
+
+            # Store new terms (that occurred equal or more times than the desired threshold) in a list that can be
+            # added to the database
+            for go_id, score in go_counts.items():
+                if score >= threshold:
+                    new_associations.append({
+                        'sequence_id': sequence_id,
+                        'go_id': go_id,
+                        'evidence': 'IEP',
+                        'source': source,
+                        'predicted': True,
+                        'prediction_data': json.dumps({'score': score,
+                                                       'threshold': threshold,
+                                                       'network_method': expression_network_method_id,
+                                                       'prediction_method': 'Neighbor counting'
+                                                       })
+                    })
+
+        GO.__add_predictions(new_associations)
 
     @staticmethod
-    def predict_from_network_enrichment(expression_network_method_id, cutoff=0.05, source="PlaNet Prediction"):
+    def predict_from_network_enrichment(expression_network_method_id, cutoff=0.05, source="PlaNet Prediction",
+                                        processes=1, batch_size=1000):
+        """
+        Function to transfer GO terms that are enriched in the neighborhood of genes in the network. The network and
+        annotation are loaded at once, genes are scored in batches (in parallel with processes > 1) and predictions
+        are written in bulk.
+
+        :param expression_network_method_id: Expression network as input
+        :param cutoff: p-value cutoff for enriched terms
+        :param source: Value for the source field
+        :param processes: number of worker processes to use (default = 1)
+        :param batch_size: number of genes per batch
+        """
         from conekt.models.expression.networks import ExpressionNetworkMethod
 
         expression_network_method = ExpressionNetworkMethod.query.get(expression_network_method_id)
@@ -499,74 +519,47 @@ class GO(db.Model):
             print("ERROR: Network Method ID %d not found" % expression_network_method_id)
             return
 
-        probes = expression_network_method.probes.all()
-
-        # Get all GO terms and get background
-        # Important, counts are obtained from precomputed counts in the species_counts field !!
-        go_data = db.engine.execute(db.select([GO.__table__.c.id, GO.__table__.c.species_counts])).fetchall()
+        # Get background for all GO terms
+        # Important, counts are obtained from the precomputed species_annotation_counts table !!
+        go_background = SpeciesAnnotationCount.get_counts('go', expression_network_method.species_id)
 
-        go_background = defaultdict(lambda: 0)
-
-        for go_id, counts_json in go_data:
-            if counts_json is not "":
-                counts = json.loads(counts_json)
-                if str(expression_network_method.species_id) in counts.keys():
-                    go_background[go_id] = counts[str(expression_network_method.species_id)]
-
-        new_associations = []
-
-        for i, probe in enumerate(probes):
-            print("Predicting GO for gene: %d, %s (%d out of %d)" %
-                  (probe.sequence_id, probe.sequence.name, i, expression_network_method.probe_count))
-
-            # Get neighborhood from database
-            neighborhood = json.loads(probe.network)
-
-            # Get sequence ids from genes in first level neighborhood
-            sequence_ids = [n['gene_id'] for n in neighborhood if 'gene_id' in n]
-
-            # Get own GO terms
-            own_associations = SequenceGOAssociation.query.filter(SequenceGOAssociation.sequence_id == probe.sequence_id)
-            own_terms = list(set([a.go_id for a in own_associations]))
-
-            # Get GO terms from neighbors
-            associations = SequenceGOAssociation.query.filter(SequenceGOAssociation.sequence_id.in_(sequence_ids)).\
-                filter(SequenceGOAssociation.predicted == 0).all()
-
-            # Make GO terms from neighbors unique and ignore terms the current gene has already
-            unique_associations = set([(a.sequence_id, a.go_id) for a in associations if a.go_id not in own_terms])
-            go_counts = defaultdict(lambda: 0)
+        if len(go_background) == 0:
+            print("ERROR: No GO counts for species %d, update the counts first" % expression_network_method.species_id)
+            return
 
-            for ua in unique_associations:
-                go_counts[ua[1]] += 1
-
-            # find significantly enriched GO terms and store them
-            enriched_go = []
-
-            for go_id, count in go_counts.items():
-                p_value = hypergeo_sf(count, len(sequence_ids), go_background[go_id], len(probes))
-                if p_value < cutoff:
-                    enriched_go.append((go_id, p_value))
-
-            # apply FDR correction to the p-values
-            corrected_p = fdr_correction([a[1] for a in enriched_go])
-
-            # push new prediction in a dict that will be added to the DB
-            for corrected_p, (go_id, p_value) in zip(corrected_p, enriched_go):
-                new_associations.append({
-                    'sequence_id': probe.sequence_id,
-                    'go_id': go_id,
-                    'evidence': 'IEP',
-                    'source': source,
-                    'predicted': True,
-                    'prediction_data': json.dumps({'p-cutoff': cutoff,
-                                                   'p-value': p_value,
-                                                   'p-value (FDR)': corrected_p,
-                                                   'network_method': expression_network_method_id,
-                                                   'prediction_method': 'Neighborhood enrichment'
-                                                   })
-                })
-
-        # Add new labels to the database in chuncks of 400
-        for i in range(0, len(new_associations), 400):
-            db.engine.execute(SequenceGOAssociation.__table__.insert(), new_associations[i: i + 400])
+        probe_count, neighborhoods, own_go, sequence_go = GO.__load_network_go_data(expression_network_method)
+
+        def batches():
+            for i in range(0, len(neighborhoods), batch_size):
+                batch = neighborhoods[i:i + batch_size]
+                neighbor_ids = set([n for _, neighbors in batch for n in neighbors])
+
+                yield (batch,
+                       {s: own_go[s] for s, _ in batch if s in own_go},
+                       {s: sequence_go[s] for s in neighbor_ids if s in sequence_go},
+                       go_background,
+                       probe_count,
+                       cutoff)
+
+        def to_associations(predictions):
+            return [{
+                'sequence_id': sequence_id,
+                'go_id': go_id,
+                'evidence': 'IEP',
+                'source': source,
+                'predicted': True,
+                'prediction_data': json.dumps({'p-cutoff': cutoff,
+                                               'p-value': p_value,
+                                               'p-value (FDR)': corrected_p_value,
+                                               'network_method': expression_network_method_id,
+                                               'prediction_method': 'Neighborhood enrichment'
+                                               })
+            } for sequence_id, go_id, p_value, corrected_p_value in predictions]
+
+        if processes > 1:
+            with Pool(processes) as pool:
+                for predictions in pool.imap_unordered(network_go_enrichment, batches()):
+                    GO.__add_predictions(to_associations(predictions))
+        else:
+            for data in batches():
+                GO.__add_predictions(to_associations(network_go_enrichment(data)))
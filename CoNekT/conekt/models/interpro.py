@@ -1,7 +1,9 @@
 from conekt import db, whooshee
 from conekt.models.relationships import sequence_interpro
 from conekt.models.relationships.sequence_interpro import SequenceInterproAssociation
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
 from conekt.models.sequences import Sequence
+from conekt.models import annotation_stats
 
 from utils.parser.interpro import Parser as InterproParser
 from utils.parser.interpro import DomainParser as InterproDomainParser
@@ -36,7 +38,12 @@ class Interpro(db.Model):
         Finds all species the family has genes from
         :return: a list of all species (codes)
         """
+        output = SpeciesAnnotationCount.get_species_counts('interpro', self.id)
 
+        if len(output) > 0:
+            return list(output.keys())
+
+        # No precomputed counts available, check sequences
         sequences = self.sequences.options(joinedload('species')).all()
 
         output = []
@@ -53,7 +60,12 @@ class Interpro(db.Model):
         Generates a phylogenetic profile of a gene family
         :return: a dict with counts per species (codes are keys)
         """
+        output = SpeciesAnnotationCount.get_species_counts('interpro', self.id)
+
+        if len(output) > 0:
+            return output
 
+        # No precomputed counts available, count sequences
         sequences = self.sequences.options(joinedload('species')).all()
 
         output = {}
@@ -74,46 +86,16 @@ class Interpro(db.Model):
         :param sequence_ids: list of sequence ids
         :return: dict with for each InterPro domain linked with any of the input sequences stats
         """
-        data = SequenceInterproAssociation.query.filter(SequenceInterproAssociation.sequence_id.in_(sequence_ids)).all()
-
-        return Interpro.__sequence_stats_associations(data)
+        return annotation_stats.sequence_stats(SequenceInterproAssociation, SequenceInterproAssociation.interpro_id,
+                                               Interpro, 'domain', sequence_ids=sequence_ids)
 
     @staticmethod
     def sequence_stats_subquery(sequences):
-        subquery = sequences.subquery()
-        data = SequenceInterproAssociation.query.join(subquery, SequenceInterproAssociation.sequence_id == subquery.c.id).all()
-
-        return Interpro.__sequence_stats_associations(data)
-
-    @staticmethod
-    def __sequence_stats_associations(associations):
-        output = {}
-
-        for d in associations:
-            if d.interpro_id not in output.keys():
-                output[d.interpro_id] = {
-                    'domain': d.domain,
-                    'count': 1,
-                    'sequences': [d.sequence_id],
-                    'species': [d.sequence.species_id]
-                }
-            else:
-                output[d.interpro_id]['count'] += 1
-                if d.sequence_id not in output[d.interpro_id]['sequences']:
-                    output[d.interpro_id]['sequences'].append(d.sequence_id)
-                if d.sequence.species_id not in output[d.interpro_id]['species']:
-                    output[d.interpro_id]['species'].append(d.sequence.species_id)
-
-        for k, v in output.items():
-            v['species_count'] = len(v['species'])
-            v['sequence_count'] = len(v['sequences'])
-
-        return output
+        return annotation_stats.sequence_stats(SequenceInterproAssociation, SequenceInterproAssociation.interpro_id,
+                                               Interpro, 'domain', sequences=sequences)
 
     @property
     def interpro_stats(self):
-        sequence_ids = [s.id for s in self.sequences.all()]
-
         return Interpro.sequence_stats_subquery(self.sequences)
 
     @property
@@ -149,24 +131,18 @@ class Interpro(db.Model):
 
         interpro_parser.readfile(filename)
 
-        for i, domain in enumerate(interpro_parser.domains):
-            interpro = Interpro(domain.label, domain.description)
-
-            db.session.add(interpro)
+        # the domains are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(Interpro, rebuild=empty):
+            for domain in interpro_parser.domains:
+                interpro = Interpro(domain.label, domain.description)
 
-            if i % 40 == 0:
-                # commit to the db frequently to allow WHOOSHEE's indexing function to work without timing out
-                try:
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    print(e)
+                db.session.add(interpro)
 
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            print(e)
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(e)
 
     @staticmethod
     def add_interpro_from_plaza(filename):
@@ -269,4 +245,14 @@ class Interpro(db.Model):
                 db.engine.execute(SequenceInterproAssociation.__table__.insert(), new_domains)
                 new_domains = []
 
-        db.engine.execute(SequenceInterproAssociation.__table__.insert(), new_domains)
\ No newline at end of file
+        db.engine.execute(SequenceInterproAssociation.__table__.insert(), new_domains)
+
+        # Refresh the pre-calculated cluster summaries for this species
+        from conekt.models.expression.coexpression_clusters import CoexpressionCluster
+        CoexpressionCluster.update_summaries(species_id=species_id)
+
+        SpeciesAnnotationCount.update_counts(annotation_types=('interpro',), species_id=species_id)
+
+        # Refresh the top InterPro domains of gene families with members from this species
+        from conekt.models.gene_families import GeneFamilyMethod
+        GeneFamilyMethod.update_interpro_annotation(species_id=species_id)
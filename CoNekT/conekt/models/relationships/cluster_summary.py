@@ -0,0 +1,45 @@
+from conekt import db
+
+
+class CoexpressionClusterSummary(db.Model):
+    __tablename__ = 'coexpression_cluster_summaries'
+    __table_args__ = {'extend_existing': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(db.Integer, db.ForeignKey('coexpression_clusters.id', ondelete='CASCADE'),
+                           unique=True, index=True)
+
+    cluster = db.relationship('CoexpressionCluster', backref=db.backref('summary',
+                                                                        uselist=False,
+                                                                        passive_deletes=True))
+
+    """
+    Number of sequences in the cluster and the average profile (JSON with order, colors, mean, median and stdev of the
+    normalized profiles of all members), pre-calculated for quick access
+    """
+    member_count = db.Column(db.Integer)
+    profile = db.Column(db.Text)
+
+
+class CoexpressionClusterAnnotationCount(db.Model):
+    __tablename__ = 'coexpression_cluster_annotation_counts'
+    __table_args__ = (db.Index('ix_cluster_annotation_type', 'cluster_id', 'annotation_type'),
+                      {'extend_existing': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    cluster_id = db.Column(db.Integer, db.ForeignKey('coexpression_clusters.id', ondelete='CASCADE'))
+
+    cluster = db.relationship('CoexpressionCluster', backref=db.backref('annotation_counts',
+                                                                        lazy='dynamic',
+                                                                        passive_deletes=True))
+
+    """
+    Type and internal ID of the annotation (InterPro domain, GO term, CAZYme or gene family) with the number of
+    associations, sequences and species in the cluster
+    """
+    annotation_type = db.Column(db.Enum('interpro', 'go', 'cazyme', 'family', name='cluster_annotation_type'))
+    annotation_id = db.Column(db.Integer, index=True)
+
+    count = db.Column(db.Integer)
+    sequence_count = db.Column(db.Integer)
+    species_count = db.Column(db.Integer)
@@ -0,0 +1,26 @@
+from conekt import db
+
+
+class GOClosure(db.Model):
+    __tablename__ = 'go_closure'
+    __table_args__ = (db.Index('ix_go_closure_ancestor', 'ancestor_id', 'go_id'),
+                      db.Index('ix_go_closure_go', 'go_id', 'ancestor_id'),
+                      {'extend_existing': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    go_id = db.Column(db.Integer, db.ForeignKey('go.id', ondelete='CASCADE'))
+    ancestor_id = db.Column(db.Integer, db.ForeignKey('go.id', ondelete='CASCADE'))
+
+    """
+    Length of the shortest path from the term to the ancestor, each term is included as its own ancestor with
+    distance 0
+    """
+    distance = db.Column(db.Integer)
+
+    go = db.relationship('GO', foreign_keys=[go_id], backref=db.backref('ancestor_associations',
+                                                                        lazy='dynamic',
+                                                                        passive_deletes=True))
+
+    ancestor = db.relationship('GO', foreign_keys=[ancestor_id], backref=db.backref('descendant_associations',
+                                                                                    lazy='dynamic',
+                                                                                    passive_deletes=True))
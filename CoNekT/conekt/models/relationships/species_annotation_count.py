@@ -0,0 +1,172 @@
+from conekt import db
+
+from sqlalchemy import func, literal
+
+from collections import defaultdict
+
+
+class SpeciesAnnotationCount(db.Model):
+    __tablename__ = 'species_annotation_counts'
+    __table_args__ = (db.Index('ix_species_annotation', 'annotation_type', 'annotation_id', 'species_id'),
+                      db.Index('ix_species_annotation_species', 'annotation_type', 'species_id', 'annotation_id'),
+                      {'extend_existing': True})
+
+    id = db.Column(db.Integer, primary_key=True)
+    species_id = db.Column(db.Integer, db.ForeignKey('species.id', ondelete='CASCADE'))
+
+    """
+    Type and internal ID of the annotation (GO term, InterPro domain, CAZYme or gene family) with the number of
+    sequences from the species associated with it. Together these rows form a sparse annotation x species matrix,
+    only non-zero counts are stored.
+    """
+    annotation_type = db.Column(db.Enum('interpro', 'go', 'cazyme', 'family', name='species_annotation_type'))
+    annotation_id = db.Column(db.Integer)
+    count = db.Column(db.Integer)
+
+    species = db.relationship('Species', backref=db.backref('annotation_counts',
+                                                            lazy='dynamic',
+                                                            passive_deletes=True))
+
+    @staticmethod
+    def update_counts(annotation_types=('go', 'interpro', 'cazyme', 'family'), species_id=None):
+        """
+        Counts for each annotation the number of associated sequences per species, with one GROUP BY query per type
+        of annotation. Predicted GO labels are excluded.
+
+        :param annotation_types: types of annotation to count (default: all)
+        :param species_id: only recount the annotation of this species (default: all species)
+        """
+        from conekt.models.sequences import Sequence
+        from conekt.models.relationships.sequence_go import SequenceGOAssociation
+        from conekt.models.relationships.sequence_interpro import SequenceInterproAssociation
+        from conekt.models.relationships.sequence_cazyme import SequenceCAZYmeAssociation
+        from conekt.models.relationships.sequence_family import SequenceFamilyAssociation
+
+        associations = {
+            'go': (SequenceGOAssociation, SequenceGOAssociation.go_id, [SequenceGOAssociation.predicted == 0]),
+            'interpro': (SequenceInterproAssociation, SequenceInterproAssociation.interpro_id, []),
+            'cazyme': (SequenceCAZYmeAssociation, SequenceCAZYmeAssociation.cazyme_id, []),
+            'family': (SequenceFamilyAssociation, SequenceFamilyAssociation.gene_family_id, [])
+        }
+
+        for annotation_type in annotation_types:
+            association, annotation_id, filters = associations[annotation_type]
+
+            counts = db.session.query(literal(annotation_type),
+                                      annotation_id,
+                                      Sequence.species_id,
+                                      func.count(association.sequence_id.distinct())).\
+                join(Sequence, Sequence.id == association.sequence_id).\
+                filter(*filters)
+
+            delete = SpeciesAnnotationCount.query.filter(SpeciesAnnotationCount.annotation_type == annotation_type)
+
+            if species_id is not None:
+                counts = counts.filter(Sequence.species_id == species_id)
+                delete = delete.filter(SpeciesAnnotationCount.species_id == species_id)
+
+            counts = counts.group_by(annotation_id, Sequence.species_id)
+
+            try:
+                delete.delete(synchronize_session=False)
+                db.session.execute(SpeciesAnnotationCount.__table__.insert().from_select(
+                    ['annotation_type', 'annotation_id', 'species_id', 'count'], counts.subquery().select()))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(e)
+
+    @staticmethod
+    def get_counts(annotation_type, species_id):
+        """
+        Gets the number of sequences from a species associated with each annotation of one type
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param species_id: internal ID of the species
+        :return: dict with internal annotation IDs as keys and counts as values
+        """
+        counts = db.session.query(SpeciesAnnotationCount.annotation_id, SpeciesAnnotationCount.count).\
+            filter(SpeciesAnnotationCount.annotation_type == annotation_type).\
+            filter(SpeciesAnnotationCount.species_id == species_id).all()
+
+        return {annotation_id: count for annotation_id, count in counts}
+
+    @staticmethod
+    def get_species_counts(annotation_type, annotation_id):
+        """
+        Gets the phylogenetic profile of one annotation
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param annotation_id: internal ID of the annotation
+        :return: dict with species codes as keys and counts as values
+        """
+        from conekt.models.species import Species
+
+        counts = db.session.query(Species.code, SpeciesAnnotationCount.count).\
+            join(SpeciesAnnotationCount, SpeciesAnnotationCount.species_id == Species.id).\
+            filter(SpeciesAnnotationCount.annotation_type == annotation_type).\
+            filter(SpeciesAnnotationCount.annotation_id == annotation_id).all()
+
+        return {code: count for code, count in counts}
+
+    @staticmethod
+    def get_profiles(annotation_type, annotation_ids=None):
+        """
+        Gets the phylogenetic profiles of many annotations of the same type at once
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param annotation_ids: list of internal annotation IDs (all annotations of this type if None)
+        :return: dict with internal annotation IDs as keys and dicts with counts per species (codes are keys) as values
+        """
+        from conekt.models.species import Species
+
+        query = db.session.query(SpeciesAnnotationCount.annotation_id, Species.code, SpeciesAnnotationCount.count).\
+            join(Species, SpeciesAnnotationCount.species_id == Species.id).\
+            filter(SpeciesAnnotationCount.annotation_type == annotation_type)
+
+        output = defaultdict(dict)
+
+        if annotation_ids is None:
+            data = query.all()
+        else:
+            annotation_ids = list(set(annotation_ids))
+            data = []
+            for i in range(0, len(annotation_ids), 400):
+                data += query.filter(SpeciesAnnotationCount.annotation_id.in_(annotation_ids[i:i + 400])).all()
+
+        for annotation_id, code, count in data:
+            output[annotation_id][code] = count
+
+        return output
+
+    @staticmethod
+    def find_by_presence(annotation_type, present=None, absent=None):
+        """
+        Finds annotations that occur in all species from one list and in none of the species from another list (e.g.
+        families present in all genotypes of one species, but absent in another one)
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param present: list of internal species IDs the annotation needs to occur in
+        :param absent: list of internal species IDs the annotation can't occur in
+        :return: list of internal annotation IDs
+        """
+        present = list(set(present)) if present is not None else []
+        absent = list(set(absent)) if absent is not None else []
+
+        query = db.session.query(SpeciesAnnotationCount.annotation_id).\
+            filter(SpeciesAnnotationCount.annotation_type == annotation_type)
+
+        if len(present) > 0:
+            query = query.filter(SpeciesAnnotationCount.species_id.in_(present)).\
+                group_by(SpeciesAnnotationCount.annotation_id).\
+                having(func.count(SpeciesAnnotationCount.species_id.distinct()) == len(present))
+        else:
+            query = query.distinct()
+
+        if len(absent) > 0:
+            absent_query = db.session.query(SpeciesAnnotationCount.annotation_id).\
+                filter(SpeciesAnnotationCount.annotation_type == annotation_type).\
+                filter(SpeciesAnnotationCount.species_id.in_(absent))
+            query = query.filter(SpeciesAnnotationCount.annotation_id.notin_(absent_query))
+
+        return [a.annotation_id for a in query.all()]
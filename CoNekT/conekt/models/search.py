@@ -1,7 +1,10 @@
 from sqlalchemy import func
-from sqlalchemy.sql import or_, and_
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import or_
 
+from conekt import db
 from conekt.models.expression.profiles import ExpressionProfile
+from conekt.models.expression.specificity import ExpressionSpecificity
 from conekt.models.gene_families import GeneFamily
 from conekt.models.go import GO
 from conekt.models.interpro import Interpro
@@ -12,10 +15,17 @@ from conekt.models.relationships.cluster_clade import ClusterCladeEnrichment
 from conekt.models.sequences import Sequence
 from conekt.models.xrefs import XRef
 from conekt.models.species import Species
+from conekt.models.full_text import FullTextIndex
+from conekt.models.fuzzy_names import FuzzyNames
+from conekt.models.search_planner import SearchPlanner
+from conekt.models.annotation_stats import sequence_facets
 
 import re
 import whoosh
 
+# maximum number of hits of the advanced search to count annotations for in the facets (species are always counted)
+MAX_FACET_SEQUENCES = 5000
+
 
 class Search:
     @staticmethod
@@ -23,37 +33,52 @@ class Search:
         """
         Private function to be used internally by the simple search. Performs an intuitive search on various fields.
 
-        all terms are converted into uppercase to make searches case insensitive
+        Identifiers (sequence names, xrefs, GO/InterPro labels, CAZYme and gene families and probes) are matched
+        exactly, converted into uppercase to make searches case insensitive. If none of these match, descriptions are
+        searched using the full-text index, "quoted text" is searched as a phrase and term* as a prefix.
 
         :param term_string: space-separated strings to search for
-        :return: dict with results per type
+        :return: dict with results per type (full-text hits are ranked by relevance) and facets
         """
-        terms = term_string.upper().split()
+        terms = [t for t in term_string.upper().split() if len(t) >= 3]
 
-        sequences = Sequence.query.filter(or_(or_(*[Sequence.name.ilike(term+"%") for term in terms
-                                                    if len(term) > 5]),
-                                              Sequence.name.in_(terms),
-                                              and_(*[Sequence.description.ilike("%"+term+"%") for term in terms
-                                                     if len(term) > 3]),
-                                              *[Sequence.xrefs.any(name=term) for term in terms]
-                                              )
-                                          ).limit(50).all()
+        sequences_by_name = Sequence.query.filter(Sequence.name.in_(terms),
+                                                  Sequence.type == 'protein_coding').limit(50).all()
+        sequences_by_xref = Sequence.query.filter(Sequence.xrefs.any(XRef.name.in_(terms)),
+                                                  Sequence.type == 'protein_coding').limit(50).all()
 
-        go = GO.query.filter(or_(and_(*[GO.description.ilike("%"+term+"%") for term in terms]),
-                                 and_(*[GO.name.ilike("%"+term+"%") for term in terms]),
-                                 GO.label.in_(terms))).limit(50).all()
+        sequences = sequences_by_name + sequences_by_xref
 
-        interpro = Interpro.query.filter(or_(and_(*[Interpro.description.ilike("%"+term+"%") for term in terms]),
-                                             Interpro.label.in_(terms))).limit(50).all()
+        if len(sequences) == 0:
+            # identifiers with a different version suffix or transcript tag
+            sequences = Search.__normalized_sequences(terms)
+
+        go = GO.query.filter(GO.label.in_(terms)).all()
+        interpro = Interpro.query.filter(Interpro.label.in_(terms)).all()
+        cazyme = CAZYme.query.filter(CAZYme.family.in_(terms)).all()
 
         families = GeneFamily.query.filter(func.upper(GeneFamily.name).in_(terms)).limit(50).all()
         profiles = ExpressionProfile.query.filter(ExpressionProfile.probe.in_(terms)).limit(50).all()
 
-        return {"go": go,
-                "interpro": interpro,
-                "sequences": sequences,
-                "families": families,
-                "profiles": profiles}
+        full_text_sequences, full_text_go, full_text_interpro, full_text_cazyme = [], [], [], []
+
+        if all([len(t) == 0 for t in [sequences, go, interpro, cazyme, families, profiles]]):
+            # didn't find a term by ID, try descriptions
+            full_text_sequences = FullTextIndex.search(Sequence, term_string, limit=50)
+            full_text_go = FullTextIndex.search(GO, term_string, limit=50)
+            full_text_interpro = FullTextIndex.search(Interpro, term_string, limit=50)
+            full_text_cazyme = FullTextIndex.search(CAZYme, term_string, limit=50)
+
+        output = {"go": (go + full_text_go)[:50],
+                  "interpro": (interpro + full_text_interpro)[:50],
+                  "cazyme": (cazyme + full_text_cazyme)[:50],
+                  "sequences": (sequences + full_text_sequences)[:50],
+                  "families": families,
+                  "profiles": profiles}
+
+        output["facets"] = sequence_facets([s.id for s in output["sequences"]])
+
+        return output
 
     @staticmethod
     def whooshee_simple(term_string):
@@ -105,113 +130,147 @@ class Search:
     @staticmethod
     def keyword(keyword):
         """
-        Keyword search, this is potentially faster than the simple search
+        Keyword search, this is potentially faster than the simple search. Identifiers need to match exactly,
+        descriptions are searched using the full-text index for words starting with the keyword.
 
         :param keyword: single word
-        :return: dict with results per type
+        :return: dict with results per type (full-text hits are ranked by relevance) and facets
         """
-        sequences = Sequence.query.filter(or_(Sequence.name.ilike(keyword+"%"),
-                                              Sequence.description.ilike("%"+keyword+"%"),
-                                              Sequence.xrefs.any(name=keyword), 
-                                              Sequence.type == 'protein_coding'
-                                              )
-                                          ).limit(50).all()
-
-        go = GO.query.filter(or_(GO.description.ilike("%"+keyword+"%"),
-                                 GO.name.ilike("%"+keyword+"%"),
-                                 GO.label == keyword)).limit(50).all()
-
-        interpro = Interpro.query.filter(or_(Interpro.description.ilike("%"+keyword+"%"),
-                                             Interpro.label == keyword)).limit(50).all()
-        
-        cazyme = CAZYme.query.filter(or_(CAZYme.activities.ilike("%"+keyword+"%"),
-                                             CAZYme.family == keyword, 
-                                             CAZYme.cazyme_class.ilike("%"+keyword+"%"))).limit(50).all()
+        full_text_keyword = keyword if keyword.endswith('*') else keyword + '*'
+
+        sequences = Sequence.query.filter(or_(Sequence.name == keyword,
+                                              Sequence.xrefs.any(name=keyword)),
+                                          Sequence.type == 'protein_coding').limit(50).all()
+
+        if len(sequences) == 0:
+            sequences = Search.__normalized_sequences([keyword])
+
+        go = GO.query.filter(GO.label == keyword).all()
+        interpro = Interpro.query.filter(Interpro.label == keyword).all()
+        cazyme = CAZYme.query.filter(CAZYme.family == keyword).all()
+
+        sequences += [s for s in FullTextIndex.search(Sequence, full_text_keyword, limit=50) if s not in sequences]
+        go += [t for t in FullTextIndex.search(GO, full_text_keyword, limit=50) if t not in go]
+        interpro += [i for i in FullTextIndex.search(Interpro, full_text_keyword, limit=50) if i not in interpro]
+        cazyme += [c for c in FullTextIndex.search(CAZYme, full_text_keyword, limit=50) if c not in cazyme]
 
         families = GeneFamily.query.filter(GeneFamily.name == keyword).limit(50).all()
         profiles = ExpressionProfile.query.filter(ExpressionProfile.probe == keyword).limit(50).all()
 
-        return {"go": go,
-                "interpro": interpro,
-                "cazyme": cazyme,
-                "sequences": sequences,
-                "families": families,
-                "profiles": profiles}
+        output = {"go": go[:50],
+                  "interpro": interpro[:50],
+                  "cazyme": cazyme[:50],
+                  "sequences": sequences[:50],
+                  "families": families,
+                  "profiles": profiles}
+
+        output["facets"] = sequence_facets([s.id for s in output["sequences"]])
+
+        return output
+
+    @staticmethod
+    def __normalized_sequences(terms):
+        """
+        Protein coding sequences with a name or cross-reference that matches one of the terms after removing version
+        suffixes and transcript tags, using the FuzzyNames index. The index is built in the background, until it is
+        ready nothing is found.
+
+        :param terms: list of identifiers
+        :return: list of (at most 50) sequences
+        """
+        sequence_ids = list(set([i for ids in FuzzyNames.lookup(terms).values() for i in ids]))
+
+        if len(sequence_ids) == 0:
+            return []
+
+        return Sequence.query.filter(Sequence.id.in_(sequence_ids[:400]),
+                                     Sequence.type == 'protein_coding').limit(50).all()
 
     @staticmethod
     def advanced_sequence_search(species_id, gene_list, terms, term_rules, gene_family_method_id, gene_families,
                                  go_terms, go_rules, interpro_domains,
                                  interpro_rules, cazyme_families, include_predictions=False):
+        """
+        Finds sequences matching all selected filters, the filters are evaluated by the SearchPlanner starting with
+        the most selective one
+
+        :param species_id: internal ID of the species (ignored if not a valid ID)
+        :param gene_list: list of sequence names or cross-references
+        :param terms: terms to look for in the description
+        :param term_rules: 'exact' (substring), 'all' or 'any' (full-text search)
+        :param gene_family_method_id: internal ID of the gene family method (ignored if 0 or lower)
+        :param gene_families: list of gene family names
+        :param go_terms: list of GO names
+        :param go_rules: 'all' or 'any'
+        :param interpro_domains: list of InterPro descriptions
+        :param interpro_rules: 'all' or 'any'
+        :param cazyme_families: list of CAZYme families (any of them)
+        :param include_predictions: also consider predicted GO labels
+        :return: dict with (at most 200) sequences and facets (counts per species and most common annotation) for all
+                 matching sequences, annotations are counted for a sample of MAX_FACET_SEQUENCES sequences when there
+                 are more hits ('sampled' in the facets)
+        """
         valid_species_ids = [s.id for s in Species.query.all()]
 
-        query = Sequence.query
+        if species_id not in valid_species_ids:
+            species_id = None
 
-        if gene_family_method_id > 0:
-            query = query.filter(Sequence.type == 'protein_coding', Sequence.families.any(or_(*[
-                and_(GeneFamily.method_id == gene_family_method_id, GeneFamily.name == name) for name in gene_families])))
+        criteria = []
 
-        # Add species filter if necessary
-        if species_id is not None and species_id in valid_species_ids:
-            query = query.filter(Sequence.species_id == species_id, Sequence.type == 'protein_coding')
+        if species_id is not None:
+            criteria.append(SearchPlanner.species(species_id))
+
+        if gene_family_method_id > 0 and len(gene_families) > 0:
+            criteria.append(SearchPlanner.families(gene_family_method_id, gene_families, species_id=species_id))
 
         if len(gene_list) > 0:
-            query = query.filter(or_(*[or_(Sequence.name == gene, 
-                                           Sequence.type == 'protein_coding',
-                                           Sequence.xrefs.any(name=gene)) for gene in gene_list]))
+            criteria.append(SearchPlanner.genes(gene_list))
 
         # Add terms filter if necessary
         if len(terms.strip()) > 5:
             if term_rules == 'exact':
                 # EXACT MATCH
-                query = query.filter(Sequence.description.ilike("%" + terms + "%"), Sequence.type == 'protein_coding')
+                criteria.append(SearchPlanner.description(terms))
             else:
                 # Prepare whooshee search (remove short strings)
                 whooshee_search_terms = [t for t in re.sub('(\W|\d)+', ' ', terms).split() if len(t) > 3]
                 whooshee_search_string = ' '.join(whooshee_search_terms)
                 if len(whooshee_search_string) > 5:
-                    if term_rules == 'all':
-                        # AND logic
-                        query = query.whooshee_search(whooshee_search_string, group=whoosh.qparser.AndGroup, limit=200)
-                    else:
-                        # OR logic
-                        query = query.whooshee_search(whooshee_search_string, group=whoosh.qparser.OrGroup, limit=200)
+                    # AND or OR logic
+                    group = whoosh.qparser.AndGroup if term_rules == 'all' else whoosh.qparser.OrGroup
+                    criteria.append(SearchPlanner.full_text(whooshee_search_string, group, limit=200))
 
         # Filter for GO terms
         if go_terms is not None and len(go_terms) > 0:
-            selected_go_id = [go.id for go in GO.query.filter(GO.name.in_(go_terms)).all()]
-
-            if go_rules == 'all':
-                if include_predictions:
-                    query = query.filter(and_(*[Sequence.go_associations.any(go_id=go_id) for go_id in selected_go_id]))
-                else:
-                    query = query.filter(and_(*[Sequence.go_associations.any(go_id=go_id, predicted=0)
-                                                for go_id in selected_go_id]))
-            else:
-                if include_predictions:
-                    query = query.filter(or_(*[Sequence.go_associations.any(go_id=go_id) for go_id in selected_go_id]))
-                else:
-                    query = query.filter(or_(*[Sequence.go_associations.any(go_id=go_id, predicted=0)
-                                               for go_id in selected_go_id]))
+            criteria.append(SearchPlanner.go(go_terms, rule=go_rules, include_predictions=include_predictions,
+                                             species_id=species_id))
 
         # Filter for InterPro domains
         if interpro_domains is not None and len(interpro_domains) > 0:
-            if interpro_rules == 'all':
-                query = query.filter(and_(*[Sequence.interpro_domains.any(description=t) for t in interpro_domains]))
-            else:
-                query = query.filter(or_(*[Sequence.interpro_domains.any(description=t) for t in interpro_domains]))
-        
+            criteria.append(SearchPlanner.interpro(interpro_domains, rule=interpro_rules, species_id=species_id))
+
         if cazyme_families is not None and len(cazyme_families) > 0:
-            query = query.filter(or_(*[Sequence.cazymes.any(family=t) for t in cazyme_families]))
+            criteria.append(SearchPlanner.cazyme(cazyme_families, species_id=species_id))
 
-        sequences = query.limit(200).all()
+        sequence_ids = SearchPlanner.run(criteria)
 
-        return sequences
+        if sequence_ids is None:
+            sequences = Sequence.query.limit(200).all()
+            return {"sequences": sequences, "facets": sequence_facets([s.id for s in sequences])}
+
+        # facets are counted for all hits, not only the ones that are shown, annotations of large sets are sampled
+        facets = sequence_facets(sequence_ids, max_annotated=MAX_FACET_SEQUENCES)
+
+        sequences = {s.id: s for s in Sequence.query.filter(Sequence.id.in_(sequence_ids[:200])).all()}
+
+        return {"sequences": [sequences[i] for i in sequence_ids[:200] if i in sequences.keys()],
+                "facets": facets}
 
     @staticmethod
     def count_enriched_clusters(go_id, method=-1, min_enrichment=None, max_p=None, max_corrected_p=None,
                                 enriched_clade_id=None):
         """
-        Function to get enriched clusters for a specific GO term
+        Function to count enriched clusters for a specific GO term
 
 
         :param go_id: Internal GO id
@@ -219,27 +278,63 @@ class Search:
         :param min_enrichment: minimal (log2) enrichment score (ignored if None)
         :param max_p: maximum (uncorrected) p-value (ignored if None)
         :param max_corrected_p: maximum corrected p-value (ignored if None)
-        :return: all clusters with the desired properties (ignored if None)
+        :return: number of clusters with the desired properties (ignored if None)
         """
-        clusters = ClusterGOEnrichment.query.filter(ClusterGOEnrichment.go_id == go_id)\
+        counts = Search.count_enriched_clusters_per_method(go_id,
+                                                           min_enrichment=min_enrichment,
+                                                           max_p=max_p,
+                                                           max_corrected_p=max_corrected_p,
+                                                           enriched_clade_id=enriched_clade_id)
 
-        if method != -1:
-            clusters = clusters.filter(ClusterGOEnrichment.cluster.has(method_id=method))
+        return sum(counts.values()) if method == -1 else counts.get(method, 0)
+
+    @staticmethod
+    def count_enriched_clusters_per_method(go_id, min_enrichment=None, max_p=None, max_corrected_p=None,
+                                           enriched_clade_id=None):
+        """
+        Counts enriched clusters for a specific GO term for each clustering method at once (grouped query)
+
+        :param go_id: Internal GO id
+        :param min_enrichment: minimal (log2) enrichment score (ignored if None)
+        :param max_p: maximum (uncorrected) p-value (ignored if None)
+        :param max_corrected_p: maximum corrected p-value (ignored if None)
+        :param enriched_clade_id: only include clusters enriched for this clade (ignored if None)
+        :return: dict with internal IDs of clustering methods as keys and the number of clusters as values
+        """
+        counts = db.session.query(CoexpressionCluster.method_id, func.count(ClusterGOEnrichment.id)).\
+            join(CoexpressionCluster, CoexpressionCluster.id == ClusterGOEnrichment.cluster_id).\
+            filter(ClusterGOEnrichment.go_id == go_id)
 
         if min_enrichment is not None:
-            clusters = clusters.filter(ClusterGOEnrichment.enrichment >= min_enrichment)
+            counts = counts.filter(ClusterGOEnrichment.enrichment >= min_enrichment)
 
         if max_p is not None:
-            clusters = clusters.filter(ClusterGOEnrichment.p_value <= max_p)
+            counts = counts.filter(ClusterGOEnrichment.p_value <= max_p)
 
         if max_corrected_p is not None:
-            clusters = clusters.filter(ClusterGOEnrichment.corrected_p_value <= max_corrected_p)
+            counts = counts.filter(ClusterGOEnrichment.corrected_p_value <= max_corrected_p)
 
         if enriched_clade_id is not None:
-            clusters = clusters.filter(ClusterGOEnrichment.cluster.has(
-                CoexpressionCluster.clade_enrichment.any(clade_id=enriched_clade_id)))
+            counts = counts.filter(CoexpressionCluster.clade_enrichment.any(clade_id=enriched_clade_id))
+
+        return {method_id: count for method_id, count in counts.group_by(CoexpressionCluster.method_id).all()}
+
+    @staticmethod
+    def count_specific_profiles_per_condition(method_id, cutoff):
+        """
+        Counts profiles with a specificity (SPM) score above a cutoff for all conditions of a method at once (grouped
+        query)
+
+        :param method_id: Internal ID of the expression specificity method
+        :param cutoff: minimal SPM score
+        :return: dict with conditions as keys and the number of profiles as values
+        """
+        counts = db.session.query(ExpressionSpecificity.condition, func.count(ExpressionSpecificity.id)).\
+            filter(ExpressionSpecificity.method_id == method_id).\
+            filter(ExpressionSpecificity.score >= cutoff).\
+            group_by(ExpressionSpecificity.condition).all()
 
-        return clusters.count()
+        return {condition: count for condition, count in counts}
 
     @staticmethod
     def enriched_clusters(go_id, method=-1, min_enrichment=None, max_p=None, max_corrected_p=None,
@@ -273,5 +368,9 @@ class Search:
             clusters = clusters.filter(ClusterGOEnrichment.cluster.has(
                 CoexpressionCluster.clade_enrichment.any(clade_id=enriched_clade_id)))
 
+        # the species and method of each cluster are shown with the results, load them along with the enrichment
+        clusters = clusters.options(joinedload('cluster').joinedload('method').
+                                    joinedload('network_method').joinedload('species'))
+
         return clusters.all()
 
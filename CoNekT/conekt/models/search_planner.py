@@ -0,0 +1,355 @@
+"""
+Planner for the advanced sequence search. Every filter (species, gene list, description, GO, InterPro, CAZYme or gene
+family) is a criterion that can return a sorted list of matching sequence IDs (a posting). The number of sequences
+each criterion matches is estimated from stored counts (species.sequence_count and species_annotation_counts), the most
+selective criterion is evaluated first. Other criteria are intersected with the candidates, either by fetching their
+posting (intersected using bisection or bitmaps) or, if they match far more sequences than there are candidates, by
+checking only the candidates.
+"""
+from conekt import db
+from conekt.models.cazyme import CAZYme
+from conekt.models.gene_families import GeneFamily
+from conekt.models.gene_resolver import GeneResolver
+from conekt.models.go import GO
+from conekt.models.interpro import Interpro
+from conekt.models.sequences import Sequence
+from conekt.models.species import Species
+from conekt.models.relationships.sequence_go import SequenceGOAssociation
+from conekt.models.relationships.sequence_interpro import SequenceInterproAssociation
+from conekt.models.relationships.sequence_cazyme import SequenceCAZYmeAssociation
+from conekt.models.relationships.sequence_family import SequenceFamilyAssociation
+from conekt.models.relationships.species_annotation_count import SpeciesAnnotationCount
+
+from utils.postings import intersect, union
+
+from sqlalchemy import func
+
+from collections import defaultdict
+
+CHUNK_SIZE = 400
+
+# candidates are checked directly (instead of fetching a posting) if a criterion is estimated to match more than
+# PROBE_RATIO times the number of candidates, and there are at most PROBE_LIMIT candidates
+PROBE_RATIO = 8
+PROBE_LIMIT = 4000
+
+
+class SearchPlanner:
+    @staticmethod
+    def run(criteria, limit=None):
+        """
+        Evaluates criteria, the most selective (lowest estimate) first. Criteria without an estimate are evaluated
+        last.
+
+        :param criteria: list of criteria (see criterion)
+        :param limit: maximum number of sequence IDs to return
+        :return: list of sequence IDs matching all criteria, None if there are no criteria
+        """
+        if len(criteria) == 0:
+            return None
+
+        candidates = SearchPlanner.evaluate(criteria)
+
+        order = None
+        for c in criteria:
+            if c['order'] is not None:
+                order = c['order']
+
+        if order is not None:
+            rank = {sequence_id: i for i, sequence_id in enumerate(order)}
+            candidates = sorted(candidates, key=lambda i: rank.get(i, len(rank)))
+
+        return candidates if limit is None else candidates[:limit]
+
+    @staticmethod
+    def evaluate(criteria, candidates=None):
+        """
+        Intersects criteria in order of selectivity. For each criterion either the posting is fetched and intersected
+        with the candidates, or, if the criterion matches far more sequences, only the candidates are checked.
+
+        :param criteria: list of criteria (see criterion)
+        :param candidates: sorted list of sequence IDs to start from (None to start from the first posting)
+        :return: sorted list of sequence IDs matching all criteria
+        """
+        for c in SearchPlanner.plan(criteria):
+            if candidates is None:
+                candidates = c['posting'](None)
+            elif len(candidates) <= PROBE_LIMIT and \
+                    (c['estimate'] is None or c['estimate'] > len(candidates) * PROBE_RATIO):
+                candidates = c['posting'](candidates)
+            else:
+                candidates = intersect([candidates, c['posting'](None)])
+
+            if len(candidates) == 0:
+                break
+
+        return candidates
+
+    @staticmethod
+    def plan(criteria):
+        """
+        Orders criteria by their estimated number of hits, criteria without an estimate go last
+
+        :param criteria: list of criteria (see criterion)
+        :return: sorted list of criteria
+        """
+        return sorted(criteria, key=lambda c: (c['estimate'] is None, c['estimate'] or 0))
+
+    @staticmethod
+    def criterion(name, estimate, query, column, order=None):
+        """
+        Creates a criterion from a query selecting sequence IDs
+
+        :param name: name of the criterion (for debugging)
+        :param estimate: estimated number of matching sequences (None if unknown)
+        :param query: query returning sequence IDs
+        :param column: column with the sequence ID, used to restrict the query to candidates
+        :param order: preferred order of the results (list of sequence IDs), e.g. by relevance
+        :return: dict describing the criterion
+        """
+        def posting(candidates):
+            if candidates is None:
+                return [i for i, in query.distinct().order_by(column).all()]
+
+            output = []
+            for i in range(0, len(candidates), CHUNK_SIZE):
+                output += [s for s, in query.filter(column.in_(candidates[i:i + CHUNK_SIZE])).distinct().all()]
+
+            return sorted(output)
+
+        return {'name': name, 'estimate': estimate, 'posting': posting, 'order': order}
+
+    @staticmethod
+    def fixed(name, sequence_ids, order=None):
+        """
+        Creates a criterion from a list of sequence IDs that is known beforehand
+
+        :param name: name of the criterion (for debugging)
+        :param sequence_ids: list of sequence IDs
+        :param order: preferred order of the results (list of sequence IDs)
+        :return: dict describing the criterion
+        """
+        sequence_ids = sorted(set(sequence_ids))
+
+        def posting(candidates):
+            return sequence_ids if candidates is None else intersect([candidates, sequence_ids])
+
+        return {'name': name, 'estimate': len(sequence_ids), 'posting': posting, 'order': order}
+
+    @staticmethod
+    def combine(name, criteria, rule='all'):
+        """
+        Combines criteria into a single one
+
+        :param name: name of the criterion (for debugging)
+        :param criteria: list of criteria
+        :param rule: 'all' (intersection) or 'any' (union)
+        :return: dict describing the criterion
+        """
+        if len(criteria) == 1:
+            return criteria[0]
+
+        estimates = [c['estimate'] for c in criteria]
+
+        if None in estimates:
+            estimate = None
+        else:
+            estimate = min(estimates) if rule == 'all' else sum(estimates)
+
+        def posting(candidates):
+            if rule == 'all':
+                return SearchPlanner.evaluate(criteria, candidates)
+            else:
+                return union([c['posting'](candidates) for c in criteria])
+
+        return {'name': name, 'estimate': estimate, 'posting': posting, 'order': None}
+
+    @staticmethod
+    def estimate_annotation(annotation_type, annotation_ids, species_id=None):
+        """
+        Estimates the number of sequences associated with annotations from the precomputed counts
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param annotation_ids: list of internal annotation IDs
+        :param species_id: only count sequences from this species
+        :return: dict with the annotation IDs as keys and counts as values, None if no counts are available
+        """
+        query = db.session.query(SpeciesAnnotationCount.annotation_id, func.sum(SpeciesAnnotationCount.count)).\
+            filter(SpeciesAnnotationCount.annotation_type == annotation_type).\
+            filter(SpeciesAnnotationCount.annotation_id.in_(annotation_ids))
+
+        if species_id is not None:
+            query = query.filter(SpeciesAnnotationCount.species_id == species_id)
+
+        output = {annotation_id: int(count) for annotation_id, count in
+                  query.group_by(SpeciesAnnotationCount.annotation_id).all()}
+
+        if len(output) == 0 and SpeciesAnnotationCount.query.\
+                filter(SpeciesAnnotationCount.annotation_type == annotation_type).first() is None:
+            return None
+
+        return {annotation_id: output.get(annotation_id, 0) for annotation_id in annotation_ids}
+
+    @staticmethod
+    def species(species_id):
+        """
+        Protein coding sequences from one species
+
+        :param species_id: internal ID of the species
+        :return: criterion
+        """
+        species = Species.query.get(species_id)
+
+        query = db.session.query(Sequence.id).\
+            filter(Sequence.species_id == species_id, Sequence.type == 'protein_coding')
+
+        return SearchPlanner.criterion('species', species.sequence_count, query, Sequence.id)
+
+    @staticmethod
+    def genes(gene_list):
+        """
+        Sequences with one of the names or cross-references (e.g. aliases) in a list
+
+        :param gene_list: list of identifiers
+        :return: criterion
+        """
+        resolved = GeneResolver.resolve(gene_list)
+
+        sequence_ids = list(resolved['matched'].values()) + [i for ids in resolved['ambiguous'].values() for i in ids]
+
+        return SearchPlanner.fixed('genes', sequence_ids)
+
+    @staticmethod
+    def description(terms):
+        """
+        Protein coding sequences with a description containing a string, this can't be estimated as it requires a full
+        scan
+
+        :param terms: string to look for
+        :return: criterion
+        """
+        query = db.session.query(Sequence.id).\
+            filter(Sequence.description.ilike("%" + terms + "%"), Sequence.type == 'protein_coding')
+
+        return SearchPlanner.criterion('description', None, query, Sequence.id)
+
+    @staticmethod
+    def full_text(search_string, group, limit=200):
+        """
+        Best hits of a Whooshee search on sequences, ranked by relevance
+
+        :param search_string: search string
+        :param group: whoosh group (AndGroup or OrGroup)
+        :param limit: maximum number of hits
+        :return: criterion
+        """
+        hits = [i for i, in Sequence.query.whooshee_search(search_string, group=group, limit=limit).
+                with_entities(Sequence.id).all()]
+
+        return SearchPlanner.fixed('full_text', hits, order=hits)
+
+    @staticmethod
+    def go(go_terms, rule='any', include_predictions=False, species_id=None):
+        """
+        Sequences associated with GO terms
+
+        :param go_terms: list of GO names
+        :param rule: 'all' (all terms are required) or 'any'
+        :param include_predictions: also consider predicted GO labels
+        :param species_id: species used to estimate the number of hits
+        :return: criterion
+        """
+        go_ids = [i for i, in db.session.query(GO.id).filter(GO.name.in_(go_terms)).all()]
+
+        filters = [] if include_predictions else [SequenceGOAssociation.predicted == 0]
+
+        return SearchPlanner.__annotation('go', {go_id: [go_id] for go_id in go_ids}, rule, species_id,
+                                          SequenceGOAssociation.sequence_id, SequenceGOAssociation.go_id, filters)
+
+    @staticmethod
+    def interpro(descriptions, rule='any', species_id=None):
+        """
+        Sequences associated with InterPro domains
+
+        :param descriptions: list of InterPro descriptions
+        :param rule: 'all' (all domains are required) or 'any'
+        :param species_id: species used to estimate the number of hits
+        :return: criterion
+        """
+        groups = defaultdict(list)
+        for interpro_id, description in db.session.query(Interpro.id, Interpro.description).\
+                filter(Interpro.description.in_(descriptions)).all():
+            groups[description].append(interpro_id)
+
+        return SearchPlanner.__annotation('interpro', groups, rule, species_id,
+                                          SequenceInterproAssociation.sequence_id,
+                                          SequenceInterproAssociation.interpro_id)
+
+    @staticmethod
+    def cazyme(families, species_id=None):
+        """
+        Sequences associated with any of the CAZYme families
+
+        :param families: list of CAZYme families
+        :param species_id: species used to estimate the number of hits
+        :return: criterion
+        """
+        cazyme_ids = [i for i, in db.session.query(CAZYme.id).filter(CAZYme.family.in_(families)).all()]
+
+        return SearchPlanner.__annotation('cazyme', {'any': cazyme_ids}, 'any', species_id,
+                                          SequenceCAZYmeAssociation.sequence_id, SequenceCAZYmeAssociation.cazyme_id)
+
+    @staticmethod
+    def families(method_id, names, species_id=None):
+        """
+        Protein coding sequences in any of the gene families
+
+        :param method_id: internal ID of the gene family method
+        :param names: list of family names
+        :param species_id: species used to estimate the number of hits
+        :return: criterion
+        """
+        family_ids = [i for i, in db.session.query(GeneFamily.id).
+                      filter(GeneFamily.method_id == method_id, GeneFamily.name.in_(names)).all()]
+
+        return SearchPlanner.__annotation('family', {'any': family_ids}, 'any', species_id,
+                                          SequenceFamilyAssociation.sequence_id,
+                                          SequenceFamilyAssociation.gene_family_id,
+                                          protein_coding=True)
+
+    @staticmethod
+    def __annotation(annotation_type, groups, rule, species_id, sequence_id, annotation_id, filters=None,
+                     protein_coding=False):
+        """
+        Creates a criterion for sequences associated with groups of annotations. A group matches if a sequence has any
+        of the annotations in the group, the rule defines if all or any of the groups need to match.
+
+        :param annotation_type: type of annotation ('interpro', 'go', 'cazyme' or 'family')
+        :param groups: dict with lists of internal annotation IDs as values
+        :param rule: 'all' or 'any'
+        :param species_id: species used to estimate the number of hits
+        :param sequence_id: column of the association with the sequence ID
+        :param annotation_id: column of the association with the annotation ID
+        :param filters: additional filters on the association (e.g. to exclude predicted GO labels)
+        :param protein_coding: only include protein coding sequences
+        :return: criterion
+        """
+        groups = [ids for ids in groups.values() if len(ids) > 0]
+
+        if len(groups) == 0:
+            return SearchPlanner.fixed(annotation_type, [])
+
+        estimates = SearchPlanner.estimate_annotation(annotation_type, [i for ids in groups for i in ids],
+                                                      species_id=species_id)
+
+        criteria = []
+        for ids in groups:
+            query = db.session.query(sequence_id).filter(annotation_id.in_(ids), *(filters or []))
+
+            if protein_coding:
+                query = query.join(Sequence, Sequence.id == sequence_id).filter(Sequence.type == 'protein_coding')
+
+            estimate = sum([estimates[i] for i in ids]) if estimates is not None else None
+            criteria.append(SearchPlanner.criterion(annotation_type, estimate, query, sequence_id))
+
+        return SearchPlanner.combine(annotation_type, criteria, rule=rule)
@@ -3,11 +3,10 @@ from conekt import db, whooshee
 from conekt.models.relationships import sequence_go, sequence_interpro, sequence_cazyme, sequence_family, sequence_coexpression_cluster
 from conekt.models.relationships import sequence_xref, sequence_sequence_ecc
 from utils.sequence import translate
-from utils.parser.fasta import Fasta
+from utils.parser.fasta import Fasta, FastaIndex, write_record
+from utils.sequence_packing import pack, unpack
 
-from sqlalchemy.orm import undefer
-from sqlalchemy.dialects.mysql import LONGTEXT
-import operator
+from sqlalchemy.dialects.mysql import LONGTEXT, LONGBLOB
 import sys
 
 SQL_COLLATION = 'NOCASE' if db.engine.name == 'sqlite' else ''
@@ -74,6 +73,9 @@ class Sequence(db.Model):
 
     xrefs = db.relationship('XRef', secondary=sequence_xref, lazy='joined')
 
+    # coding sequences can be stored compactly in a separate table, see Sequence.pack_sequences
+    packed = db.relationship('PackedSequence', uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
     def __init__(self, species_id, name, coding_sequence, type='protein_coding', is_chloroplast=False,
                  is_mitochondrial=False, description=None):
         self.species_id = species_id
@@ -92,7 +94,19 @@ class Sequence(db.Model):
 
         :return: The amino acid sequence based on the coding sequence
         """
-        return translate(self.coding_sequence)
+        return translate(self.nucleotide_sequence)
+
+    @property
+    def nucleotide_sequence(self):
+        """
+        The coding sequence, decoded from the packed version if it isn't stored as plain text
+
+        :return: The coding sequence
+        """
+        if self.coding_sequence is None and self.packed is not None:
+            return unpack(self.packed.data)
+
+        return self.coding_sequence
 
     @property
     def aliases(self):
@@ -159,33 +173,104 @@ class Sequence(db.Model):
             return 'other'
 
     @staticmethod
-    def add_from_fasta(filename, species_id, compressed=False, sequence_type='protein_coding'):
-        fasta_data = Fasta()
-        fasta_data.readfile(filename, compressed=compressed)
-
+    def add_from_fasta(filename, species_id, compressed=None, sequence_type='protein_coding', packed=False):
+        """
+        Adds sequences from a (gzipped) fasta file, the file is streamed so only one batch of sequences is kept in
+        memory at the time. Sequences are added in the order they appear in the file.
+
+        :param filename: fasta file
+        :param species_id: internal id of the species
+        :param compressed: set to true for gzipped files, detected automatically if None
+        :param sequence_type: type of the sequences (protein_coding, TE or RNA)
+        :param packed: set to true to store the coding sequences in the compact packed format
+        :return: number of sequences added
+        """
         new_sequences = []
+        count = 0
+
+        # the new sequences are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(Sequence):
+            for name, sequence in Fasta.iterate(filename, compressed=compressed):
+                new_sequence = {"species_id": species_id,
+                                "name": name,
+                                "description": None,
+                                "coding_sequence": sequence,
+                                "type": sequence_type,
+                                "is_mitochondrial": False,
+                                "is_chloroplast": False}
+
+                new_sequences.append(new_sequence)
+                count += 1
+
+                # add 400 sequences at the time, more can cause problems with some database engines
+                if len(new_sequences) >= 400:
+                    db.engine.execute(Sequence.__table__.insert(), new_sequences)
+                    new_sequences = []
+
+            # add the last set of sequences
+            if len(new_sequences) > 0:
+                db.engine.execute(Sequence.__table__.insert(), new_sequences)
 
-        # Loop over sequences, sorted by name (key here) and add to db
-        for name, sequence in sorted(fasta_data.sequences.items(), key=operator.itemgetter(0)):
-            new_sequence = {"species_id": species_id,
-                            "name": name,
-                            "description": None,
-                            "coding_sequence": sequence,
-                            "type": sequence_type,
-                            "is_mitochondrial": False,
-                            "is_chloroplast": False}
+        if packed:
+            Sequence.pack_sequences(species_id=species_id)
 
-            new_sequences.append(new_sequence)
+        return count
 
-            # add 400 sequences at the time, more can cause problems with some database engines
-            if len(new_sequences) > 400:
-                db.engine.execute(Sequence.__table__.insert(), new_sequences)
-                new_sequences = []
+    @staticmethod
+    def update_from_fasta(filename, species_id, sequence_type='protein_coding', chunk_size=400):
+        """
+        Replaces the coding sequences of existing sequences of a species (e.g. with a corrected release of the genome
+        annotation). Sequences are looked up by name in a faidx index of the file (see utils.parser.fasta.FastaIndex,
+        the name is the first word of the header), so only the current batch is kept in memory. Sequences missing from
+        the file are left unchanged. Packed sequences are packed again after the update.
+
+        Plain, gzipped and bgzipped files are supported, for large gzipped files use bgzip for fast random access.
+
+        :param filename: fasta file
+        :param species_id: internal id of the species
+        :param sequence_type: only update sequences of this type (protein_coding, TE or RNA)
+        :param chunk_size: number of sequences to update at the time
+        :return: tuple with the number of sequences updated and the number of sequences not found in the file
+        """
+        table = Sequence.__table__
+        packed_table = PackedSequence.__table__
+        updated, missing, repack = 0, 0, False
+        last_id = 0
+
+        with FastaIndex(filename) as index:
+            while True:
+                query = db.select([table.c.id, table.c.name, packed_table.c.sequence_id]).\
+                    select_from(table.outerjoin(packed_table, packed_table.c.sequence_id == table.c.id)).\
+                    where(table.c.id > last_id).\
+                    where(table.c.species_id == species_id).\
+                    where(table.c.type == sequence_type)
 
-        # add the last set of sequences
-        db.engine.execute(Sequence.__table__.insert(), new_sequences)
+                rows = db.engine.execute(query.order_by(table.c.id).limit(chunk_size)).fetchall()
 
-        return len(fasta_data.sequences.keys())
+                if len(rows) == 0:
+                    break
+
+                found = [(sequence_id, name, packed_id) for sequence_id, name, packed_id in rows if name in index]
+                missing += len(rows) - len(found)
+
+                # fetch in file order, gzipped files that aren't bgzipped can only be read forward efficiently
+                found.sort(key=lambda r: index.entries[r[1]][1])
+
+                if len(found) > 0:
+                    with db.engine.begin() as connection:
+                        connection.execute(table.update().where(table.c.id == db.bindparam('target_id')).
+                                           values(coding_sequence=db.bindparam('new_sequence')),
+                                           [{'target_id': sequence_id, 'new_sequence': index[name]}
+                                            for sequence_id, name, _ in found])
+
+                updated += len(found)
+                repack = repack or any([packed_id is not None for _, _, packed_id in found])
+                last_id = rows[-1][0]
+
+        if repack:
+            Sequence.pack_sequences(species_id=species_id)
+
+        return updated, missing
 
     @staticmethod
     def add_descriptions(filename, species_id):
@@ -196,33 +281,160 @@ class Sequence(db.Model):
         for s in sequences:
             seq_dict[s.name] = s
 
-        with open(filename, "r") as f_in:
-            for i, line in enumerate(f_in):
-                try:
-                    name, description = line.strip().split('\t')
-                except ValueError:
-                    print("Cannot parse line %d: \"%s\"" % (i, line), file=sys.stderr)
-                finally:
-                    if name in seq_dict.keys():
-                        seq_dict[name].description = description
+        # the descriptions are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(Sequence):
+            with open(filename, "r") as f_in:
+                for i, line in enumerate(f_in):
+                    try:
+                        name, description = line.strip().split('\t')
+                    except ValueError:
+                        print("Cannot parse line %d: \"%s\"" % (i, line), file=sys.stderr)
+                    finally:
+                        if name in seq_dict.keys():
+                            seq_dict[name].description = description
 
-                if i % 400 == 0:
-                    db.session.commit()
+                    if i % 400 == 0:
+                        db.session.commit()
 
-            db.session.commit()
+                db.session.commit()
 
     @staticmethod
-    def export_cds(filename):
-        sequences = Sequence.query.options(undefer('coding_sequence')).all()
+    def stream_sequences(species_id=None, sequence_type=None, chunk_size=400):
+        """
+        Gets the coding sequences of all sequences (matching the filters) in batches, ordered by ID. Each batch starts
+        after the last ID of the previous one, so only one batch is kept in memory. Packed sequences are decoded.
+
+        :param species_id: only include sequences from this species (default: all species)
+        :param sequence_type: only include sequences of this type (default: all types)
+        :param chunk_size: number of sequences to fetch at the time
+        :return: generator yielding tuples with the name and coding sequence
+        """
+        table = Sequence.__table__
+        packed_table = PackedSequence.__table__
+        last_id = 0
+
+        while True:
+            query = db.select([table.c.id, table.c.name, table.c.coding_sequence, packed_table.c.data]).\
+                select_from(table.outerjoin(packed_table, packed_table.c.sequence_id == table.c.id)).\
+                where(table.c.id > last_id)
+
+            if species_id is not None:
+                query = query.where(table.c.species_id == species_id)
+            if sequence_type is not None:
+                query = query.where(table.c.type == sequence_type)
+
+            rows = db.engine.execute(query.order_by(table.c.id).limit(chunk_size)).fetchall()
+
+            for _, name, coding_sequence, data in rows:
+                yield name, coding_sequence if coding_sequence is not None or data is None else unpack(data)
+
+            if len(rows) < chunk_size:
+                break
 
+            last_id = rows[-1][0]
+
+    @staticmethod
+    def pack_sequences(species_id=None, chunk_size=400):
+        """
+        Moves coding sequences to the packed_sequences table, where nucleotides take two bits (see
+        utils.sequence_packing). The plain text coding sequences are removed.
+
+        :param species_id: only pack sequences from this species (default: all species)
+        :param chunk_size: number of sequences to pack at the time
+        :return: number of sequences packed
+        """
+        table = Sequence.__table__
+        count = 0
+        last_id = 0
+
+        while True:
+            query = db.select([table.c.id, table.c.coding_sequence]).\
+                where(table.c.id > last_id).where(table.c.coding_sequence.isnot(None))
+
+            if species_id is not None:
+                query = query.where(table.c.species_id == species_id)
+
+            rows = db.engine.execute(query.order_by(table.c.id).limit(chunk_size)).fetchall()
+
+            if len(rows) == 0:
+                break
+
+            ids = [sequence_id for sequence_id, _ in rows]
+
+            # the packed sequence replaces an existing one (e.g. if a sequence was updated after packing)
+            with db.engine.begin() as connection:
+                connection.execute(PackedSequence.__table__.delete().
+                                   where(PackedSequence.__table__.c.sequence_id.in_(ids)))
+                connection.execute(PackedSequence.__table__.insert(),
+                                   [{"sequence_id": sequence_id,
+                                     "length": len(coding_sequence),
+                                     "data": pack(coding_sequence)} for sequence_id, coding_sequence in rows])
+                connection.execute(table.update().where(table.c.id.in_(ids)).values(coding_sequence=None))
+
+            count += len(rows)
+            last_id = ids[-1]
+
+        return count
+
+    @staticmethod
+    def unpack_sequences(species_id=None, chunk_size=400):
+        """
+        Restores plain text coding sequences from the packed_sequences table, reverts pack_sequences
+
+        :param species_id: only unpack sequences from this species (default: all species)
+        :param chunk_size: number of sequences to unpack at the time
+        :return: number of sequences unpacked
+        """
+        table = Sequence.__table__
+        packed_table = PackedSequence.__table__
+        count = 0
+        last_id = 0
+
+        while True:
+            query = db.select([packed_table.c.sequence_id, packed_table.c.data]).\
+                where(packed_table.c.sequence_id > last_id)
+
+            if species_id is not None:
+                query = query.where(packed_table.c.sequence_id.in_(db.select([table.c.id]).
+                                                                   where(table.c.species_id == species_id)))
+
+            rows = db.engine.execute(query.order_by(packed_table.c.sequence_id).limit(chunk_size)).fetchall()
+
+            if len(rows) == 0:
+                break
+
+            ids = [sequence_id for sequence_id, _ in rows]
+
+            with db.engine.begin() as connection:
+                for sequence_id, data in rows:
+                    connection.execute(table.update().where(table.c.id == sequence_id).
+                                       values(coding_sequence=unpack(data)))
+                connection.execute(packed_table.delete().where(packed_table.c.sequence_id.in_(ids)))
+
+            count += len(rows)
+            last_id = ids[-1]
+
+        return count
+
+    @staticmethod
+    def export_cds(filename):
         with open(filename, "w") as f_out:
-            for s in sequences:
-                print(">%s\n%s" % (s.name, s.coding_sequence), file=f_out)
+            for name, coding_sequence in Sequence.stream_sequences():
+                write_record(f_out, name, coding_sequence)
 
     @staticmethod
     def export_protein(filename):
-        sequences = Sequence.query.options(undefer('coding_sequence')).all()
-
         with open(filename, "w") as f_out:
-            for s in sequences:
-                print(">%s\n%s" % (s.name, s.protein_sequence), file=f_out)
+            for name, coding_sequence in Sequence.stream_sequences():
+                write_record(f_out, name, translate(coding_sequence))
+
+
+class PackedSequence(db.Model):
+    """
+    Compact version of a coding sequence (see utils.sequence_packing), kept in a separate table so the sequences table
+    stays small. Use Sequence.nucleotide_sequence to get the decoded sequence.
+    """
+    __tablename__ = 'packed_sequences'
+    sequence_id = db.Column(db.Integer, db.ForeignKey('sequences.id', ondelete='CASCADE'), primary_key=True)
+    length = db.Column(db.Integer)
+    data = db.Column(LONGBLOB)
@@ -0,0 +1,146 @@
+"""
+In-memory prefix indexes for the typeahead endpoints. Each process builds an index per type of data the first time it
+is used, it is rebuilt when the data changes (through the ORM in this process, or when the number of rows or the
+highest ID in the underlying tables differ, which is checked at most every REFRESH_INTERVAL seconds).
+"""
+from conekt import db
+from conekt.models.cazyme import CAZYme
+from conekt.models.gene_families import GeneFamily, GeneFamilyMethod
+from conekt.models.go import GO
+from conekt.models.interpro import Interpro
+from conekt.models.sequences import Sequence
+from conekt.models.species import Species
+from conekt.models.xrefs import XRef
+
+from utils.prefix_index import PrefixIndex
+
+from sqlalchemy import event, func
+
+from collections import defaultdict
+
+import time
+
+REFRESH_INTERVAL = 60
+MAX_RESULTS = 20
+
+TYPEAHEAD_MODELS = {
+    'go': [GO],
+    'interpro': [Interpro],
+    'cazyme': [CAZYme],
+    'sequence': [Sequence, XRef],
+    'family': [GeneFamily]
+}
+
+
+class Typeahead:
+    indexes = {}
+
+    @staticmethod
+    def complete(index_type, term, limit=MAX_RESULTS):
+        """
+        Returns the best completions for a partial search term, ordered by length
+
+        :param index_type: type of data ('go', 'interpro', 'cazyme', 'sequence' or 'family')
+        :param term: partial search term
+        :param limit: maximum number of completions (at most MAX_RESULTS)
+        :return: list of dicts compatible with typeahead.js
+        """
+        return Typeahead.get_index(index_type).complete(term, limit=limit)
+
+    @staticmethod
+    def get_index(index_type):
+        """
+        Gets the prefix index for a type of data, the index is (re-)built when needed
+
+        :param index_type: type of data ('go', 'interpro', 'cazyme', 'sequence' or 'family')
+        :return: PrefixIndex
+        """
+        current = Typeahead.indexes.get(index_type)
+
+        if current is not None and time.time() - current['checked'] < REFRESH_INTERVAL:
+            return current['index']
+
+        signature = Typeahead.__signature(index_type)
+
+        if current is None or current['signature'] != signature:
+            current = {'signature': signature, 'index': Typeahead.__build(index_type)}
+
+        current['checked'] = time.time()
+        Typeahead.indexes[index_type] = current
+
+        return current['index']
+
+    @staticmethod
+    def invalidate(index_type=None):
+        """
+        Drops an index, it will be rebuilt when it is used again
+
+        :param index_type: type of data (default: all indexes)
+        """
+        if index_type is None:
+            Typeahead.indexes.clear()
+        else:
+            Typeahead.indexes.pop(index_type, None)
+
+    @staticmethod
+    def __signature(index_type):
+        """
+        Number of rows and highest ID of the tables used to build an index
+
+        :param index_type: type of data
+        :return: list of (count, max id) tuples
+        """
+        return [tuple(db.session.query(func.count(m.id), func.max(m.id)).one()) for m in TYPEAHEAD_MODELS[index_type]]
+
+    @staticmethod
+    def __build(index_type):
+        if index_type == 'go':
+            terms = db.session.query(GO.label, GO.name).filter(GO.obsolete == 0, GO.name.isnot(None)).all()
+            entries = [(name.split() + [name, label], (len(name), name),
+                        {'value': name, 'tokens': name.split() + [label], 'label': label}) for label, name in terms]
+        elif index_type == 'interpro':
+            domains = db.session.query(Interpro.label, Interpro.description).\
+                filter(Interpro.description.isnot(None)).all()
+            entries = [(description.split() + [description, label], (len(description), description),
+                        {'value': description, 'tokens': description.split() + [label], 'label': label})
+                       for label, description in domains]
+        elif index_type == 'cazyme':
+            families = db.session.query(CAZYme.family, CAZYme.cazyme_class).\
+                filter(CAZYme.cazyme_class.isnot(None)).all()
+            entries = [(cazyme_class.split() + [cazyme_class, family], (len(family), family),
+                        {'value': family, 'tokens': cazyme_class.split() + [family], 'label': cazyme_class})
+                       for family, cazyme_class in families]
+        elif index_type == 'sequence':
+            aliases = defaultdict(list)
+            for sequence_id, name in db.session.query(Sequence.id, XRef.name).join(Sequence.xrefs).\
+                    filter(XRef.platform.in_(['token', 'display'])).all():
+                aliases[sequence_id].append(name)
+
+            sequences = db.session.query(Sequence.id, Sequence.name, Species.code).\
+                join(Species, Species.id == Sequence.species_id).\
+                filter(Sequence.type == 'protein_coding').all()
+            entries = [([name] + aliases[sequence_id], (len(name), name),
+                        {'value': name, 'tokens': [name] + aliases[sequence_id], 'label': code})
+                       for sequence_id, name, code in sequences]
+        elif index_type == 'family':
+            families = db.session.query(GeneFamily.name, GeneFamilyMethod.method).\
+                join(GeneFamilyMethod, GeneFamilyMethod.id == GeneFamily.method_id).all()
+            entries = [([name], (len(name), name), {'value': name, 'tokens': [name], 'label': method})
+                       for name, method in families]
+        else:
+            raise KeyError(index_type)
+
+        return PrefixIndex(entries, max_results=MAX_RESULTS)
+
+
+def _register_invalidation(index_type, model):
+    def invalidate(mapper, connection, target):
+        Typeahead.invalidate(index_type)
+
+    for e in ['after_insert', 'after_update', 'after_delete']:
+        event.listen(model, e, invalidate)
+
+
+for t, models in TYPEAHEAD_MODELS.items():
+    for m in models:
+        _register_invalidation(t, m)
@@ -61,31 +61,33 @@ class XRef(db.Model):
         sequences = species.sequences.all()
         seq_dict = {s.name.upper(): s for s in sequences}
 
-        with open(filename, "r") as f:
-            for i, line in enumerate(f):
-                sequence, name, platform, url = line.split('\t')
-
-                xref = XRef()
-                xref.name = name
-                xref.platform = platform
-                xref.url = url
-
-                if sequence.upper() in seq_dict.keys():
-                    s = seq_dict[sequence.upper()]
-                    s.xrefs.append(xref)
-
-                if i % 400 == 0:
-                    # Update every 400 lines
-                    try:
-                        db.session.commit()
-                    except Exception as e:
-                        db.session.rollback()
-
-            # Commit final changes
-            try:
-                db.session.commit()
-            except Exception as e:
-                db.session.rollback()
+        # the cross-references are indexed by WHOOSHEE in one pass when all of them are added
+        with whooshee.bulk_load(XRef):
+            with open(filename, "r") as f:
+                for i, line in enumerate(f):
+                    sequence, name, platform, url = line.split('\t')
+
+                    xref = XRef()
+                    xref.name = name
+                    xref.platform = platform
+                    xref.url = url
+
+                    if sequence.upper() in seq_dict.keys():
+                        s = seq_dict[sequence.upper()]
+                        s.xrefs.append(xref)
+
+                    if i % 400 == 0:
+                        # Update every 400 lines
+                        try:
+                            db.session.commit()
+                        except Exception as e:
+                            db.session.rollback()
+
+                # Commit final changes
+                try:
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
 
     @staticmethod
     def add_xref_families_from_file(gene_family_method_id, filename):
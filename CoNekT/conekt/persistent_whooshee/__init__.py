@@ -0,0 +1 @@
+from .whooshee import PersistentWhooshee
@@ -0,0 +1,416 @@
+from flask import current_app
+from flask_whooshee import Whooshee, _get_app, _get_config, INSERT_KWD, UPDATE_KWD, DELETE_KWD
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, object_session
+
+from whoosh.index import LockError
+from whoosh.writing import AsyncWriter
+
+import whoosh.index
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class PersistentWhooshee(Whooshee):
+    """
+    Whooshee with an index that persists between restarts and is shared by all processes (e.g. gunicorn workers).
+
+      * changes made through the ORM are collected per session and written in one go after the transaction is
+        committed (changes from transactions that are rolled back are dropped)
+      * for each index the highest indexed ID is kept, rows added outside the ORM (e.g. by the build scripts) are
+        indexed incrementally at the first request
+      * a full rebuild writes segments in parallel (multiprocessing) in a new directory, which replaces the existing
+        index when it is complete, so the current index remains usable during the rebuild
+      * bulk_load() defers indexing during large imports, new and changed rows are indexed in one pass afterwards
+    """
+    pending_key = 'whooshee_changes'
+
+    def __init__(self, app=None):
+        super().__init__(app)
+
+        self.local = threading.local()
+
+        event.listen(Session, 'after_commit', self.after_session_commit)
+        event.listen(Session, 'after_rollback', self.after_session_rollback)
+
+    def init_app(self, app):
+        """
+        Register with app, on top of Whooshee's settings WHOOSHEE_REBUILD_PROCS and WHOOSHEE_REBUILD_LIMITMB control
+        the resources used for a full rebuild, WHOOSHEE_UPDATE_ON_START starts the incremental update in a background
+        thread at the first request (off by default, use flask whooshee_update after loading data instead)
+
+        :param app: Flask application
+        """
+        super().init_app(app)
+
+        config = app.extensions['whooshee']
+        config['rebuild_procs'] = app.config.get('WHOOSHEE_REBUILD_PROCS', os.cpu_count() or 1)
+        config['rebuild_limitmb'] = app.config.get('WHOOSHEE_REBUILD_LIMITMB', 128)
+        config['update_on_start'] = app.config.get('WHOOSHEE_UPDATE_ON_START', False)
+
+        if config['update_on_start'] and not config['memory_storage'] and config['enable_indexing']:
+            app.before_first_request(self.__start_update)
+
+    def __start_update(self):
+        # the first request doesn't wait for the update, other workers skip it while the index is locked
+        threading.Thread(target=self.__update_in_background, args=(current_app._get_current_object(),),
+                         daemon=True).start()
+
+    def __update_in_background(self, app):
+        with app.app_context():
+            try:
+                for index, count in self.update().items():
+                    app.logger.info("Whooshee: indexed %d new rows in %s" % (count, index))
+            except Exception as e:
+                app.logger.error("Whooshee: incremental update failed: %s" % e)
+
+    @staticmethod
+    def __primary(wh):
+        return wh.models[0].__table__.primary_key.columns.values()[0].name
+
+    @staticmethod
+    def __fields(wh):
+        primary = PersistentWhooshee.__primary(wh)
+
+        return [name for name in wh.schema.names() if name != primary]
+
+    @staticmethod
+    def __document(wh, values):
+        """
+        Converts values from the database in a document for the index (the same way Whooshee's update_model does)
+
+        :param wh: whoosheer
+        :param values: dict with the values of the primary key and indexed fields
+        :return: dict with the document
+        """
+        primary = PersistentWhooshee.__primary(wh)
+
+        return {k: v if k == primary or isinstance(v, int) else str(v) for k, v in values.items()}
+
+    def __whoosheer(self, model):
+        for wh in self.whoosheers:
+            if model in wh.models:
+                return wh
+
+    def __index_path(self, wh):
+        return os.path.join(_get_config(self)['index_path_root'], wh.index_subdir)
+
+    def __get_last_id(self, wh):
+        """
+        Gets the highest ID of the rows in an index, this is stored next to the index
+
+        :param wh: whoosheer
+        :return: highest indexed ID, 0 for new indexes
+        """
+        try:
+            with open(self.__index_path(wh) + '.json') as f:
+                return json.load(f)['last_id']
+        except (IOError, ValueError, KeyError):
+            return 0
+
+    def __set_last_id(self, wh, last_id, replace=False):
+        """
+        Stores the highest ID in an index, concurrent processes might lower the value which leads to rows being
+        re-indexed (this is harmless as documents are replaced)
+
+        :param wh: whoosheer
+        :param last_id: highest ID written to the index
+        :param replace: set to True to overwrite a higher value (after a rebuild)
+        """
+        if not replace:
+            last_id = max(last_id, self.__get_last_id(wh))
+
+        with open(self.__index_path(wh) + '.json', 'w') as f:
+            json.dump({'last_id': last_id, 'updated': time.time()}, f)
+
+    def __track(self, target, change):
+        """
+        Keeps track of a change made through the ORM in the session, only the last change for each row is kept
+
+        :param target: changed object
+        :param change: type of change (INSERT_KWD, UPDATE_KWD or DELETE_KWD)
+        """
+        session = object_session(target)
+        wh = self.__whoosheer(target.__class__)
+
+        if session is None or wh is None or not wh.auto_update or _get_config(self)['enable_indexing'] is False:
+            return
+
+        primary = PersistentWhooshee.__primary(wh)
+
+        bulk_load = getattr(self.local, 'bulk_load', None)
+        if bulk_load is not None and wh in bulk_load.keys():
+            # only keep the ID, the row is (re-)indexed when the bulk load is done
+            bulk_load[wh]['ids'].add(getattr(target, primary))
+            return
+        fields = [primary] if change == DELETE_KWD else [primary] + PersistentWhooshee.__fields(wh)
+
+        changes = session.info.setdefault(self.pending_key, OrderedDict())
+        changes[(wh, getattr(target, primary))] = (change, {f: getattr(target, f) for f in fields})
+
+    def after_insert(self, mapper, connection, target):
+        self.__track(target, INSERT_KWD)
+
+    def after_update(self, mapper, connection, target):
+        self.__track(target, UPDATE_KWD)
+
+    def after_delete(self, mapper, connection, target):
+        self.__track(target, DELETE_KWD)
+
+    def after_session_commit(self, session):
+        changes = session.info.pop(self.pending_key, None)
+
+        if changes:
+            # the data is committed at this point, a failing index update should not break the request
+            try:
+                self.write_changes(changes)
+            except Exception as e:
+                _get_app(self).logger.error("Whooshee: failed to write changes to the index: %s" % e)
+
+    def after_session_rollback(self, session):
+        session.info.pop(self.pending_key, None)
+
+    def write_changes(self, changes):
+        """
+        Writes tracked changes to the indexes, with one writer per index. If another process holds the lock on an
+        index the changes are written in a background thread once the lock is released.
+
+        :param changes: OrderedDict with (whoosheer, id) as keys and (type of change, values) as values
+        """
+        per_whoosheer = OrderedDict()
+        for (wh, _), (change, values) in changes.items():
+            per_whoosheer.setdefault(wh, []).append((change, values))
+
+        for wh, wh_changes in per_whoosheer.items():
+            index = type(self).get_or_create_index(_get_app(self), wh)
+            primary = PersistentWhooshee.__primary(wh)
+
+            writer = AsyncWriter(index, writerargs={'timeout': _get_config(self)['writer_timeout']})
+            for change, values in wh_changes:
+                if change == DELETE_KWD:
+                    writer.delete_by_term(primary, values[primary])
+                else:
+                    writer.update_document(**PersistentWhooshee.__document(wh, values))
+            writer.commit()
+
+            inserted = [values[primary] for change, values in wh_changes if change == INSERT_KWD]
+            if len(inserted) > 0 and not _get_config(self)['memory_storage']:
+                self.__set_last_id(wh, max(inserted))
+
+    def __rows(self, wh, min_id=0, ids=None, batch_size=1000):
+        """
+        Generator with the values to index, only the required columns are loaded, in batches
+
+        :param wh: whoosheer
+        :param min_id: only rows with a higher ID are returned
+        :param ids: list of IDs, when set only these rows are returned (min_id is ignored)
+        :param batch_size: number of rows to load at once
+        """
+        primary = PersistentWhooshee.__primary(wh)
+        columns = [primary] + PersistentWhooshee.__fields(wh)
+
+        for model in wh.models:
+            query = model.query.with_entities(*[getattr(model, c) for c in columns])
+
+            if ids is not None:
+                for i in range(0, len(ids), 400):
+                    for row in query.filter(getattr(model, primary).in_(ids[i:i + 400])).all():
+                        yield dict(zip(columns, row))
+                continue
+
+            query = query.filter(getattr(model, primary) > min_id).order_by(getattr(model, primary))
+
+            for row in query.yield_per(batch_size):
+                yield dict(zip(columns, row))
+
+    def update(self):
+        """
+        Indexes rows with an ID higher than the last indexed one, this includes rows added to the database without
+        the ORM. Indexes that are locked by another process are skipped.
+
+        :return: dict with the number of indexed rows per index
+        """
+        output = {}
+
+        for wh in self.whoosheers:
+            primary = PersistentWhooshee.__primary(wh)
+            index = type(self).get_or_create_index(_get_app(self), wh)
+
+            try:
+                writer = index.writer(timeout=_get_config(self)['writer_timeout'])
+            except LockError:
+                _get_app(self).logger.warning("Whooshee: %s index is locked, skipping update" % wh.index_subdir)
+                continue
+
+            count, last_id = 0, self.__get_last_id(wh)
+            for values in self.__rows(wh, min_id=last_id):
+                writer.update_document(**PersistentWhooshee.__document(wh, values))
+                count, last_id = count + 1, values[primary]
+            writer.commit()
+
+            self.__set_last_id(wh, last_id)
+            output[wh.index_subdir] = count
+
+        return output
+
+    def __max_id(self, wh):
+        model = wh.models[0]
+
+        max_id = model.query.with_entities(func.max(getattr(model, PersistentWhooshee.__primary(wh)))).scalar()
+
+        return max_id if max_id is not None else 0
+
+    def __selected_whoosheers(self, models):
+        return [wh for wh in self.whoosheers if models is None or any([m in wh.models for m in models])]
+
+    @contextmanager
+    def bulk_load(self, *models, rebuild=False):
+        """
+        Context manager that defers indexing of the models during a bulk load (in the current thread). Rows changed
+        through the ORM are only tracked by ID, rows added without the ORM are found by their ID. When the block is
+        left, these are (re-)indexed with one writer per index. Changes can be committed at any frequency inside the
+        block.
+
+        Example:
+            with whooshee.bulk_load(GO):
+                GO.add_from_obo(filename)
+
+        :param models: models to defer indexing for (default: all registered models)
+        :param rebuild: rebuild the indexes of these models instead (e.g. when the tables were emptied first)
+        """
+        if getattr(self.local, 'bulk_load', None) is not None:
+            # nested bulk load, the outer one will index the data
+            yield
+            return
+
+        whoosheers = self.__selected_whoosheers(models if len(models) > 0 else None)
+        self.local.bulk_load = {wh: {'ids': set(), 'max_id': self.__max_id(wh)} for wh in whoosheers}
+
+        try:
+            yield
+        finally:
+            bulk_load, self.local.bulk_load = self.local.bulk_load, None
+
+            if _get_config(self)['enable_indexing']:
+                if rebuild:
+                    self.rebuild(models=[m for wh in whoosheers for m in wh.models])
+                else:
+                    for wh, changes in bulk_load.items():
+                        self.__index_bulk_load(wh, changes['ids'], changes['max_id'])
+
+    def __index_bulk_load(self, wh, ids, max_id):
+        """
+        Indexes rows after a bulk load, rows that no longer exist are removed from the index
+
+        :param wh: whoosheer
+        :param ids: IDs of rows changed through the ORM
+        :param max_id: highest ID in the table before the bulk load
+        """
+        primary = PersistentWhooshee.__primary(wh)
+        index = type(self).get_or_create_index(_get_app(self), wh)
+
+        writer = AsyncWriter(index, writerargs={'timeout': _get_config(self)['writer_timeout']})
+        last_id = max_id
+
+        found = set()
+        for values in self.__rows(wh, ids=[i for i in ids if i <= max_id]):
+            writer.update_document(**PersistentWhooshee.__document(wh, values))
+            found.add(values[primary])
+
+        for i in ids:
+            if i <= max_id and i not in found:
+                writer.delete_by_term(primary, i)
+
+        for values in self.__rows(wh, min_id=max_id):
+            writer.update_document(**PersistentWhooshee.__document(wh, values))
+            last_id = values[primary]
+
+        writer.commit()
+
+        if not _get_config(self)['memory_storage']:
+            self.__set_last_id(wh, last_id)
+
+    def reindex(self):
+        self.rebuild()
+
+    def rebuild(self, procs=None, models=None):
+        """
+        Rebuilds indexes from scratch. Each index is written in a new directory using multiple processes (each
+        writing its own segment) and swapped with the existing index when complete.
+
+        :param procs: number of processes to use (default: WHOOSHEE_REBUILD_PROCS)
+        :param models: only rebuild the indexes of these models (default: all indexes)
+        """
+        config = _get_config(self)
+
+        if config['memory_storage']:
+            return super().reindex()
+
+        procs = config['rebuild_procs'] if procs is None else procs
+
+        for wh in self.__selected_whoosheers(models):
+            primary = PersistentWhooshee.__primary(wh)
+            index_path = self.__index_path(wh)
+            new_path, old_path = index_path + '.new', index_path + '.old'
+
+            shutil.rmtree(new_path, ignore_errors=True)
+            os.makedirs(new_path)
+
+            index = whoosh.index.create_in(new_path, wh.schema)
+
+            if procs > 1:
+                writer = index.writer(procs=procs, limitmb=config['rebuild_limitmb'], multisegment=True)
+            else:
+                writer = index.writer(limitmb=config['rebuild_limitmb'])
+
+            last_id = 0
+            for values in self.__rows(wh):
+                writer.add_document(**PersistentWhooshee.__document(wh, values))
+                last_id = values[primary]
+            writer.commit()
+
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(index_path):
+                os.rename(index_path, old_path)
+            os.rename(new_path, index_path)
+            shutil.rmtree(old_path, ignore_errors=True)
+
+            config['whoosheers_indexes'][wh] = whoosh.index.open_dir(index_path)
+            self.__set_last_id(wh, last_id, replace=True)
+
+    def health(self):
+        """
+        Compares each index with the table it covers
+
+        :return: list of dicts with the status of each index
+        """
+        output = []
+        memory_storage = _get_config(self)['memory_storage']
+
+        for wh in self.whoosheers:
+            primary = PersistentWhooshee.__primary(wh)
+            model = wh.models[0]
+            index = type(self).get_or_create_index(_get_app(self), wh)
+
+            row_count, max_id = model.query.with_entities(func.count(getattr(model, primary)),
+                                                          func.max(getattr(model, primary))).one()
+            max_id = max_id if max_id is not None else 0
+            doc_count = index.doc_count()
+            last_id = max_id if memory_storage else self.__get_last_id(wh)
+
+            output.append({'index': wh.index_subdir,
+                           'documents': doc_count,
+                           'rows': row_count,
+                           'last_indexed_id': last_id,
+                           'max_id': max_id,
+                           'last_modified': index.last_modified(),
+                           'healthy': doc_count == row_count and last_id >= max_id})
+
+        return output
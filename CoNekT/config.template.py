@@ -42,11 +42,22 @@ WTF_CSRF_TIME_LIMIT = None
 MINIFY_PAGE = not DEBUG
 
 # Whooshee settings
-WHOOSHEE_DIR = tempfile.mkdtemp()
+# The index is stored in a fixed location so it persists between restarts and is shared by all workers
+WHOOSHEE_DIR = os.path.join(basedir, 'whooshee')
 WHOOSHEE_MIN_STRING_LEN = 3
 WHOOSHEE_WRITER_TIMEOUT = 2
 WHOOSHEE_MEMORY_STORAGE = False
 WHOOSHEE_ENABLE_INDEXING = True
+# Index rows added outside the website (e.g. by the build scripts) in a background thread after the first request,
+# alternatively run "flask whooshee_update" after loading data
+WHOOSHEE_UPDATE_ON_START = False
+# Number of processes and memory (per process, in MB) used to rebuild the index
+WHOOSHEE_REBUILD_PROCS = 4
+WHOOSHEE_REBUILD_LIMITMB = 256
+
+# Store coding sequences of new species in the compact packed format (two bits per nucleotide, see utils/sequence_packing.py)
+# Existing sequences can be (un)packed using 'flask pack_sequences'
+PACK_SEQUENCES = False
 
 # temp dir
 TMP_DIR = tempfile.mkdtemp()
@@ -49,5 +49,75 @@ def add_admin(username, password):
         db.session.commit()
 
 
+@app.cli.command()
+@click.argument('terms', type=str)
+@click.option('--repeats', type=int, default=5)
+def benchmark_search(terms, repeats):
+    """Compare the LIKE search on descriptions with the full-text index."""
+    import time
+    from sqlalchemy.sql import and_, or_
+    from conekt.models.full_text import FullTextIndex, FULL_TEXT_COLUMNS
+    from conekt.models.sequences import Sequence
+    from conekt.models.go import GO
+    from conekt.models.interpro import Interpro
+    from conekt.models.cazyme import CAZYme
+
+    for model in [Sequence, GO, Interpro, CAZYme]:
+        columns = [getattr(model, c) for c in FULL_TEXT_COLUMNS[model.__tablename__]]
+
+        start = time.time()
+        for _ in range(repeats):
+            like_hits = model.query.filter(and_(*[or_(*[c.ilike('%' + t + '%') for c in columns])
+                                                  for t in terms.split()])).limit(50).all()
+        like_time = (time.time() - start) / repeats
+
+        start = time.time()
+        for _ in range(repeats):
+            full_text_hits = FullTextIndex.search(model, terms, limit=50)
+        full_text_time = (time.time() - start) / repeats
+
+        click.echo('%s\tLIKE: %d hits in %2.4f sec\tfull-text: %d hits in %2.4f sec' %
+                   (model.__tablename__, len(like_hits), like_time, len(full_text_hits), full_text_time))
+
+
+@app.cli.command()
+@click.option('--procs', type=int, default=None)
+def whooshee_rebuild(procs):
+    """Rebuild the Whooshee index using multiple processes."""
+    from conekt import whooshee
+    whooshee.rebuild(procs=procs)
+
+
+@app.cli.command()
+def whooshee_update():
+    """Add rows that are missing from the Whooshee index (e.g. after running the build scripts)."""
+    from conekt import whooshee
+    for index, count in whooshee.update().items():
+        click.echo('%s: %d rows indexed' % (index, count))
+
+
+@app.cli.command()
+@click.option('--species_id', type=int, required=True)
+@click.option('--fasta', type=click.Path(exists=True), required=True)
+@click.option('--sequence_type', default='protein_coding')
+def update_sequences(species_id, fasta, sequence_type):
+    """Replace the coding sequences of a species with the ones from a (bgzipped) fasta file, matched by name."""
+    from conekt.models.sequences import Sequence
+    updated, missing = Sequence.update_from_fasta(fasta, species_id, sequence_type=sequence_type)
+    click.echo('%d sequences updated, %d not found in %s' % (updated, missing, fasta))
+
+
+@app.cli.command()
+@click.option('--species_id', type=int, default=None)
+@click.option('--unpack', is_flag=True, help='Restore the plain text coding sequences instead.')
+def pack_sequences(species_id, unpack):
+    """Store coding sequences in the compact packed format (two bits per nucleotide)."""
+    from conekt.models.sequences import Sequence
+    if unpack:
+        click.echo('%d sequences unpacked' % Sequence.unpack_sequences(species_id=species_id))
+    else:
+        click.echo('%d sequences packed' % Sequence.pack_sequences(species_id=species_id))
+
+
 if __name__ == '__main__':
     app.run()
\ No newline at end of file
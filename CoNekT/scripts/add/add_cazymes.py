@@ -55,8 +55,9 @@ def add_cazyme_from_tab(filename, species_code, engine):
         species_id = species.id
 
     with engine.connect() as conn:
-        stmt = select(Sequence).where(Sequence.__table__.c.species_id == species_id,\
-                                      Sequence.__table__.c.type == 'protein_coding')
+        stmt = select(Sequence.__table__.c.id, Sequence.__table__.c.name).\
+            where(Sequence.__table__.c.species_id == species_id,
+                  Sequence.__table__.c.type == 'protein_coding')
         all_sequences = conn.execute(stmt).all()
 
     with engine.connect() as conn:
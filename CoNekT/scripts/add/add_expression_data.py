@@ -284,8 +284,9 @@ def add_profile_from_lstrap(matrix_file, annotation_file, species_code, engine,
     
     # build conversion table for sequences
     with engine.connect() as conn:
-        stmt = select(Sequence).where(Sequence.__table__.c.species_id == species_id,
-                                      Sequence.__table__.c.type == "protein_coding")
+        stmt = select(Sequence.__table__.c.id, Sequence.__table__.c.name).\
+            where(Sequence.__table__.c.species_id == species_id,
+                  Sequence.__table__.c.type == "protein_coding")
         sequences = conn.execute(stmt).all()
 
     sequence_dict = {}  # key = sequence name uppercase, value internal id
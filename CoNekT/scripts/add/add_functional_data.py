@@ -2,14 +2,13 @@
 
 import argparse
 import xml.etree.ElementTree as ET
-from copy import deepcopy
 import gzip
 
 
 from sqlalchemy import create_engine
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import delete
+from sqlalchemy.sql import delete, insert, select
 
 # Create arguments
 parser = argparse.ArgumentParser(description='Add functional data to the database')
@@ -56,9 +55,11 @@ class OboEntry:
         self.namespace = ''
         self.definition = ''
         self.is_a = []
+        self.relationship = {}
         self.synonym = []
         self.alt_id = []
         self.extended_go = []
+        self.ancestor_distance = {}
         self.is_obsolete = False
 
     def set_id(self, term_id):
@@ -76,9 +77,17 @@ class OboEntry:
     def set_extended_go(self, parents):
         self.extended_go = parents
 
+    def set_ancestor_distance(self, distances):
+        self.ancestor_distance = distances
+
     def add_is_a(self, label):
         self.is_a.append(label)
 
+    def add_relationship(self, relationship_type, label):
+        if relationship_type not in self.relationship.keys():
+            self.relationship[relationship_type] = []
+        self.relationship[relationship_type].append(label)
+
     def add_synonym(self, label):
         self.synonym.append(label)
 
@@ -103,6 +112,9 @@ class OboEntry:
         elif key == "is_a":
             parts = value.split()
             self.add_is_a(parts[0])
+        elif key == "relationship":
+            parts = value.split()
+            self.add_relationship(parts[0], parts[1])
         elif key == "synonym":
             self.add_synonym(value)
         elif key == "alt_id":
@@ -183,30 +195,74 @@ class OBOParser:
             if current_term:
                 self.terms.append(current_term)
 
-    def extend_go(self):
+    def extend_go(self, relationships=('is_a',)):
         """
-        Run this after loading the OBO file to fill the extended GO table (all parental terms of the label).
+        Run this after loading the OBO file to fill the extended GO table (all parental terms of the label) and the
+        distance to each ancestor (shortest path).
+
+        Terms are numbered and the ancestors of each term are determined once, parents before children, by combining
+        the ancestors of its parents. Parents that are not defined in the file are included but not extended further.
+
+        :param relationships: relationship types to follow, default only is_a (e.g. use ('is_a', 'part_of') to
+            include part_of relationships)
         """
-        hashed_terms = {}
+        labels = [term.id for term in self.terms]
+        index = {label: i for i, label in enumerate(labels)}
 
+        parents = []
         for term in self.terms:
-            hashed_terms[term.id] = term
+            term_parents = []
+            for relationship_type in relationships:
+                if relationship_type == 'is_a':
+                    term_parents += term.is_a
+                elif relationship_type in term.relationship.keys():
+                    term_parents += term.relationship[relationship_type]
+
+            parent_ids = []
+            for label in term_parents:
+                if label not in index.keys():
+                    index[label] = len(labels)
+                    labels.append(label)
+                parent_ids.append(index[label])
+
+            parents.append(parent_ids)
+
+        # parents not defined in the file
+        parents += [[] for _ in range(len(labels) - len(parents))]
+
+        ancestors = [None] * len(labels)
+        in_progress = [False] * len(labels)
+
+        for start in range(len(labels)):
+            stack = [start]
+            while stack:
+                node = stack[-1]
+                if ancestors[node] is not None:
+                    stack.pop()
+                    continue
 
-        for term in self.terms:
-            extended_go = deepcopy(term.is_a)
+                in_progress[node] = True
+                # parents that are in progress are part of a cycle, their ancestors can't be used
+                todo = [p for p in parents[node] if ancestors[p] is None and not in_progress[p]]
 
-            found_new = True
+                if todo:
+                    stack += todo
+                else:
+                    node_ancestors = {p: 1 for p in parents[node]}
+                    for p in parents[node]:
+                        if ancestors[p] is not None:
+                            for a, distance in ancestors[p].items():
+                                if a not in node_ancestors.keys() or distance + 1 < node_ancestors[a]:
+                                    node_ancestors[a] = distance + 1
+                    node_ancestors.pop(node, None)
 
-            while found_new:
-                found_new = False
-                for parent_term in extended_go:
-                    new_gos = hashed_terms[parent_term].is_a
-                    for new_go in new_gos:
-                        if new_go not in extended_go:
-                            found_new = True
-                            extended_go.append(new_go)
+                    ancestors[node] = node_ancestors
+                    in_progress[node] = False
+                    stack.pop()
 
-            term.set_extended_go(extended_go)
+        for i, term in enumerate(self.terms):
+            term.set_extended_go([labels[a] for a in sorted(ancestors[i].keys())])
+            term.set_ancestor_distance({labels[a]: distance for a, distance in ancestors[i].items()})
 
 
 class InterPro:
@@ -357,6 +413,44 @@ def add_go_from_obo(filename, empty=True, compressed=False):
 
     session.commit()
 
+    add_go_closure(obo_parser.terms)
+
+
+def add_go_closure(terms):
+    """
+    Rebuilds the go_closure table, with for each term all ancestors and the distance to them. Each term is included as
+    its own ancestor (distance 0).
+
+    :param terms: list of OboEntry objects with ancestors determined (see OBOParser.extend_go)
+    """
+    if GOClosure is None:
+        # databases created before the go_closure table was introduced, the extended_go field is used instead
+        print("The go_closure table doesn't exist, skipping it (ancestors will be taken from extended_go)")
+        return
+
+    with engine.connect() as conn:
+        go_ids = {label: go_id for go_id, label in conn.execute(select(GO.id, GO.label)).all()}
+
+        conn.execute(delete(GOClosure))
+
+        closure = []
+
+        for term in terms:
+            closure.append({"go_id": go_ids[term.id], "ancestor_id": go_ids[term.id], "distance": 0})
+
+            for ancestor, distance in term.ancestor_distance.items():
+                if ancestor in go_ids.keys():
+                    closure.append({"go_id": go_ids[term.id], "ancestor_id": go_ids[ancestor], "distance": distance})
+
+            if len(closure) > 400:
+                conn.execute(insert(GOClosure), closure)
+                closure = []
+
+        if len(closure) > 0:
+            conn.execute(insert(GOClosure), closure)
+
+        conn.commit()
+
 
 interpro_file = ''
 go_file = ''
@@ -396,6 +490,7 @@ Base.prepare(engine, reflect=True)
 
 Interpro = Base.classes.interpro
 GO = Base.classes.go
+GOClosure = Base.classes.go_closure if 'go_closure' in Base.classes.keys() else None
 CAZYme = Base.classes.cazyme
 
 # Create a Session
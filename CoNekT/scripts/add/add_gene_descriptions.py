@@ -51,7 +51,9 @@ def add_descriptions(filename, species_code, engine):
         exit(1)
 
     with engine.connect() as conn:
-        stmt = select(Sequence).where(Sequence.__table__.c.type == 'protein_coding', Sequence.__table__.c.species_id == species.id)
+        stmt = select(Sequence.__table__.c.id, Sequence.__table__.c.name).\
+            where(Sequence.__table__.c.type == 'protein_coding',
+                  Sequence.__table__.c.species_id == species.id)
         all_sequences = conn.execute(stmt).all()
 
     seq_dict = {}
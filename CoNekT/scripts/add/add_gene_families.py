@@ -101,7 +101,7 @@ def add_families(families, family_members):
         for i, f in enumerate(families):
             
             with engine.connect() as conn:
-                stmt = select(Sequence).where(Sequence.id.in_(list(family_members[f.name])))
+                stmt = select(Sequence.__table__.c.id).where(Sequence.id.in_(list(family_members[f.name])))
                 family_sequences = conn.execute(stmt).all()
 
             for member in family_sequences:
@@ -4,8 +4,7 @@ import argparse
 
 from sqlalchemy import create_engine
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import select
+from sqlalchemy.sql import insert, select
 from collections import defaultdict
 
 parser = argparse.ArgumentParser(description='Add GO results to the database')
@@ -41,10 +40,36 @@ if args.db_password:
 else:
     db_password = input("Enter the database password: ")
 
-def add_go_from_tab(filename, species_code, engine, source="Source not provided"):
-    gene_hash = {}
-    go_hash = {}
 
+def load_ancestors(engine):
+    """
+    Loads the ancestors of all GO terms, from the go_closure table if it exists and is filled, otherwise from the
+    extended_go field
+
+    :param engine: SQLAlchemy engine
+    :return: dict with for each GO term (internal ID) the set of internal IDs of its ancestors
+    """
+    ancestors = defaultdict(set)
+
+    with engine.connect() as conn:
+        if GOClosure is not None:
+            stmt = select(GOClosure.__table__.c.go_id, GOClosure.__table__.c.ancestor_id).\
+                where(GOClosure.__table__.c.distance > 0)
+            for go_id, ancestor_id in conn.execute(stmt).all():
+                ancestors[go_id].add(ancestor_id)
+
+        if len(ancestors) == 0:
+            print("The go_closure table is missing or empty, using the extended_go field of the GO terms")
+            terms = conn.execute(select(GO.__table__.c.id, GO.__table__.c.label, GO.__table__.c.extended_go)).all()
+            go_ids = {label: go_id for go_id, label, _ in terms}
+            for go_id, _, extended_go in terms:
+                if extended_go:
+                    ancestors[go_id] = set([go_ids[label] for label in extended_go.split(";") if label in go_ids.keys()])
+
+    return ancestors
+
+
+def add_go_from_tab(filename, species_code, engine, source="Source not provided"):
     # Check if species exists in the database
     with engine.connect() as conn:
         stmt = select(Species).where(Species.__table__.c.code == species_code)
@@ -56,90 +81,69 @@ def add_go_from_tab(filename, species_code, engine, source="Source not provided"
     else:
         species_id = species.id
 
+    # Resolve gene names and GO labels to internal IDs once
     with engine.connect() as conn:
-        stmt = select(Sequence).where(Sequence.__table__.c.species_id == species_id,\
-                                        Sequence.__table__.c.type == 'protein_coding')
-        all_sequences = conn.execute(stmt).all()
-    
-    with engine.connect() as conn:
-        stmt = select(GO)
-        all_go = conn.execute(stmt).all()
+        stmt = select(Sequence.__table__.c.id, Sequence.__table__.c.name).\
+            where(Sequence.__table__.c.species_id == species_id,
+                  Sequence.__table__.c.type == 'protein_coding')
+        sequence_ids = {name: sequence_id for sequence_id, name in conn.execute(stmt).all()}
 
-    for sequence in all_sequences:
-        gene_hash[sequence.name] = sequence
+        stmt = select(GO.__table__.c.id, GO.__table__.c.label)
+        go_ids = {label: go_id for go_id, label in conn.execute(stmt).all()}
 
-    for term in all_go:
-        go_hash[term.label] = term
+    ancestors = load_ancestors(engine)
 
+    seen = set()
+    sequence_terms = defaultdict(set)
     associations = []
 
-    gene_go = defaultdict(list)
-
-    with open(filename, "r") as f:
-        for line in f:
-            gene, term, evidence = line.strip().split('\t')
-            if gene in gene_hash.keys():
-                current_sequence = gene_hash[gene]
-                if term in go_hash.keys():
-                    current_term = go_hash[term]
-                    association = {
-                        "sequence_id": current_sequence.id,
-                        "go_id": current_term.id,
-                        "evidence": evidence,
-                        "source": source,
-                        "predicted": 0}
-                    associations.append(association)
-                    session.add(SequenceGOAssociation(**association))
-
-                    if term not in gene_go[gene]:
-                        gene_go[gene].append(term)
-
+    with engine.connect() as conn:
+        with open(filename, "r") as f:
+            for line in f:
+                gene, term, evidence = line.strip().split('\t')
+                if gene in sequence_ids.keys():
+                    if term in go_ids.keys():
+                        key = (sequence_ids[gene], go_ids[term], evidence)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+
+                        sequence_terms[sequence_ids[gene]].add(go_ids[term])
+                        associations.append({"sequence_id": sequence_ids[gene],
+                                             "go_id": go_ids[term],
+                                             "evidence": evidence,
+                                             "source": source,
+                                             "predicted": 0})
+                    else:
+                        print(term, "not found in the database.")
                 else:
-                    print(term, "not found in the database.")
-            else:
-                print("Gene", gene, "not found in the database.")
-
-            if len(associations) > 400:
-                session.commit()
-                associations = []
-        
-    session.commit()
-
-    # Add extended GOs
-    for gene, terms in gene_go.items():
-        if gene in gene_hash.keys():
-            current_sequence = gene_hash[gene]
-            new_terms = []
-            current_terms = []
-
-            for term in terms:
-                if term not in current_terms:
-                    current_terms.append(term)
-
-            for term in terms:
-                if term in go_hash.keys():
-                    extended_terms = go_hash[term].extended_go.split(";")
-                    for extended_term in extended_terms:
-                        if extended_term not in current_terms and extended_term not in new_terms:
-                            new_terms.append(extended_term)
-
-            for new_term in new_terms:
-                if new_term in go_hash.keys():
-                    current_term = go_hash[new_term]
-                    association = {
-                        "sequence_id": current_sequence.id,
-                        "go_id": current_term.id,
-                        "evidence": None,
-                        "source": "Extended",
-                        "predicted": 0}
-                    associations.append(association)
-                    session.add(SequenceGOAssociation(**association))
-
-                if len(associations) > 400:
-                    session.commit()
+                    print("Gene", gene, "not found in the database.")
+
+                if len(associations) >= 400:
+                    conn.execute(insert(SequenceGOAssociation), associations)
                     associations = []
 
-    session.commit()
+        # Add extended GOs
+        for sequence_id, terms in sequence_terms.items():
+            extended_terms = set()
+            for go_id in terms:
+                extended_terms |= ancestors[go_id]
+
+            for go_id in sorted(extended_terms - terms):
+                associations.append({"sequence_id": sequence_id,
+                                     "go_id": go_id,
+                                     "evidence": None,
+                                     "source": "Extended",
+                                     "predicted": 0})
+
+                if len(associations) >= 400:
+                    conn.execute(insert(SequenceGOAssociation), associations)
+                    associations = []
+
+        if len(associations) > 0:
+            conn.execute(insert(SequenceGOAssociation), associations)
+
+        conn.commit()
 
 go_tsv = args.go_file
 sps_code = args.species_code
@@ -160,12 +164,7 @@ Species = Base.classes.species
 Sequence = Base.classes.sequences
 GO = Base.classes.go
 SequenceGOAssociation = Base.classes.sequence_go
-
-# Create a Session
-Session = sessionmaker(bind=engine)
-session = Session()
+GOClosure = Base.classes.go_closure if 'go_closure' in Base.classes.keys() else None
 
 # Run function to add GO results for species
 add_go_from_tab(go_tsv, sps_code, engine, source=annotation_source)
-
-session.close()
\ No newline at end of file
@@ -87,8 +87,9 @@ def read_expression_network_lstrap(network_file, species_code, description, engi
 
     # build conversion table for sequences
     with engine.connect() as conn:
-            stmt = select(Sequence).where(Sequence.__table__.c.species_id == species_id,\
-                                          Sequence.__table__.c.type == 'protein_coding')
+            stmt = select(Sequence.__table__.c.id, Sequence.__table__.c.name).\
+                where(Sequence.__table__.c.species_id == species_id,
+                      Sequence.__table__.c.type == 'protein_coding')
             sequences = conn.execute(stmt).all()
 
     sequence_dict = {} # key = sequence name uppercase, value internal id
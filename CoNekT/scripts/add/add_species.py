@@ -4,7 +4,6 @@ import argparse
 import psutil
 import sys
 import gzip
-import operator
 import time
 
 from sqlalchemy import create_engine
@@ -59,6 +58,32 @@ class Fasta:
 
         return output
 
+    @staticmethod
+    def iterate(filename, compressed=False):
+        """
+        Reads a fasta file one sequence at the time, only the current sequence is kept in memory
+
+        :param filename: file to read
+        :param compressed: set to true if reading form a gzipped file
+        :return: generator yielding tuples with the name and the sequence
+        """
+        name = None
+        sequence = []
+
+        with (gzip.open(filename, 'rt') if compressed else open(filename, 'r')) as f:
+            for line in f:
+                line = line.rstrip()
+                if line.startswith(">"):
+                    if name is not None:
+                        yield name, ''.join(sequence)
+                    name = line.lstrip('>')
+                    sequence = []
+                else:
+                    sequence.append(line)
+
+        if name is not None:
+            yield name, ''.join(sequence)
+
     def readfile(self, filename, compressed=False, verbose=False):
         """
         Reads a fasta file to the dictionary
@@ -70,33 +95,11 @@ class Fasta:
         if verbose:
             print("Reading FASTA file:" + filename + "...", file=sys.stderr)
 
-        # Initialize variables
-        name = ''
-        sequence = []
-        count = 1
+        count = 0
+        for name, sequence in Fasta.iterate(filename, compressed=compressed):
+            self.sequences[name] = sequence
+            count += 1
 
-        # open file
-        if compressed:
-            f = gzip.open(filename, 'rt')
-        else:
-            f = open(filename, 'r')
-
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                # ignore if first
-                if not name == '':
-                    self.sequences[name] = ''.join(sequence)
-                    count += 1
-                name = line.lstrip('>')
-                sequence = []
-            else:
-                sequence.append(line)
-
-        # add last gene
-        self.sequences[name] = ''.join(sequence)
-
-        f.close()
         if verbose:
             print("Done! (found ", count, " sequences)", file=sys.stderr)
 
@@ -195,13 +198,10 @@ def add_species(code, name, engine, data_type='genome',
 
 
 def add_from_fasta(filename, species_id, compressed=False, sequence_type='protein_coding'):
-    fasta_data = Fasta()
-    fasta_data.readfile(filename, compressed=compressed)
-
-    new_sequences = []
+    # sequences are streamed from the file (in file order), only the current batch is kept in memory
+    count = 0
 
-    # Loop over sequences, sorted by name (key here) and add to db
-    for name, sequence in sorted(fasta_data.sequences.items(), key=operator.itemgetter(0)):
+    for name, sequence in Fasta.iterate(filename, compressed=compressed):
         new_sequence = {"species_id": species_id,
                         "name": name,
                         "description": None,
@@ -210,23 +210,23 @@ def add_from_fasta(filename, species_id, compressed=False, sequence_type='protei
                         "is_mitochondrial": False,
                         "is_chloroplast": False}
 
-        new_sequences.append(new_sequence)
-
         new_sequence_obj = Sequence(**new_sequence)
 
         session.add(new_sequence_obj)
+        count += 1
 
         # add 400 sequences at the time
-        if len(new_sequences) > 400:
+        if count % 400 == 0:
             session.commit()
+            session.expunge_all()
             print_memory_usage()
-            new_sequences = []
 
     # add the last set of sequences
     session.commit()
+    session.expunge_all()
     print_memory_usage()
 
-    return len(fasta_data.sequences.keys())
+    return count
 
 
 db_admin = args.db_admin
@@ -1,17 +1,15 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 
-from math import log2
-from utils_scripts.enrichment import hypergeo_sf, fdr_correction
+from collections import defaultdict
+from multiprocessing import Pool
+from utils_scripts.enrichment import cluster_go_enrichment
 
 from sqlalchemy import create_engine
 from sqlalchemy.ext.automap import automap_base
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
-from sqlalchemy.sql import delete, select
-from sqlalchemy.orm import joinedload
+from sqlalchemy.sql import delete, insert, select
 
 # Create arguments
 parser = argparse.ArgumentParser(description='Compute GO enrichment for all clusters in the database.')
@@ -27,6 +25,11 @@ parser.add_argument('--db_password', type=str, metavar='DB password',
                     dest='db_password',
                     help='The database password',
                     required=False)
+parser.add_argument('--processes', type=int, metavar='N',
+                    dest='processes',
+                    help='Number of species to process in parallel (default: 1)',
+                    default=1,
+                    required=False)
 
 args = parser.parse_args()
 
@@ -36,77 +39,83 @@ else:
     db_password = input("Enter the database password: ")
 
 
-def __calculate_enrichment(engine, cluster, all_species_db, all_network_methods_db, all_clustering_methods_db, go_species_counts_dict):
-        """
-        Initial implementation to calculate GO enrichment for a single cluster
-        """
-        
-        clustering_method = [n for n in all_clustering_methods_db if n.id == cluster.method_id][0]
-        network_method = [n for n in all_network_methods_db if n.id == clustering_method.network_method_id][0]
-        
-        species = [s for s in all_species_db if s.id == network_method.species_id][0]
-        species_id = species.id
-        gene_count = species.sequence_count
+def load_species_data(engine, species_id):
+    """
+    Loads the members of all co-expression clusters of a species and the non-predicted GO annotation of all its
+    sequences as sparse incidence dicts (cluster -> set of sequences and sequence -> set of GO terms).
 
-        with engine.connect() as conn:
-            stmt = select(SequenceCoexpressionClusterAssociation.__table__.c.sequence_id)\
-                        .where(SequenceCoexpressionClusterAssociation.__table__.c.coexpression_cluster_id == cluster.id).distinct()
-            sequences_cluster = conn.execute(stmt).all()
+    :param engine: SQLAlchemy engine
+    :param species_id: internal ID of the species
+    :return: tuple with cluster members and sequence GO terms
+    """
+    with engine.connect() as conn:
+        stmt = select(SequenceCoexpressionClusterAssociation.__table__.c.coexpression_cluster_id,
+                      SequenceCoexpressionClusterAssociation.__table__.c.sequence_id).\
+            join(CoexpressionCluster.__table__,
+                 SequenceCoexpressionClusterAssociation.__table__.c.coexpression_cluster_id == CoexpressionCluster.__table__.c.id).\
+            join(CoexpressionClusteringMethod.__table__,
+                 CoexpressionCluster.__table__.c.method_id == CoexpressionClusteringMethod.__table__.c.id).\
+            join(ExpressionNetworkMethod.__table__,
+                 CoexpressionClusteringMethod.__table__.c.network_method_id == ExpressionNetworkMethod.__table__.c.id).\
+            where(ExpressionNetworkMethod.__table__.c.species_id == species_id,
+                  SequenceCoexpressionClusterAssociation.__table__.c.sequence_id.is_not(None))
+        memberships = conn.execute(stmt).all()
+
+    cluster_members = defaultdict(set)
+    for cluster_id, sequence_id in memberships:
+        cluster_members[cluster_id].add(sequence_id)
 
-        with engine.connect() as conn:
-            stmt = select(SequenceGOAssociation.__table__.c.sequence_id,
-                  SequenceGOAssociation.__table__.c.go_id).\
-                    where(SequenceGOAssociation.sequence_id.in_([s.sequence_id for s in sequences_cluster]),
-                          SequenceGOAssociation.predicted == 0).\
-                    group_by(SequenceGOAssociation.sequence_id, SequenceGOAssociation.go_id)
-            associations = conn.execute(stmt).all()
-
-        go_data = {}
-
-        for a in associations:
-            if a.go_id not in go_data.keys():
-                go_data[a.go_id] = {}
-                go_data[a.go_id]["total_count"] = go_species_counts_dict[a.go_id][species_id]
-                go_data[a.go_id]["cluster_count"] = 1
-            else:
-                go_data[a.go_id]["cluster_count"] += 1
-
-        p_values = []
-        for go_id in go_data:
-            p_values.append(hypergeo_sf(go_data[go_id]['cluster_count'],
-                                        len(sequences_cluster),
-                                        go_data[go_id]['total_count'],
-                                        gene_count))
-
-        corrected_p_values = fdr_correction(p_values)
-
-        for i, go_id in enumerate(go_data):
-            enrichment = ClusterGOEnrichment()
-            enrichment.cluster_id = cluster.id
-            enrichment.go_id = go_id
-
-            enrichment.cluster_count = go_data[go_id]['cluster_count']
-            enrichment.cluster_size = len(sequences_cluster)
-            enrichment.go_count = go_data[go_id]['total_count']
-            enrichment.go_size = gene_count
-
-            enrichment.enrichment = log2((go_data[go_id]['cluster_count']/len(sequences_cluster))/(go_data[go_id]['total_count']/gene_count))
-            enrichment.p_value = p_values[i]
-            enrichment.corrected_p_value = corrected_p_values[i]
-
-            session.add(enrichment)
-
-        try:
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            print(e)
-
-
-def calculate_enrichment(engine, all_species_db, all_network_methods_db, all_clustering_methods_db, go_species_counts_dict, empty=True):
+    with engine.connect() as conn:
+        stmt = select(SequenceGOAssociation.__table__.c.sequence_id,
+                      SequenceGOAssociation.__table__.c.go_id).\
+            join(Sequence.__table__, SequenceGOAssociation.__table__.c.sequence_id == Sequence.__table__.c.id).\
+            where(Sequence.__table__.c.species_id == species_id,
+                  SequenceGOAssociation.__table__.c.predicted == 0).distinct()
+        associations = conn.execute(stmt).all()
+
+    sequence_go = defaultdict(set)
+    for sequence_id, go_id in associations:
+        sequence_go[sequence_id].add(go_id)
+
+    return cluster_members, sequence_go
+
+
+def calculate_species_enrichment(species):
+    """
+    Calculates GO enrichment for all clusters of one species and writes the results in bulk. Each call opens its own
+    connection so species can be processed in separate processes.
+
+    :param species: tuple with species ID and number of protein coding genes
+    :return: number of enrichment rows added
+    """
+    species_id, gene_count = species
+
+    engine = create_engine(create_engine_string, poolclass=NullPool)
+
+    cluster_members, sequence_go = load_species_data(engine, species_id)
+
+    if len(cluster_members) == 0:
+        return 0
+
+    enrichments = cluster_go_enrichment((cluster_members, sequence_go, gene_count))
+
+    with engine.connect() as conn:
+        for i in range(0, len(enrichments), 400):
+            conn.execute(insert(ClusterGOEnrichment), enrichments[i: i + 400])
+        conn.commit()
+
+    engine.dispose()
+
+    return len(enrichments)
+
+
+def calculate_enrichment(engine, all_species_db, processes=1, empty=True):
     """
-    Static method to calculate the enrichment for all cluster in the database
+    Calculates the GO enrichment for all clusters in the database, species by species
 
+    :param engine: SQLAlchemy engine
+    :param all_species_db: list of species
+    :param processes: number of species to process in parallel
     :param empty: empty table cluster_go_enrichment first
     """
 
@@ -117,13 +126,21 @@ def calculate_enrichment(engine, all_species_db, all_network_methods_db, all_clu
             conn.execute(stmt)
             conn.commit()
 
-    # Getting all clusters from the database
-    with engine.connect() as conn:
-        stmt = select(CoexpressionCluster)
-        clusters = conn.execute(stmt).all()
-
-    for i, cluster in enumerate(clusters):
-        __calculate_enrichment(engine, cluster, all_species_db, all_network_methods_db, all_clustering_methods_db, go_species_counts_dict)
+    species = []
+    for s in all_species_db:
+        if not s.sequence_count:
+            print("No sequence count for species", s.code, "update the counts first. Skipping...")
+            continue
+        species.append((s.id, s.sequence_count))
+
+    if processes > 1:
+        with Pool(processes) as pool:
+            for (species_id, _), added in zip(species, pool.imap(calculate_species_enrichment, species)):
+                print("Added", added, "GO enrichment rows for species", species_id)
+    else:
+        for s in species:
+            added = calculate_species_enrichment(s)
+            print("Added", added, "GO enrichment rows for species", s[0])
 
 db_admin = args.db_admin
 db_name = args.db_name
@@ -146,44 +163,11 @@ CoexpressionClusteringMethod = Base.classes.coexpression_clustering_methods
 CoexpressionCluster = Base.classes.coexpression_clusters
 SequenceCoexpressionClusterAssociation = Base.classes.sequence_coexpression_cluster
 SequenceGOAssociation = Base.classes.sequence_go
-GO = Base.classes.go
 
 # Getting all species from the database
 with engine.connect() as conn:
     stmt = select(Species)
     all_species_db = conn.execute(stmt).all()
 
-# Building dictionary with associations between species IDs and GO counts
-go_species_counts_dict = {}
-
-with engine.connect() as conn:
-    stmt = select(GO.__table__.c.id,
-                  GO.__table__.c.species_counts)
-    all_gos = conn.execute(stmt).all()
-
-for go in all_gos:
-    go_species_counts_dict[go.id] = {}
-    for sp in all_species_db:
-        if go.species_counts:
-            print(go.id, sp.id, json.loads(go.species_counts))
-            if str(sp.id) in json.loads(go.species_counts).keys():
-                go_species_counts_dict[go.id][sp.id] = json.loads(go.species_counts)[str(sp.id)]
-
-# Getting all co-expression network methods from the database
-with engine.connect() as conn:
-    stmt = select(ExpressionNetworkMethod)
-    all_network_methods_db = conn.execute(stmt).all()
-
-# Getting all co-expression clustering methods from the database
-with engine.connect() as conn:
-    stmt = select(CoexpressionClusteringMethod)
-    all_clustering_methods_db = conn.execute(stmt).all()
-
-# Create a Session
-Session = sessionmaker(bind=engine)
-session = Session()
-
 # Run the function to compute GO enrichment for all clusters
-calculate_enrichment(engine, all_species_db, all_network_methods_db, all_clustering_methods_db, go_species_counts_dict)
-
-session.close()
\ No newline at end of file
+calculate_enrichment(engine, all_species_db, processes=args.processes)
@@ -2,11 +2,11 @@
 
 import argparse
 
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, func, literal
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy.orm import sessionmaker
 
-from sqlalchemy.sql import select, update
+from sqlalchemy.sql import delete, insert, select, update
 
 # Create arguments
 parser = argparse.ArgumentParser(description='Update all counts in the CoNekT Grasses database')
@@ -112,6 +112,45 @@ def update_species_counts(engine):
             conn.execute(stmt)
             conn.commit()
 
+
+def update_annotation_species_counts(engine, species_id=None):
+    """
+    Counts for each GO term, InterPro domain, CAZYme and gene family the number of associated sequences per species,
+    using one GROUP BY query per type of annotation. Predicted GO labels are excluded.
+
+    :param engine: SQLAlchemy engine
+    :param species_id: only recount the annotation of this species (default: all species)
+    """
+    associations = {
+        'go': (SequenceGOAssociation.__table__, SequenceGOAssociation.__table__.c.go_id,
+               [SequenceGOAssociation.__table__.c.predicted == 0]),
+        'interpro': (SequenceInterproAssociation.__table__, SequenceInterproAssociation.__table__.c.interpro_id, []),
+        'cazyme': (SequenceCAZYmeAssociation.__table__, SequenceCAZYmeAssociation.__table__.c.cazyme_id, []),
+        'family': (SequenceFamilyAssociation.__table__, SequenceFamilyAssociation.__table__.c.gene_family_id, [])
+    }
+
+    for annotation_type, (association, annotation_id, filters) in associations.items():
+        stmt = select(literal(annotation_type),
+                      annotation_id,
+                      Sequence.__table__.c.species_id,
+                      func.count(association.c.sequence_id.distinct())).\
+            join(Sequence.__table__, Sequence.__table__.c.id == association.c.sequence_id).\
+            where(*filters)
+        clear = delete(SpeciesAnnotationCount).\
+            where(SpeciesAnnotationCount.__table__.c.annotation_type == annotation_type)
+
+        if species_id is not None:
+            stmt = stmt.where(Sequence.__table__.c.species_id == species_id)
+            clear = clear.where(SpeciesAnnotationCount.__table__.c.species_id == species_id)
+
+        stmt = stmt.group_by(annotation_id, Sequence.__table__.c.species_id)
+
+        with engine.connect() as conn:
+            conn.execute(clear)
+            conn.execute(insert(SpeciesAnnotationCount).from_select(
+                ['annotation_type', 'annotation_id', 'species_id', 'count'], stmt))
+            conn.commit()
+
 def update_counts(engine):
     """
     Updates pre-computed counts in the database.
@@ -122,7 +161,7 @@ def update_counts(engine):
     update_network_count(engine)
     update_gene_family_count(engine)
     update_species_counts(engine)
-    #TODO: implement GO.update_species_counts()
+    update_annotation_species_counts(engine)
 
 db_admin = args.db_admin
 db_name = args.db_name
@@ -147,6 +186,11 @@ GeneFamily = Base.classes.gene_families
 GeneFamilyMethod = Base.classes.gene_family_methods
 Species = Base.classes.species
 GO = Base.classes.go
+SequenceGOAssociation = Base.classes.sequence_go
+SequenceInterproAssociation = Base.classes.sequence_interpro
+SequenceCAZYmeAssociation = Base.classes.sequence_cazyme
+SequenceFamilyAssociation = Base.classes.sequence_family
+SpeciesAnnotationCount = Base.classes.species_annotation_counts
 
 # Create a Session
 Session = sessionmaker(bind=engine)
@@ -217,3 +217,60 @@ class BuildTest(TestCase):
         self.assertEqual(
             len(test_family.sequences.all()), 2
         )  # Check if gene family contains 2 genes
+
+    def test_go_without_closure(self):
+        from conekt.models.go import GO
+        from conekt.models.sequences import Sequence
+        from conekt.models.species import Species
+        from conekt.models.relationships.go_closure import GOClosure
+        from conekt.models.relationships.sequence_go import SequenceGOAssociation
+
+        s = Species.query.first()
+
+        # databases created before the go_closure table existed get it empty, the closure should be rebuilt, without
+        # is_a relationships the extended_go field should be used
+        for clear_is_a in [False, True]:
+            GOClosure.query.delete()
+            SequenceGOAssociation.query.delete()
+            if clear_is_a:
+                GO.query.update({GO.is_a: None})
+            db.session.commit()
+
+            GO.add_go_from_tab(
+                "./tests/data/functional_data/test.go.txt",
+                s.id,
+                source="Fake UnitTest Data",
+            )
+
+            test_sequence = Sequence.query.filter_by(name="Gene01", type='protein_coding').first()
+            extended = test_sequence.go_associations.filter_by(source="Extended").all()
+
+            self.assertEqual(
+                [a.go.label for a in extended], ["GO:0000001"]
+            )  # Check if the parental term is added
+
+    def test_update_from_fasta(self):
+        from conekt.models.sequences import Sequence
+        from conekt.models.species import Species
+
+        import gzip
+        import os
+        import tempfile
+
+        s = Species.query.first()
+        Sequence.pack_sequences(species_id=s.id)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'update.fasta.gz')
+            with gzip.open(filename, 'wt') as f:
+                f.write('>Gene03 new release\nATGAAA\nTAG\n>Unknown\nATG\n>Gene01\nATGCCC\n')
+
+            updated, missing = Sequence.update_from_fasta(filename, s.id)
+
+        sequences = {name: coding_sequence for name, coding_sequence in
+                     Sequence.stream_sequences(species_id=s.id, sequence_type='protein_coding')}
+
+        self.assertEqual(sequences['Gene01'], 'ATGCCC')  # Check if sequences are replaced (and packed again)
+        self.assertEqual(sequences['Gene03'], 'ATGAAATAG')
+        self.assertEqual(updated, 2)
+        self.assertEqual(missing, 1)  # Gene02 isn't in the file
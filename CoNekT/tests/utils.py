@@ -1,12 +1,24 @@
 from utils.tau import tau
 from utils.entropy import entropy, entropy_from_values
-from utils.jaccard import jaccard
+from utils.jaccard import jaccard, jaccard_null_distribution, empirical_p_value
 from utils.sequence import translate
-from utils.enrichment import hypergeo_cdf, hypergeo_sf, fdr_correction
-from utils.expression import max_spm
+from utils.enrichment import hypergeo_cdf, hypergeo_sf, hypergeo_sf_many, fdr_correction, network_go_enrichment
+from utils.expression import max_spm, eigengene
+from utils.prefix_index import PrefixIndex
+from utils.postings import to_bitmap, from_bitmap, intersect, union
+from utils.trigram_index import TrigramIndex, normalize_name
+from utils.parser.fasta import Fasta, FastaIndex, is_bgzipped
+from utils.sequence_packing import pack, unpack
 
+from mpmath import binomial
 from unittest import TestCase
 
+import gzip
+import os
+import struct
+import tempfile
+import zlib
+
 
 class UtilsTest(TestCase):
     def test_tau(self):
@@ -25,6 +37,31 @@ class UtilsTest(TestCase):
         self.assertAlmostEqual(hypergeo_sf(2, 6, 10, 100), 0.109, places=3)
 
         self.assertEqual(fdr_correction([0.05, 0.06, 0.07]), [0.07, 0.07, 0.07])
+        for corrected, expected in zip(fdr_correction([0.01, 0.04, 0.03, 0.2]), [0.04, 0.053, 0.053, 0.2]):
+            self.assertAlmostEqual(corrected, expected, places=3)
+        self.assertEqual(fdr_correction([]), [])
+
+        # exact tail compared to a high precision evaluation of the pmf
+        reference = sum(
+            binomial(300, i) * binomial(20000 - 300, 150 - i) / binomial(20000, 150)
+            for i in range(12, 151)
+        )
+        self.assertAlmostEqual(hypergeo_sf(12, 150, 300, 20000) / float(reference), 1, places=9)
+
+        tests = [(2, 3, 10, 100), (2, 6, 10, 100), (2, 3, 10, 100), (0, 5, 10, 100), (5, 5, 5, 5)]
+        self.assertEqual(hypergeo_sf_many(tests), [hypergeo_sf(*t) for t in tests])
+        self.assertEqual(hypergeo_sf_many([]), [])
+        self.assertAlmostEqual(hypergeo_sf(0, 5, 10, 100), 1, places=12)
+
+        # gene 1 has neighbors 2-4 that all share GO term 10, term 11 is already assigned to gene 1
+        predictions = network_go_enrichment(([(1, [2, 3, 4]), (5, [])],
+                                             {1: {11}},
+                                             {2: {10, 11}, 3: {10}, 4: {10, 12}},
+                                             {10: 5, 11: 20, 12: 50},
+                                             100,
+                                             0.05))
+        self.assertEqual([(p[0], p[1]) for p in predictions], [(1, 10)])
+        self.assertAlmostEqual(predictions[0][2], hypergeo_sf(3, 3, 5, 100), places=12)
 
     def test_entropy(self):
         self.assertEqual(entropy([1, 0, 0, 0, 0, 0]), 0)
@@ -46,11 +83,129 @@ class UtilsTest(TestCase):
         )
         self.assertEqual(max_spm({}, substract_background=False), None)
 
+        values, explained = eigengene([[1, 2, 3], [2, 4, 6], [3, 2, 1.5]])
+        self.assertEqual(len(values), 3)
+        self.assertTrue(values[0] < values[1] < values[2])  # follows the majority of the profiles
+        self.assertAlmostEqual(sum(values), 0)
+        self.assertAlmostEqual(sum([v**2 for v in values])/3, 1)
+        self.assertTrue(0 < explained <= 1)
+
+        values, explained = eigengene([[1, 2, 3], [2, 4, 6]])
+        self.assertAlmostEqual(explained, 1)  # identical after scaling
+        self.assertEqual(eigengene([[1, 1, 1]]), ([0, 0, 0], 0))
+        self.assertEqual(eigengene([]), ([], 0))
+
     def test_jaccard(self):
         self.assertEqual(jaccard("ab", "bc"), 1 / 3)
         self.assertEqual(jaccard("ab", "cd"), 0)
         self.assertEqual(jaccard("ab", "ab"), 1)
 
+        # with a single label every pair of sets is identical
+        self.assertEqual(jaccard_null_distribution(["a"] * 10, 3, 4, permutations=5), [1, 1, 1, 1, 1])
+        # with unique labels sets never overlap
+        self.assertEqual(jaccard_null_distribution(list(range(10)), 3, 4, permutations=5), [0, 0, 0, 0, 0])
+
+        self.assertEqual(empirical_p_value([0, 0, 0.5, 1], 0.5), 3 / 5)
+        self.assertEqual(empirical_p_value([0, 0, 0.5, 1], 2), 1 / 5)
+
+    def test_prefix_index(self):
+        entries = [(['Heat', 'shock', 'protein', 'heat shock protein'], 3, 'long'),
+                   (['Heat', 'stable'], 2, 'medium'),
+                   (['heat', 'Hsp70'], 1, 'short'),
+                   (['kinase'], 0, 'other')]
+
+        index = PrefixIndex(entries, max_results=2, precompute_length=2, cache_threshold=0)
+
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index.complete('h'), ['short', 'medium'])
+        self.assertEqual(index.complete('HEA', limit=1), ['short'])
+        self.assertEqual(index.complete('heat sh'), ['long'])
+        self.assertEqual(index.complete('hsp'), ['short'])
+        self.assertEqual(index.complete('sta'), ['medium'])
+        self.assertEqual(index.complete('x'), [])
+        self.assertEqual(index.complete(''), [])
+
+    def test_postings(self):
+        self.assertEqual(from_bitmap(to_bitmap([0, 7, 8, 1000])), [0, 7, 8, 1000])
+        self.assertEqual(to_bitmap([]), 0)
+        self.assertEqual(from_bitmap(0), [])
+
+        self.assertEqual(intersect([[1, 3, 5, 7], [3, 4, 5], [0, 5, 3]]), [3, 5])
+        self.assertEqual(intersect([[2, 500], list(range(0, 10000, 2))]), [2, 500])
+        self.assertEqual(intersect([[1, 2], []]), [])
+        self.assertEqual(intersect([]), [])
+
+        self.assertEqual(union([[5, 1], [2, 5], []]), [1, 2, 5])
+
+    def test_trigram_index(self):
+        self.assertEqual(normalize_name('AT1G01010.1'), 'at1g01010')
+        self.assertEqual(normalize_name('Zm00001d000001_T001'), 'zm00001d000001')
+        self.assertEqual(normalize_name('Sobic.001G000100.v3.1'), 'sobic.001g000100')
+        self.assertEqual(normalize_name('CG1234-RA'), 'cg1234')
+        self.assertEqual(normalize_name('gene01'), 'gene01')
+
+        index = TrigramIndex([('AT1G01010', 1), ('At1g01010.2', 1), ('AT1G01020', 2), ('Gene01', 3)])
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.exact('at1g01010.1'), [1])
+        self.assertEqual(index.exact('AT1G01030'), [])
+
+        self.assertEqual(index.search('AT1G01010.4', limit=1), [(1.0, 'at1g01010', 1)])
+        self.assertEqual([item for _, _, item in index.search('AT1G0101O')], [1, 2])
+        self.assertEqual([item for _, _, item in index.search('gene1')], [3])
+        self.assertEqual(index.search('xyz'), [])
+
+        # names shared by multiple items, candidates are taken from the rarest trigrams of the query
+        index = TrigramIndex([('Gene%03d' % i, i) for i in range(500)] + [('gene042.1', 'alias')])
+
+        self.assertEqual(index.exact('GENE042'), [42, 'alias'])
+        self.assertEqual(index.search('Gene042', limit=2, max_candidates=5), [(1.0, 'gene042', 42),
+                                                                              (1.0, 'gene042', 'alias')])
+
+    def test_fasta(self):
+        sequences = [('Gene01', 'ATG' * 30), ('Gene02', ''), ('Gene03', 'ACGT' * 41)]
+        data = ''.join('>%s description\n%s' % (n, ''.join(s[i:i + 60] + '\n' for i in range(0, len(s), 60)))
+                       for n, s in sequences).encode()
+
+        # bgzip file with blocks of 100 bytes followed by the empty end-of-file block
+        bgzipped = b''
+        for i in range(0, len(data), 100):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+            block = compressor.compress(data[i:i + 100]) + compressor.flush()
+            bgzipped += struct.pack('<4BI2BH2B2H', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(block) + 25) + block + \
+                struct.pack('<2I', zlib.crc32(data[i:i + 100]), len(data[i:i + 100]))
+        bgzipped += bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+        with tempfile.TemporaryDirectory() as directory:
+            for filename, content in [('test.fasta', data), ('test.fasta.gz', gzip.compress(data)),
+                                      ('test.fasta.bgz', bgzipped)]:
+                filename = os.path.join(directory, filename)
+                with open(filename, 'wb') as f:
+                    f.write(content)
+
+                self.assertEqual([(n.split()[0], s) for n, s in Fasta.iterate(filename)], sequences)
+                self.assertEqual(is_bgzipped(filename), filename.endswith('.bgz'))
+
+                # the second time the index is read from disk
+                for _ in range(2):
+                    with FastaIndex(filename) as index:
+                        self.assertEqual(len(index), 3)
+                        self.assertEqual(list(index.iterate()), sequences)
+                        self.assertEqual(index['Gene03'], sequences[2][1])
+                        self.assertEqual(index.fetch('Gene03', 58, 63), sequences[2][1][58:63])
+                        self.assertEqual(index.fetch('Gene01', 0, 3), 'ATG')
+                        self.assertEqual(index.length('Gene02'), 0)
+
+                self.assertTrue(os.path.exists(filename + '.fai'))
+
+    def test_sequence_packing(self):
+        for sequence in ['', 'A', 'ACGTACG', 'ATG' * 100 + 'NNNNN' + 'ACGT' * 50 + 'R', 'acgtNNNN', 'MSELLQLPPGFRFH*']:
+            self.assertEqual(unpack(pack(sequence)), sequence)
+
+        # two bits per nucleotide, plus the header and the exceptions
+        self.assertEqual(len(pack('ACGT' * 250)), 259)
+        self.assertEqual(len(pack('ACGT' * 250 + 'N' * 100)), 293)
+
     def test_sequence(self):
         sequence = "ATGTCAGAATTATTACAGTTGCCTCCAGGTTTCCGATTTCACCCTACCGATGAAGAGCTTGTCATGCACTATCTCTGCCGCAAATGTGCCTCTCAGTCCATCGCCGTTCCGATCATCGCTGAGATCGATCTCTACAAATACGATCCATGGGAGCTTCCTGGTTTAGCCTTGTATGGTGAGAAGGAATGGTACTTCTTCTCTCCCAGGGACAGAAAATATCCCAACGGTTCGCGTCCTAACCGGTCCGCTGGTTCTGGTTACTGGAAAGCTACCGGAGCTGATAAACCGATCGGACTACCTAAACCGGTCGGAATTAAGAAAGCTCTTGTTTTCTACGCCGGCAAAGCTCCAAAGGGAGAGAAAACCAATTGGATCATGCACGAGTACCGTCTCGCCGACGTTGACCGGTCCGTTCGCAAGAAGAAGAATAGTCTCAGGCTGGATGATTGGGTTCTCTGCCGGATTTACAACAAAAAAGGAGCTACCGAGAGGCGGGGACCACCGCCTCCGGTTGTTTACGGCGACGAAATCATGGAGGAGAAGCCGAAGGTGACGGAGATGGTTATGCCTCCGCCGCCGCAACAGACAAGTGAGTTCGCGTATTTCGACACGTCGGATTCGGTGCCGAAGCTGCATACTACGGATTCGAGTTGCTCGGAGCAGGTGGTGTCGCCGGAGTTCACGAGCGAGGTTCAGAGCGAGCCCAAGTGGAAAGATTGGTCGGCCGTAAGTAATGACAATAACAATACCCTTGATTTTGGGTTTAATTACATTGATGCCACCGTGGATAACGCGTTTGGAGGAGGAGGGAGTAGTAATCAGATGTTTCCGCTACAGGATATGTTCATGTACATGCAGAAGCCTTACTAG"
         translation = "MSELLQLPPGFRFHPTDEELVMHYLCRKCASQSIAVPIIAEIDLYKYDPWELPGLALYGEKEWYFFSPRDRKYPNGSRPNRSAGSGYWKATGADKPIGLPKPVGIKKALVFYAGKAPKGEKTNWIMHEYRLADVDRSVRKKKNSLRLDDWVLCRIYNKKGATERRGPPPPVVYGDEIMEEKPKVTEMVMPPPPQQTSEFAYFDTSDSVPKLHTTDSSCSEQVVSPEFTSEVQSEPKWKDWSAVSNDNNNTLDFGFNYIDATVDNAFGGGGSSNQMFPLQDMFMYMQKPY*"
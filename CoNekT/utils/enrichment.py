@@ -1,16 +1,29 @@
-from math import log, exp
-from mpmath import loggamma
+from math import exp, lgamma, log2
+from collections import defaultdict
+
+# Table with log(i!) for i = 0 .. len - 1, grown on demand and shared by all calls
+_log_factorials = [0.0]
+
+
+def log_factorials(n):
+    """
+    Returns the cached table with log(i!) making sure it covers at least 0 .. n
+
+    :param n: largest value required
+    :return: list with log factorials
+    """
+    if n >= len(_log_factorials):
+        _log_factorials.extend([lgamma(i + 1) for i in range(len(_log_factorials), n + 1)])
+
+    return _log_factorials
 
 
 def logchoose(ni, ki):
-    try:
-        lgn1 = loggamma(ni+1)
-        lgk1 = loggamma(ki+1)
-        lgnk1 = loggamma(ni-ki+1)
-    except ValueError:
-        #print ni,ki
+    if ki < 0 or ki > ni:
         raise ValueError
-    return lgn1 - (lgnk1 + lgk1)
+    lf = log_factorials(ni)
+
+    return lf[ni] - (lf[ni - ki] + lf[ki])
 
 
 def gauss_hypergeom(X, n, m, N):
@@ -29,6 +42,48 @@ def gauss_hypergeom(X, n, m, N):
     return exp(r1 + r2 - r3)
 
 
+def __hypergeo_terms(start, stop, n, m, N):
+    """
+    Sums the hypergeometric probabilities for start .. stop (inclusive) using the log factorial table. Terms beyond the
+    mode decrease monotonically, once they no longer change the sum the loop stops early.
+
+    :return: sum of probabilities
+    """
+    lf = log_factorials(N)
+    offset = lf[m] + lf[N-m] + lf[n] + lf[N-n] - lf[N]
+    mode = ((n + 1) * (m + 1)) // (N + 2)
+
+    s = 0.0
+    for i in range(start, stop + 1):
+        term = exp(offset - lf[i] - lf[m-i] - lf[n-i] - lf[N-m-n+i])
+        s += term
+        if i > mode and term < s * 1e-17:
+            break
+
+    return s
+
+
+def __hypergeo_terms_reverse(start, stop, n, m, N):
+    """
+    Sums the hypergeometric probabilities for stop .. start (descending), stops early once terms below the mode no
+    longer change the sum.
+
+    :return: sum of probabilities
+    """
+    lf = log_factorials(N)
+    offset = lf[m] + lf[N-m] + lf[n] + lf[N-n] - lf[N]
+    mode = ((n + 1) * (m + 1)) // (N + 2)
+
+    s = 0.0
+    for i in range(stop, start - 1, -1):
+        term = exp(offset - lf[i] - lf[m-i] - lf[n-i] - lf[N-m-n+i])
+        s += term
+        if i < mode and term < s * 1e-17:
+            break
+
+    return s
+
+
 def hypergeo_cdf(X, n, m, N):
     """
     Returns the cummulative distribution function of drawing X successes of m marked items
@@ -46,9 +101,9 @@ def hypergeo_cdf(X, n, m, N):
     assert N >= n, 'Number of draws %i must be smaller than the total number of items %i' % (n, N)
     assert N-m >= n-X, 'There are more failures %i than unmarked items %i' % (N-m, n-X)
 
-    s = 0
-    for i in range(0, X+1):
-        s += max(gauss_hypergeom(i, n, m, N), 0.0)
+    # values below n - (N - m) are impossible and contribute nothing
+    s = __hypergeo_terms_reverse(max(0, n - (N - m)), X, n, m, N)
+
     return min(max(s, 0.0), 1)
 
 
@@ -69,12 +124,35 @@ def hypergeo_sf(X, n, m, N):
     assert N >= n, 'Number of draws %i must be smaller than the total number of items %i' % (n, N)
     assert N-m >= n-X, 'There are more failures %i than unmarked items %i' % (N-m, n-X)
 
-    s = 0
-    for i in range(X, min(m, n)+1):
-        s += max(gauss_hypergeom(i, n, m, N), 0.0)
+    s = __hypergeo_terms(X, min(m, n), n, m, N)
+
     return min(max(s, 0.0), 1)
 
 
+def hypergeo_sf_many(tests):
+    """
+    Returns the significance for many tests at once. The log factorial table is extended once for the largest
+    population and identical tests are only computed once, which is typical when scoring many clusters against the
+    same background.
+
+    :param tests: list of tuples (X, n, m, N), see hypergeo_sf
+    :return: list of p-values in the same order as the tests
+    """
+    if len(tests) == 0:
+        return []
+
+    log_factorials(max(t[3] for t in tests))
+
+    cache = {}
+    output = []
+    for t in tests:
+        if t not in cache:
+            cache[t] = hypergeo_sf(*t)
+        output.append(cache[t])
+
+    return output
+
+
 def rank_simple(vector):
     return sorted(range(len(vector)), key=vector.__getitem__)
 
@@ -116,17 +194,105 @@ def rankdata(a, method='average'):
 
 def fdr_correction(a):
     """
-    applies fdr correction to a list of p-values
+    applies fdr correction (Benjamini-Hochberg) to a list of p-values. Going from the largest p-value down, each
+    adjusted value is p * n/rank, but never more than the adjusted value of the next larger p-value (or 1).
 
     :param a: list of p-values
-    :return: list with adjusted/corrected p-values
+    :return: list with adjusted/corrected p-values (in the same order as a)
+    """
+    n = len(a)
+    output = [None] * n
+
+    current = 1
+    for position, i in enumerate(sorted(range(n), key=lambda j: a[j], reverse=True)):
+        rank = n - position
+        current = min(current, a[i] * (n/rank))
+        output[i] = current
+
+    return output
+
+
+def cluster_go_enrichment(data):
+    """
+    Calculates the GO enrichment for all clusters of a single species in one pass. Overlaps between clusters and GO
+    terms are counted from sparse incidence dicts, the background is derived from the same annotation and p-values are
+    computed in batch.
+
+    :param data: tuple with cluster members (dict cluster_id -> set of sequence ids), GO annotation (dict
+                 sequence_id -> set of GO ids) and the number of genes in the species
+    :return: list of dicts with the enrichment for each pair of cluster and GO term that co-occur
+    """
+    cluster_members, sequence_go, gene_count = data
+
+    go_counts = defaultdict(lambda: 0)
+    for terms in sequence_go.values():
+        for go_id in terms:
+            go_counts[go_id] += 1
+
+    output = []
+
+    for cluster_id, members in cluster_members.items():
+        cluster_size = len(members)
+
+        cluster_counts = defaultdict(lambda: 0)
+        for sequence_id in members:
+            for go_id in sequence_go.get(sequence_id, []):
+                cluster_counts[go_id] += 1
+
+        p_values = hypergeo_sf_many([(count, cluster_size, go_counts[go_id], gene_count)
+                                     for go_id, count in cluster_counts.items()])
+
+        corrected_p_values = fdr_correction(p_values)
+
+        for (go_id, count), p_value, corrected_p_value in zip(cluster_counts.items(), p_values, corrected_p_values):
+            output.append({
+                'cluster_id': cluster_id,
+                'go_id': go_id,
+                'cluster_count': count,
+                'cluster_size': cluster_size,
+                'go_count': go_counts[go_id],
+                'go_size': gene_count,
+                'enrichment': log2((count/cluster_size)/(go_counts[go_id]/gene_count)),
+                'p_value': p_value,
+                'corrected_p_value': corrected_p_value
+            })
+
+    return output
+
+
+def network_go_enrichment(data):
+    """
+    Predicts GO terms for a batch of genes based on the annotation of their neighbors in a co-expression network. For
+    each gene, terms (it doesn't have yet) that are enriched in its neighborhood compared to the background are
+    returned.
+
+    :param data: tuple with the neighborhoods (list of tuples with a sequence id and a list of neighboring sequence ids),
+                 GO terms of the genes themselves (dict sequence_id -> set of GO ids), GO annotation of the neighbors
+                 (dict sequence_id -> set of GO ids), the background (dict GO id -> number of genes with the term), the
+                 number of genes in the network and the p-value cutoff
+    :return: list of tuples with sequence id, GO id, p-value and FDR corrected p-value for enriched terms
     """
-    ranks = rankdata(a, method='max')
+    neighborhoods, own_go, sequence_go, go_background, gene_count, cutoff = data
 
     output = []
 
-    for p, rank in zip(a, ranks):
-        corrected = p * (len(a)/rank)
-        output.append(corrected if corrected < max(a) else max(a))
+    for sequence_id, neighbors in neighborhoods:
+        own_terms = own_go.get(sequence_id, set())
+
+        go_counts = defaultdict(lambda: 0)
+        for neighbor_id in set(neighbors):
+            for go_id in sequence_go.get(neighbor_id, []):
+                if go_id not in own_terms:
+                    go_counts[go_id] += 1
+
+        p_values = hypergeo_sf_many([(count, len(neighbors), go_background.get(go_id, 0), gene_count)
+                                     for go_id, count in go_counts.items()])
+
+        enriched_go = [(go_id, p_value) for go_id, p_value in zip(go_counts.keys(), p_values) if p_value < cutoff]
+
+        corrected_p_values = fdr_correction([p_value for _, p_value in enriched_go])
+
+        for (go_id, p_value), corrected_p_value in zip(enriched_go, corrected_p_values):
+            output.append((sequence_id, go_id, p_value, corrected_p_value))
 
     return output
@@ -1,3 +1,5 @@
+from math import sqrt
+
 from utils.vector import dot_prod, norm
 
 
@@ -28,4 +30,64 @@ def max_spm(profile, substract_background=False):
     if len(spm_values) > 0:
         return spm_values[0]
     else:
-        return None
\ No newline at end of file
+        return None
+
+
+def eigengene(profiles, iterations=1000, tolerance=1e-10):
+    """
+    Calculates the eigengene (first principal component) of a set of expression profiles using power iteration. Each
+    profile is scaled to zero mean and unit variance first, profiles without variance are ignored. The eigengene is
+    scaled the same way and oriented to correlate positively with the average (scaled) profile.
+
+    :param profiles: list of profiles (lists with one value per condition, all in the same order)
+    :param iterations: maximum number of iterations
+    :param tolerance: stop when none of the values changes more than this between two iterations
+    :return: tuple with the eigengene (list with one value per condition) and the fraction of variance explained
+    """
+    if len(profiles) == 0:
+        return [], 0
+
+    conditions = len(profiles[0])
+
+    scaled = []
+    for p in profiles:
+        m = sum(p)/conditions
+        sd = sqrt(sum([(v - m)**2 for v in p])/conditions)
+        if sd > 0:
+            scaled.append([(v - m)/sd for v in p])
+
+    if len(scaled) == 0:
+        return [0]*conditions, 0
+
+    # covariance between conditions, conditions are few compared to genes
+    columns = list(zip(*scaled))
+    covariance = [[dot_prod(columns[i], columns[j]) for j in range(conditions)] for i in range(conditions)]
+    total_variance = sum([covariance[i][i] for i in range(conditions)])
+
+    average = [sum(c)/len(scaled) for c in columns]
+
+    vector = average if norm(average) > 0 else scaled[0]
+    length = norm(vector)
+    vector = [v/length for v in vector]
+
+    for _ in range(iterations):
+        new_vector = [dot_prod(row, vector) for row in covariance]
+        length = norm(new_vector)
+
+        if length == 0:
+            break
+
+        new_vector = [v/length for v in new_vector]
+        converged = max([abs(a - b) for a, b in zip(new_vector, vector)]) < tolerance
+        vector = new_vector
+
+        if converged:
+            break
+
+    explained = dot_prod(vector, [dot_prod(row, vector) for row in covariance])/total_variance
+
+    if dot_prod(vector, average) < 0:
+        vector = [-v for v in vector]
+
+    # vector has unit length and zero mean, scale to unit variance
+    return [v*sqrt(conditions) for v in vector], explained
@@ -1,3 +1,6 @@
+import random
+from bisect import bisect_left
+
 
 def jaccard(list_a, list_b):
     """
@@ -12,3 +15,40 @@ def jaccard(list_a, list_b):
 
     return intersection_count/union_count
 
+
+def jaccard_null_distribution(labels, size_a, size_b, permutations=1000, rng=random):
+    """
+    Samples the jaccard index between the labels of two random, non-overlapping sets of items. Drawing the items from
+    the pool of all labelled items corresponds to permuting the labels while keeping the set sizes fixed.
+
+    :param labels: list with the label of each item in the pool (labels can occur multiple times)
+    :param size_a: number of items in the first set
+    :param size_b: number of items in the second set
+    :param permutations: number of samples to draw
+    :param rng: random number generator to use (default: random module)
+    :return: sorted list with jaccard indexes
+    """
+    output = []
+
+    for _ in range(permutations):
+        sample = rng.sample(labels, size_a + size_b)
+        set_a, set_b = set(sample[:size_a]), set(sample[size_a:])
+
+        union_count = len(set_a | set_b)
+        output.append(len(set_a & set_b)/union_count if union_count > 0 else 0)
+
+    return sorted(output)
+
+
+def empirical_p_value(null_distribution, value):
+    """
+    Returns the fraction of samples in a (sorted) null distribution that is at least as large as the observed value,
+    using a pseudo-count to avoid p-values of zero.
+
+    :param null_distribution: sorted list with sampled values
+    :param value: observed value
+    :return: empirical p-value
+    """
+    larger_count = len(null_distribution) - bisect_left(null_distribution, value)
+
+    return (larger_count + 1)/(len(null_distribution) + 1)
@@ -1,5 +1,48 @@
 import sys
 import gzip
+import os
+import struct
+import zlib
+
+from bisect import bisect_right
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def is_gzipped(filename):
+    """
+    Checks if a file is compressed with gzip (or bgzip) based on the first bytes
+
+    :param filename: path to the file
+    :return: True if the file is gzipped
+    """
+    with open(filename, 'rb') as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def is_bgzipped(filename):
+    """
+    Checks if a file is compressed with bgzip (blocked gzip, as used by samtools/htslib), these can be accessed randomly
+
+    :param filename: path to the file
+    :return: True if the file is bgzipped
+    """
+    with open(filename, 'rb') as f:
+        header = f.read(18)
+
+    # gzip header with the FEXTRA flag and a BC subfield
+    return len(header) == 18 and header[:2] == GZIP_MAGIC and header[3] & 4 == 4 and header[12:14] == b'BC'
+
+
+def write_record(f, name, sequence):
+    """
+    Writes a single sequence to an open (text) file in fasta format
+
+    :param f: file handle
+    :param name: name of the sequence
+    :param sequence: sequence
+    """
+    f.write('>' + name + '\n' + sequence + '\n')
 
 
 class Fasta:
@@ -21,44 +64,51 @@ class Fasta:
 
         return output
 
-    def readfile(self, filename, compressed=False, verbose=False):
+    @staticmethod
+    def iterate(filename, compressed=None):
         """
-        Reads a fasta file to the dictionary
+        Reads a fasta file one sequence at the time, only the current sequence is kept in memory
 
         :param filename: file to read
-        :param compressed: set to true if reading form a gzipped file
-        :param verbose: set to true to get extra debug information printed to STDERR
+        :param compressed: set to true if reading from a gzipped (or bgzipped) file, detected automatically if None
+        :return: generator yielding tuples with the name (complete header) and the sequence
         """
-        if verbose:
-            print("Reading FASTA file:" + filename + "...", file=sys.stderr)
+        if compressed is None:
+            compressed = is_gzipped(filename)
 
-        # Initialize variables
-        name = ''
+        name = None
         sequence = []
-        count = 1
 
-        # open file
-        if compressed:
-            f = gzip.open(filename, 'rt')
-        else:
-            f = open(filename, 'r')
-
-        for line in f:
-            line = line.rstrip()
-            if line.startswith(">"):
-                # ignore if first
-                if not name == '':
-                    self.sequences[name] = ''.join(sequence)
-                    count += 1
-                name = line.lstrip('>')
-                sequence = []
-            else:
-                sequence.append(line)
+        with (gzip.open(filename, 'rt') if compressed else open(filename, 'r')) as f:
+            for line in f:
+                line = line.rstrip()
+                if line.startswith(">"):
+                    if name is not None:
+                        yield name, ''.join(sequence)
+                    name = line.lstrip('>')
+                    sequence = []
+                else:
+                    sequence.append(line)
 
-        # add last gene
-        self.sequences[name] = ''.join(sequence)
+        if name is not None:
+            yield name, ''.join(sequence)
+
+    def readfile(self, filename, compressed=None, verbose=False):
+        """
+        Reads a fasta file to the dictionary, use iterate or FastaIndex to avoid reading the whole file in memory
+
+        :param filename: file to read
+        :param compressed: set to true if reading from a gzipped file, detected automatically if None
+        :param verbose: set to true to get extra debug information printed to STDERR
+        """
+        if verbose:
+            print("Reading FASTA file:" + filename + "...", file=sys.stderr)
+
+        count = 0
+        for name, sequence in Fasta.iterate(filename, compressed=compressed):
+            self.sequences[name] = sequence
+            count += 1
 
-        f.close()
         if verbose:
             print("Done! (found ", count, " sequences)", file=sys.stderr)
 
@@ -70,5 +120,281 @@ class Fasta:
         """
         with open(filename, 'w') as f:
             for k, v in self.sequences.items():
-                print(">" + k, file=f)
-                print(v, file=f)
+                write_record(f, k, v)
+
+
+class FastaIndex:
+    """
+    Random access to sequences in a (plain, gzipped or bgzipped) fasta file using a faidx index (.fai, compatible with
+    samtools faidx). For each sequence the index contains the name (first word of the header), length, offset of the
+    first base (in the uncompressed file) and the number of bases and bytes per line.
+
+    The index is read from <filename>.fai if it is present and newer than the fasta file, otherwise it is built by
+    reading the file once and written next to it (if possible). For bgzipped files the position of the compressed
+    blocks is stored in <filename>.gzi (as by bgzip -i), plain gzipped files can only be read sequentially, fetching
+    sequences in file order is efficient, jumping back is not.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.names = []
+        self.entries = {}
+
+        self.bgzipped = is_bgzipped(filename)
+        self.gzipped = self.bgzipped or is_gzipped(filename)
+
+        if self.__is_fresh(filename + '.fai'):
+            self.__read_fai(filename + '.fai')
+        else:
+            self.__build()
+            self.__write(filename + '.fai', self.__write_fai)
+
+        self.blocks = None
+        if self.bgzipped:
+            if self.__is_fresh(filename + '.gzi'):
+                self.blocks = FastaIndex.__read_gzi(filename + '.gzi')
+            else:
+                self.blocks = FastaIndex.__scan_blocks(filename)
+                self.__write(filename + '.gzi', self.__write_gzi, mode='wb')
+
+            self.block_offsets = [u for _, u in self.blocks]
+            self.handle = open(filename, 'rb')
+        elif self.gzipped:
+            self.handle = gzip.open(filename, 'rb')
+        else:
+            self.handle = open(filename, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.entries.keys()
+
+    def __getitem__(self, name):
+        return self.fetch(name)
+
+    def close(self):
+        self.handle.close()
+
+    def length(self, name):
+        """
+        Length of a sequence
+
+        :param name: name of the sequence
+        :return: number of bases or residues
+        """
+        return self.entries[name][0]
+
+    def fetch(self, name, start=0, end=None):
+        """
+        Gets (a region of) a sequence
+
+        :param name: name of the sequence
+        :param start: start position (0-based)
+        :param end: end position (exclusive, default: end of the sequence)
+        :return: sequence
+        """
+        length, offset, line_bases, line_width = self.entries[name]
+
+        end = length if end is None else min(end, length)
+        start = max(0, start)
+
+        if start >= end:
+            return ''
+
+        def position(i):
+            return offset + (i // line_bases) * line_width + i % line_bases
+
+        first = position(start)
+        data = self.__read(first, position(end - 1) + 1 - first)
+
+        return data.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+    def iterate(self, names=None):
+        """
+        Reads sequences one at the time
+
+        :param names: names of the sequences to read (default: all in file order)
+        :return: generator yielding tuples with the name and sequence
+        """
+        for name in (self.names if names is None else names):
+            yield name, self.fetch(name)
+
+    def __read(self, offset, size):
+        """
+        Reads a number of bytes starting at an offset in the uncompressed file
+
+        :param offset: offset in the uncompressed file
+        :param size: number of bytes to read
+        :return: bytes
+        """
+        if not self.bgzipped:
+            self.handle.seek(offset)
+            return self.handle.read(size)
+
+        block = bisect_right(self.block_offsets, offset) - 1
+        skip = offset - self.block_offsets[block]
+
+        output = []
+        remaining = skip + size
+        while remaining > 0 and block < len(self.blocks):
+            data = self.__read_block(self.blocks[block][0])
+            output.append(data)
+            remaining -= len(data)
+            block += 1
+
+        return b''.join(output)[skip:skip + size]
+
+    def __read_block(self, compressed_offset):
+        """
+        Decompresses a single BGZF block
+
+        :param compressed_offset: offset of the block in the compressed file
+        :return: uncompressed data
+        """
+        self.handle.seek(compressed_offset)
+        header = self.handle.read(12)
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = self.handle.read(extra_length)
+
+        block_size = None
+        i = 0
+        while i < extra_length:
+            subfield, length = extra[i:i + 2], struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if subfield == b'BC':
+                block_size = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+            i += 4 + length
+
+        data = self.handle.read(block_size - 12 - extra_length - 8)
+
+        return zlib.decompress(data, -15)
+
+    def __build(self):
+        """
+        Builds the index by reading the (uncompressed) file once, lines of a sequence need to have the same length
+        (except the last one)
+        """
+        name = None
+        offset = 0
+        length, line_bases, line_width, sequence_offset = 0, 0, 0, 0
+        short_line = False
+
+        with (gzip.open(self.filename, 'rb') if self.gzipped else open(self.filename, 'rb')) as f:
+            for line in f:
+                if line.startswith(b'>'):
+                    if name is not None:
+                        self.__add(name, length, sequence_offset, line_bases, line_width)
+
+                    name = line[1:].decode('utf-8').split()[0] if len(line[1:].split()) > 0 else ''
+                    length, line_bases, line_width, sequence_offset = 0, 0, 0, offset + len(line)
+                    short_line = False
+                elif name is not None:
+                    bases = len(line.rstrip(b'\r\n'))
+
+                    if bases > 0:
+                        if line_bases == 0:
+                            line_bases, line_width = bases, len(line)
+                        elif short_line or bases > line_bases or (bases == line_bases and len(line) != line_width):
+                            raise ValueError("Different line length in sequence '%s' of %s" % (name, self.filename))
+
+                        short_line = bases < line_bases
+                        length += bases
+
+                offset += len(line)
+
+        if name is not None:
+            self.__add(name, length, sequence_offset, line_bases, line_width)
+
+    def __add(self, name, length, offset, line_bases, line_width):
+        if name in self.entries.keys():
+            raise ValueError("Duplicate sequence name '%s' in %s" % (name, self.filename))
+
+        # sequences without bases need a valid line length to compute positions
+        self.names.append(name)
+        self.entries[name] = (length, offset, max(line_bases, 1), max(line_width, 1))
+
+    def __is_fresh(self, index_filename):
+        return os.path.exists(index_filename) and os.path.getmtime(index_filename) >= os.path.getmtime(self.filename)
+
+    def __read_fai(self, filename):
+        with open(filename, 'r') as f:
+            for line in f:
+                name, length, offset, line_bases, line_width = line.rstrip('\n').split('\t')[:5]
+                self.names.append(name)
+                self.entries[name] = (int(length), int(offset), int(line_bases), int(line_width))
+
+    def __write_fai(self, f):
+        for name in self.names:
+            print('\t'.join([name] + [str(v) for v in self.entries[name]]), file=f)
+
+    def __write_gzi(self, f):
+        # same layout as htslib: number of entries, followed by (compressed, uncompressed) offsets except for block 0
+        f.write(struct.pack('<Q', len(self.blocks) - 1))
+        for compressed_offset, uncompressed_offset in self.blocks[1:]:
+            f.write(struct.pack('<QQ', compressed_offset, uncompressed_offset))
+
+    def __write(self, filename, writer, mode='w'):
+        """
+        Writes an index file, if the directory isn't writable the index is only kept in memory
+        """
+        try:
+            with open(filename, mode) as f:
+                writer(f)
+        except OSError as e:
+            print("Cannot write index %s: %s" % (filename, e), file=sys.stderr)
+
+    @staticmethod
+    def __read_gzi(filename):
+        with open(filename, 'rb') as f:
+            count = struct.unpack('<Q', f.read(8))[0]
+            blocks = [(0, 0)] + [struct.unpack('<QQ', f.read(16)) for _ in range(count)]
+
+        return blocks
+
+    @staticmethod
+    def __scan_blocks(filename):
+        """
+        Finds the offsets of all BGZF blocks, only the block headers and sizes are read
+
+        :param filename: bgzipped file
+        :return: list of tuples with the compressed and uncompressed offset of each block
+        """
+        blocks = []
+        compressed_offset, uncompressed_offset = 0, 0
+
+        with open(filename, 'rb') as f:
+            while True:
+                header = f.read(12)
+                if len(header) < 12:
+                    break
+
+                extra_length = struct.unpack('<H', header[10:12])[0]
+                extra = f.read(extra_length)
+
+                block_size = None
+                i = 0
+                while i < extra_length:
+                    subfield, length = extra[i:i + 2], struct.unpack('<H', extra[i + 2:i + 4])[0]
+                    if subfield == b'BC':
+                        block_size = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+                    i += 4 + length
+
+                if block_size is None:
+                    raise ValueError("%s is not a valid bgzipped file" % filename)
+
+                f.seek(compressed_offset + block_size - 4)
+                uncompressed_size = struct.unpack('<I', f.read(4))[0]
+
+                # the empty block at the end of the file is not needed
+                if uncompressed_size > 0:
+                    blocks.append((compressed_offset, uncompressed_offset))
+
+                compressed_offset += block_size
+                uncompressed_offset += uncompressed_size
+
+        return blocks if len(blocks) > 0 else [(0, 0)]
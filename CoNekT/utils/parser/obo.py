@@ -1,7 +1,6 @@
 """
 Parser class for obo files (ontology structure files).
 """
-from copy import deepcopy
 
 import gzip
 
@@ -16,9 +15,11 @@ class OboEntry:
         self.namespace = ''
         self.definition = ''
         self.is_a = []
+        self.relationship = {}
         self.synonym = []
         self.alt_id = []
         self.extended_go = []
+        self.ancestor_distance = {}
         self.is_obsolete = False
 
     def set_id(self, term_id):
@@ -36,9 +37,17 @@ class OboEntry:
     def set_extended_go(self, parents):
         self.extended_go = parents
 
+    def set_ancestor_distance(self, distances):
+        self.ancestor_distance = distances
+
     def add_is_a(self, label):
         self.is_a.append(label)
 
+    def add_relationship(self, relationship_type, label):
+        if relationship_type not in self.relationship.keys():
+            self.relationship[relationship_type] = []
+        self.relationship[relationship_type].append(label)
+
     def add_synonym(self, label):
         self.synonym.append(label)
 
@@ -63,6 +72,9 @@ class OboEntry:
         elif key == "is_a":
             parts = value.split()
             self.add_is_a(parts[0])
+        elif key == "relationship":
+            parts = value.split()
+            self.add_relationship(parts[0], parts[1])
         elif key == "synonym":
             self.add_synonym(value)
         elif key == "alt_id":
@@ -143,27 +155,71 @@ class Parser:
             if current_term:
                 self.terms.append(current_term)
 
-    def extend_go(self):
+    def extend_go(self, relationships=('is_a',)):
         """
-        Run this after loading the OBO file to fill the extended GO table (all parental terms of the label).
-        """
-        hashed_terms = {}
+        Run this after loading the OBO file to fill the extended GO table (all parental terms of the label) and the
+        distance to each ancestor (shortest path).
 
-        for term in self.terms:
-            hashed_terms[term.id] = term
+        Terms are numbered and the ancestors of each term are determined once, parents before children, by combining
+        the ancestors of its parents. Parents that are not defined in the file are included but not extended further.
 
-        for term in self.terms:
-            extended_go = deepcopy(term.is_a)
+        :param relationships: relationship types to follow, default only is_a (e.g. use ('is_a', 'part_of') to
+            include part_of relationships)
+        """
+        labels = [term.id for term in self.terms]
+        index = {label: i for i, label in enumerate(labels)}
 
-            found_new = True
+        parents = []
+        for term in self.terms:
+            term_parents = []
+            for relationship_type in relationships:
+                if relationship_type == 'is_a':
+                    term_parents += term.is_a
+                elif relationship_type in term.relationship.keys():
+                    term_parents += term.relationship[relationship_type]
+
+            parent_ids = []
+            for label in term_parents:
+                if label not in index.keys():
+                    index[label] = len(labels)
+                    labels.append(label)
+                parent_ids.append(index[label])
+
+            parents.append(parent_ids)
+
+        # parents not defined in the file
+        parents += [[] for _ in range(len(labels) - len(parents))]
+
+        ancestors = [None] * len(labels)
+        in_progress = [False] * len(labels)
+
+        for start in range(len(labels)):
+            stack = [start]
+            while stack:
+                node = stack[-1]
+                if ancestors[node] is not None:
+                    stack.pop()
+                    continue
 
-            while found_new:
-                found_new = False
-                for parent_term in extended_go:
-                    new_gos = hashed_terms[parent_term].is_a
-                    for new_go in new_gos:
-                        if new_go not in extended_go:
-                            found_new = True
-                            extended_go.append(new_go)
+                in_progress[node] = True
+                # parents that are in progress are part of a cycle, their ancestors can't be used
+                todo = [p for p in parents[node] if ancestors[p] is None and not in_progress[p]]
 
-            term.set_extended_go(extended_go)
+                if todo:
+                    stack += todo
+                else:
+                    node_ancestors = {p: 1 for p in parents[node]}
+                    for p in parents[node]:
+                        if ancestors[p] is not None:
+                            for a, distance in ancestors[p].items():
+                                if a not in node_ancestors.keys() or distance + 1 < node_ancestors[a]:
+                                    node_ancestors[a] = distance + 1
+                    node_ancestors.pop(node, None)
+
+                    ancestors[node] = node_ancestors
+                    in_progress[node] = False
+                    stack.pop()
+
+        for i, term in enumerate(self.terms):
+            term.set_extended_go([labels[a] for a in sorted(ancestors[i].keys())])
+            term.set_ancestor_distance({labels[a]: distance for a, distance in ancestors[i].items()})
@@ -0,0 +1,100 @@
+from bisect import bisect_left
+
+# positions of the bits set in each possible byte
+BYTE_BITS = [[bit for bit in range(8) if byte >> bit & 1] for byte in range(256)]
+
+
+def to_bitmap(ids):
+    """
+    Converts a list of (non-negative) integer IDs to a bitmap, stored as a Python integer where bit i is set if i is in
+    the list. Bitmaps can be combined with & (intersection) and | (union).
+
+    :param ids: iterable with IDs
+    :return: bitmap (int)
+    """
+    ids = list(ids)
+
+    if len(ids) == 0:
+        return 0
+
+    buffer = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buffer[i >> 3] |= 1 << (i & 7)
+
+    return int.from_bytes(buffer, 'little')
+
+
+def from_bitmap(bitmap):
+    """
+    Converts a bitmap (see to_bitmap) back to a sorted list of IDs
+
+    :param bitmap: bitmap (int)
+    :return: sorted list of IDs
+    """
+    output = []
+
+    buffer = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for position, byte in enumerate(buffer):
+        if byte:
+            offset = position * 8
+            output += [offset + bit for bit in BYTE_BITS[byte]]
+
+    return output
+
+
+def intersect(postings, ratio=32):
+    """
+    Intersects sorted lists of IDs, starting with the shortest list. Lists that are much longer than the current result
+    are searched using bisection, lists of similar length are combined as bitmaps.
+
+    :param postings: list of sorted lists of IDs
+    :param ratio: use bisection if a list is this many times longer than the current result
+    :return: sorted list of IDs present in all lists
+    """
+    if len(postings) == 0:
+        return []
+
+    postings = sorted(postings, key=len)
+    output = list(postings[0])
+    size = len(output)
+    bitmap = None
+
+    for posting in postings[1:]:
+        if size == 0:
+            break
+
+        if size * ratio < len(posting):
+            if bitmap is not None:
+                output = from_bitmap(bitmap)
+                bitmap = None
+
+            found = []
+            start = 0
+            for i in output:
+                start = bisect_left(posting, i, lo=start)
+                if start == len(posting):
+                    break
+                if posting[start] == i:
+                    found.append(i)
+            output = found
+            size = len(output)
+        else:
+            # the result is only converted back to a list when needed
+            bitmap = (to_bitmap(output) if bitmap is None else bitmap) & to_bitmap(posting)
+            size = bin(bitmap).count('1')
+
+    return output if bitmap is None else from_bitmap(bitmap)
+
+
+def union(postings):
+    """
+    Combines lists of IDs
+
+    :param postings: list of lists of IDs
+    :return: sorted list of IDs present in any of the lists
+    """
+    bitmap = 0
+    for posting in postings:
+        bitmap |= to_bitmap(posting)
+
+    return from_bitmap(bitmap)
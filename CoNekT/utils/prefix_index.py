@@ -0,0 +1,93 @@
+from bisect import bisect_left
+from heapq import nsmallest
+
+
+class PrefixIndex:
+    """
+    Sorted array of (lowercase) keys that allows to look up the best completions for a prefix. Each entry can be
+    found with multiple keys (e.g. all words in a description) and is ranked using a value provided when the index is
+    built (lower is better). For short prefixes, where the range of matching keys can be very long, the best
+    completions are precomputed, for other prefixes that match many keys they are cached after the first lookup.
+    """
+    def __init__(self, entries, max_results=50, precompute_length=2, cache_threshold=1000, cache_size=10000):
+        """
+        Builds the index
+
+        :param entries: iterable with tuples (keys, rank, item), keys is a list of strings the item can be found with
+        :param max_results: maximum number of completions that can be returned
+        :param precompute_length: completions for prefixes up to this length are precomputed
+        :param cache_threshold: completions for prefixes matching more keys than this are cached
+        :param cache_size: maximum number of cached prefixes
+        """
+        self.max_results = max_results
+        self.precompute_length = precompute_length
+        self.cache_threshold = cache_threshold
+        self.cache_size = cache_size
+
+        self.items = []
+        self.ranks = []
+
+        keys = []
+        for keys_for_item, rank, item in entries:
+            item_id = len(self.items)
+            self.items.append(item)
+            self.ranks.append(rank)
+            keys += [(k.lower(), item_id) for k in set(keys_for_item) if k]
+
+        keys.sort()
+        self.keys = [k for k, _ in keys]
+        self.key_items = [i for _, i in keys]
+
+        self.cache = {}
+
+        self.precomputed = {}
+        prefixes = set([k[:length] for k in self.keys for length in range(1, precompute_length + 1)])
+        for prefix in prefixes:
+            self.precomputed[prefix] = self.__best(prefix)
+
+        self.cache.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __best(self, prefix):
+        """
+        Finds the best ranked items with a key starting with the prefix (scans all matching keys), results for
+        prefixes matching many keys are cached
+
+        :param prefix: lowercase prefix
+        :return: list of (at most max_results) item positions, best first
+        """
+        if prefix in self.cache.keys():
+            return self.cache[prefix]
+
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + '\U0010ffff', lo=start)
+
+        item_ids = nsmallest(self.max_results, set(self.key_items[start:end]), key=lambda i: self.ranks[i])
+
+        if end - start > self.cache_threshold and len(self.cache) < self.cache_size:
+            self.cache[prefix] = item_ids
+
+        return item_ids
+
+    def complete(self, prefix, limit=10):
+        """
+        Returns the best ranked items with a key starting with the prefix (case insensitive)
+
+        :param prefix: prefix to complete
+        :param limit: maximum number of items to return (capped at max_results)
+        :return: list of items, best first
+        """
+        prefix = prefix.lower()
+        limit = min(limit, self.max_results)
+
+        if prefix == '':
+            return []
+
+        if len(prefix) <= self.precompute_length:
+            item_ids = self.precomputed.get(prefix, [])
+        else:
+            item_ids = self.__best(prefix)
+
+        return [self.items[i] for i in item_ids[:limit]]
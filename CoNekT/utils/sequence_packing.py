@@ -0,0 +1,78 @@
+import re
+import struct
+import zlib
+
+TWO_BIT = 0
+ZLIB = 1
+
+HEADER = struct.Struct('<BII')
+EXCEPTION = struct.Struct('<IIc')
+
+NUCLEOTIDES = 'ACGT'
+TO_DIGITS = str.maketrans(NUCLEOTIDES, '0123')
+
+# four nucleotides for each possible byte, the first nucleotide is stored in the highest bits
+BYTE_NUCLEOTIDES = [''.join(NUCLEOTIDES[byte >> shift & 3] for shift in (6, 4, 2, 0)) for byte in range(256)]
+
+# runs of the same character that can't be stored in two bits (N, IUPAC codes, lowercase, gaps, ...)
+EXCEPTION_PATTERN = re.compile(r'([^ACGT])\1*')
+
+
+def pack(sequence):
+    """
+    Packs a nucleotide sequence using two bits per nucleotide. Runs of other characters are stored separately (as
+    position, length and character), sequences with too many of those (e.g. protein sequences) are compressed with zlib
+    instead.
+
+    :param sequence: nucleotide sequence
+    :return: packed sequence (bytes)
+    """
+    exceptions = [(m.start(), m.end() - m.start(), m.group(1)) for m in EXCEPTION_PATTERN.finditer(sequence)]
+
+    # the exceptions shouldn't take more space than the packed nucleotides
+    if len(exceptions) * EXCEPTION.size > len(sequence) // 4 or any(ord(c) > 127 for _, _, c in exceptions):
+        return bytes([ZLIB]) + zlib.compress(sequence.encode('utf-8'))
+
+    if len(exceptions) > 0:
+        sequence = EXCEPTION_PATTERN.sub(lambda m: 'A' * len(m.group(0)), sequence)
+
+    digits = sequence.translate(TO_DIGITS)
+    digits += '0' * (-len(digits) % 4)
+
+    output = [HEADER.pack(TWO_BIT, len(sequence), len(exceptions))]
+    output += [EXCEPTION.pack(start, length, c.encode('ascii')) for start, length, c in exceptions]
+
+    if len(digits) > 0:
+        output.append(int(digits, 4).to_bytes(len(digits) // 4, 'big'))
+
+    return b''.join(output)
+
+
+def unpack(data):
+    """
+    Restores a sequence packed with pack
+
+    :param data: packed sequence (bytes)
+    :return: sequence
+    """
+    if data[0] == ZLIB:
+        return zlib.decompress(data[1:]).decode('utf-8')
+
+    _, length, exception_count = HEADER.unpack_from(data)
+    start = HEADER.size + exception_count * EXCEPTION.size
+
+    sequence = ''.join(map(BYTE_NUCLEOTIDES.__getitem__, data[start:]))[:length]
+
+    if exception_count == 0:
+        return sequence
+
+    output = []
+    position = 0
+    for i in range(exception_count):
+        exception_start, exception_length, c = EXCEPTION.unpack_from(data, HEADER.size + i * EXCEPTION.size)
+        output += [sequence[position:exception_start], c.decode('ascii') * exception_length]
+        position = exception_start + exception_length
+
+    output.append(sequence[position:])
+
+    return ''.join(output)
@@ -0,0 +1,169 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+import math
+import re
+
+# version suffixes (.1, .v2.1), transcript and protein tags (.t1, _T01, .p1, -RA, -PA) removed when normalizing names
+SUFFIX_PATTERN = re.compile(r'(\.v?\d+|[._-]t\d+|\.p\d+|-[rp][a-z])$')
+
+
+def normalize_name(name):
+    """
+    Normalizes a gene identifier, the name is converted to lowercase and version suffixes or transcript tags are
+    removed (e.g. AT1G01010.1 and At1g01010 become at1g01010)
+
+    :param name: gene identifier
+    :return: normalized identifier
+    """
+    name = name.strip().lower()
+
+    while True:
+        stripped = SUFFIX_PATTERN.sub('', name)
+        if stripped == name or stripped == '':
+            return name
+        name = stripped
+
+
+def trigrams(name):
+    """
+    Set of trigrams for a (normalized) name, padded with spaces so the start and end of the name weigh more
+
+    :param name: normalized name
+    :return: set of trigrams
+    """
+    padded = '  ' + name + ' '
+
+    return set([padded[i:i + 3] for i in range(len(padded) - 2)])
+
+
+class TrigramIndex:
+    """
+    Inverted index from trigrams to normalized names, used to find similar identifiers. The similarity between two
+    names is the number of shared trigrams divided by the number of distinct trigrams in both (Jaccard index).
+
+    Names are never compared one by one. Candidates are taken from the postings of the rarest trigrams of the query
+    (a name above the threshold has to contain at least one of those), so common trigrams (e.g. the species prefix
+    shared by all genes of a genome) are only used to score a limited number of candidates.
+    """
+    def __init__(self, entries):
+        """
+        Builds the index
+
+        :param entries: iterable with tuples (name, item), multiple names can refer to the same item
+        """
+        self.names = []
+        self.name_items = []
+        self.extra_items = {}
+        self.name_trigram_counts = array('H')
+
+        self.positions = {}
+        self.postings = defaultdict(lambda: array('I'))
+
+        for name, item in entries:
+            normalized = normalize_name(name)
+
+            if normalized == '':
+                continue
+
+            position = self.positions.get(normalized)
+
+            if position is None:
+                position = len(self.names)
+                self.positions[normalized] = position
+                self.names.append(normalized)
+                self.name_items.append(item)
+
+                name_trigrams = trigrams(normalized)
+                self.name_trigram_counts.append(min(len(name_trigrams), 65535))
+                for t in name_trigrams:
+                    self.postings[t].append(position)
+            elif item != self.name_items[position] and item not in self.extra_items.get(position, []):
+                # most names refer to a single item, only keep lists for the others
+                self.extra_items.setdefault(position, []).append(item)
+
+        self.postings = dict(self.postings)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self, position):
+        """
+        Items referred to by a name
+
+        :param position: position of the name in the index
+        :return: list of items
+        """
+        return [self.name_items[position]] + self.extra_items.get(position, [])
+
+    def exact(self, name):
+        """
+        Items with a name that is identical to the query after normalization
+
+        :param name: query
+        :return: list of items
+        """
+        position = self.positions.get(normalize_name(name))
+
+        return [] if position is None else self.items(position)
+
+    def search(self, name, limit=10, threshold=0.3, max_candidates=10000):
+        """
+        Finds items with names similar to the query
+
+        :param name: query
+        :param limit: maximum number of items to return
+        :param threshold: minimal similarity (0 - 1], names that are identical after normalization score 1
+        :param max_candidates: maximum number of postings scanned to find candidates, when even the rarest trigrams
+                               of the query are more common than that, similar names can be missed
+        :return: list of tuples (similarity, normalized name, item), best first
+        """
+        query_trigrams = sorted(trigrams(normalize_name(name)), key=lambda t: len(self.postings.get(t, [])))
+
+        # names with a similarity above the threshold share at least this many trigrams with the query, so at least
+        # one of the len(query_trigrams) - required + 1 rarest ones
+        required = max(1, math.ceil(threshold * len(query_trigrams) - 1e-9))
+
+        shared = Counter()
+        scanned = 0
+        used = 0
+        while used < len(query_trigrams) - required + 1 and scanned < max_candidates:
+            postings = self.postings.get(query_trigrams[used], [])
+            shared.update(postings[:max_candidates - scanned])
+            scanned += len(postings)
+            used += 1
+
+        # the other (common) trigrams only count for the candidates found, by a binary search in their postings,
+        # candidates are dropped as soon as they can't share enough trigrams anymore
+        candidates = list(shared.keys())
+        for remaining, t in zip(range(len(query_trigrams) - used - 1, -1, -1), query_trigrams[used:]):
+            postings = self.postings.get(t, [])
+            kept = []
+            for position in candidates:
+                i = bisect_left(postings, position)
+                if i < len(postings) and postings[i] == position:
+                    shared[position] += 1
+                if shared[position] + remaining >= required:
+                    kept.append(position)
+            candidates = kept
+
+        shared = {position: shared[position] for position in candidates}
+
+        scored = []
+        for position, count in shared.items():
+            if count >= required:
+                score = count / (len(query_trigrams) + self.name_trigram_counts[position] - count)
+                if score >= threshold:
+                    scored.append((score, self.names[position], position))
+
+        scored.sort(key=lambda s: (-s[0], len(s[1]), s[1]))
+
+        output = []
+        for score, n, position in scored:
+            output += [(score, n, item) for item in self.items(position)]
+
+            if len(output) >= limit:
+                break
+
+        return output[:limit]